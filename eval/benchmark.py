@@ -1,53 +1,30 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import csv
+import json
+import os
+import random
 import statistics
+import sys
 import time
-from typing import List
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import httpx
 
-from src.llm import LLMClient
+# 부하/지연 벤치마크
+# - load: 서버에 동시 요청(--concurrency) + 목표 요청률(--rate, 0이면 closed-loop) → 처리량, p50/p95/p99, 서버 단계별 시간
+# - stages: 프로세스 안에서 단계별 마이크로벤치(임베딩 단건/배치, 벡터 검색, 재랭킹, 컨텍스트 패킹, 생성)
+# - llm: 생성만(폴백 체인 포함) 모델별 비교
+# - --stub: eval/stub_ollama를 띄워 GPU/Ollama 없이 측정(stages/llm은 프로세스 내, load는 서버를 stub에 연결해 실행)
+# - --out으로 JSON 저장, --baseline과 비교해 --threshold 이상 나빠진 지표를 회귀로 표시(--fail-on-regression이면 종료 코드 1)
 
-
-def bench_e2e(question: str, models: List[str], runs: int, url: str) -> None:
-    print(f"[E2E] server={url} question='{question}' runs={runs}")
-    with httpx.Client(timeout=120.0) as client:
-        for model in models:
-            latencies: List[float] = []
-            # warmup 1
-            client.post(url, json={"question": question, "top_k": 3, "model": model})
-            for _ in range(runs):
-                t0 = time.perf_counter()
-                r = client.post(url, json={"question": question, "top_k": 3, "model": model})
-                r.raise_for_status()
-                _ = r.json()
-                latencies.append(time.perf_counter() - t0)
-            print_metrics(model, latencies)
-
-
-def bench_llm(question: str, models: List[str], runs: int) -> None:
-    print(f"[LLM-only] question='{question}' runs={runs}")
-    client = LLMClient("config.yaml")
-    for model in models:
-        latencies: List[float] = []
-        # warmup 1
-        client.generate(prompt=question, model_override=model)
-        for _ in range(runs):
-            t0 = time.perf_counter()
-            _ = client.generate(prompt=question, model_override=model)
-            latencies.append(time.perf_counter() - t0)
-        print_metrics(model, latencies)
+DEFAULT_QUESTION = "간단한 테스트 질문입니다. 답변을 1-2문장으로 해주세요."
 
 
-def print_metrics(model: str, latencies: List[float]) -> None:
-    avg = statistics.mean(latencies)
-    p50 = statistics.median(latencies)
-    p95 = percentile(latencies, 95)
-    print(f"- model={model} avg={avg:.2f}s p50={p50:.2f}s p95={p95:.2f}s runs={len(latencies)}")
-
-
-def percentile(data: List[float], p: int) -> float:
+def percentile(data: List[float], p: float) -> float:
     if not data:
         return 0.0
     data_sorted = sorted(data)
@@ -61,27 +38,345 @@ def percentile(data: List[float], p: int) -> float:
     return d0 + d1
 
 
+def summarize(values_ms: List[float]) -> Dict[str, float]:
+    if not values_ms:
+        return {"n": 0}
+    return {
+        "n": len(values_ms),
+        "mean_ms": statistics.mean(values_ms),
+        "p50_ms": percentile(values_ms, 50),
+        "p95_ms": percentile(values_ms, 95),
+        "p99_ms": percentile(values_ms, 99),
+        "max_ms": max(values_ms),
+    }
+
+
+def load_questions(path: Optional[str], question: Optional[str]) -> List[str]:
+    if question:
+        return [question]
+    if path and Path(path).exists():
+        p = Path(path)
+        if p.suffix.lower() == ".csv":
+            with p.open("r", encoding="utf-8") as f:
+                qs = [(row.get("question") or "").strip() for row in csv.DictReader(f)]
+        else:
+            qs = [line.strip() for line in p.read_text(encoding="utf-8").splitlines()]
+        qs = [q for q in qs if q]
+        if qs:
+            return qs
+    return [DEFAULT_QUESTION]
+
+
+def timed(fn, runs: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn(-1)
+    lat = []
+    for i in range(runs):
+        t0 = time.perf_counter()
+        fn(i)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+    return summarize(lat)
+
+
+# --- load ---
+async def _load(args: argparse.Namespace, questions: List[str]) -> Dict[str, Any]:
+    url = args.server.rstrip("/") + args.endpoint
+    total = args.requests
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    sem = asyncio.Semaphore(max(args.concurrency, 1))
+    rng = random.Random(args.seed)
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        q = questions[i % len(questions)]
+        if args.bust_cache:
+            q = f"{q} #{i}"  # 임베딩/답변 캐시를 피하려고 질문을 매번 다르게
+        body: Dict[str, Any] = {"question": q, "top_k": args.top_k, "include_timings": True}
+        if args.model:
+            body["model"] = args.model
+        if args.priority:
+            body["priority"] = args.priority
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(url, json=body)
+                r.raise_for_status()
+                data = r.json() if "stream" not in args.endpoint else {}
+            except Exception as e:
+                key = type(e).__name__
+                if isinstance(e, httpx.HTTPStatusError):
+                    key = f"http_{e.response.status_code}"
+                errors[key] = errors.get(key, 0) + 1
+                return
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            for k, v in (data.get("timings") or {}).items():
+                if k.endswith("_ms"):
+                    stages.setdefault(k, []).append(float(v))
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, 1) * 2)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for i in range(min(args.warmup, total)):
+            await one(client, -1 - i)
+        latencies.clear(); stages.clear(); errors.clear()
+        t0 = time.perf_counter()
+        tasks = []
+        next_at = t0
+        for i in range(total):
+            if args.rate > 0:
+                # open-loop: 포아송 도착(지수 분포 간격)으로 목표 요청률 유지
+                next_at += rng.expovariate(args.rate) if args.poisson else 1.0 / args.rate
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(client, i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t0
+
+    ok = len(latencies)
+    return {
+        "url": url,
+        "requests": total,
+        "ok": ok,
+        "errors": errors,
+        "error_rate": (total - ok) / max(total, 1),
+        "duration_s": elapsed,
+        "throughput_rps": ok / elapsed if elapsed > 0 else 0.0,
+        "latency": summarize(latencies),
+        "server_stages": {k: summarize(v) for k, v in sorted(stages.items())},
+    }
+
+
+def bench_load(args: argparse.Namespace, questions: List[str]) -> Dict[str, Any]:
+    rate = f"{args.rate}/s" if args.rate > 0 else "closed-loop"
+    print(f"[LOAD] {args.server}{args.endpoint} requests={args.requests} concurrency={args.concurrency} rate={rate}")
+    res = asyncio.run(_load(args, questions))
+    lat = res["latency"]
+    print(f"- ok={res['ok']}/{res['requests']} errors={res['errors']} throughput={res['throughput_rps']:.2f} req/s")
+    if lat.get("n"):
+        print(f"- latency p50={lat['p50_ms']:.0f}ms p95={lat['p95_ms']:.0f}ms p99={lat['p99_ms']:.0f}ms max={lat['max_ms']:.0f}ms")
+    for k, s in res["server_stages"].items():
+        print(f"  {k:<22} p50={s['p50_ms']:8.1f}ms p95={s['p95_ms']:8.1f}ms")
+    return res
+
+
+# --- stages ---
+def bench_stages(args: argparse.Namespace, questions: List[str]) -> Dict[str, Any]:
+    from src import llm
+    from src.context import pack_context
+    from src.retriever import Retriever
+
+    r = Retriever(args.config)
+    col = r.get_collection(args.collection) if args.collection else r.collection
+    name = args.collection or r.collection_name
+    n = max(args.runs, 1)
+    qs = [questions[i % len(questions)] for i in range(max(n, args.batch))]
+    print(f"[STAGES] collection={name} count={col.count()} runs={n} batch={args.batch}")
+    out: Dict[str, Any] = {}
+
+    # 캐시를 거치지 않도록 embedding_fn 직접 호출
+    out["embed_single"] = timed(lambda i: r.embedding_fn([qs[i % len(qs)]]), n)
+    out["embed_batch"] = timed(lambda i: r.embedding_fn(qs[: args.batch]), max(n // 4, 1))
+    out["embed_batch"]["per_query_ms"] = out["embed_batch"]["mean_ms"] / max(args.batch, 1)
+
+    vecs = [list(map(float, v)) for v in r.embedding_fn(qs[:n])]
+    k = r._n_results(args.top_k)
+    out["vector_search"] = timed(
+        lambda i: col.query(query_embeddings=[vecs[i % len(vecs)]], n_results=k,
+                            include=["documents", "metadatas", "distances"]), n)
+    if r.hybrid:
+        lex = r.get_lexical(name)
+        out["bm25_search"] = timed(lambda i: lex.search(qs[i % len(qs)], top_n=r.lexical_candidates), n)
+
+    res = col.query(query_embeddings=[vecs[0]], n_results=k, include=["documents"])
+    texts = [t for t in (res.get("documents") or [[]])[0] if t]
+    if r.use_reranker and r.reranker_model and texts:
+        # 예산 초과 폴백 없이 순수 재랭킹 시간만 측정
+        r.rerank_budget_ms = float("inf")
+        out["rerank"] = timed(lambda i: r._rerank_scores(qs[i % len(qs)], texts), n)
+        out["rerank"]["candidates"] = len(texts)
+
+    out["retrieve_e2e"] = timed(lambda i: r.query_detailed(qs[i % len(qs)] + (f" #{i}" if i >= 0 else ""), top_k=args.top_k,
+                                                           collection=args.collection), n)
+    hits = r.query(qs[0], top_k=args.top_k, collection=args.collection)
+    out["pack"] = timed(lambda i: pack_context(hits, llm.context_budget(qs[0], args.model), args.model), n)
+    if not args.skip_llm:
+        out["generate"] = _bench_generate(args, qs[0], hits, n)
+    return out
+
+
+def _bench_generate(args: argparse.Namespace, question: str, hits: List[Dict[str, Any]], runs: int) -> Dict[str, Any]:
+    from src import llm
+
+    model = args.model or "qwen3:8b"
+    stats_rows: List[Dict[str, float]] = []
+
+    def call(i: int) -> None:
+        st: Dict[str, float] = {}
+        llm.answer_question(question, hits, model, stats=st)
+        if i >= 0:
+            stats_rows.append(st)
+
+    res = timed(call, runs)
+    for key in ("prompt_eval_ms", "eval_ms", "load_ms"):
+        vals = [s.get(key, 0.0) for s in stats_rows]
+        res[f"{key}_p50"] = percentile(vals, 50)
+    toks = sum(s.get("eval_tokens", 0.0) for s in stats_rows)
+    ms = sum(s.get("eval_ms", 0.0) for s in stats_rows)
+    res["eval_tokens_per_s"] = toks * 1000.0 / ms if ms else 0.0
+    res["model"] = model
+    return res
+
+
+# --- llm only ---
+def bench_llm(args: argparse.Namespace, questions: List[str]) -> Dict[str, Any]:
+    print(f"[LLM-only] question='{questions[0]}' runs={args.runs}")
+    out = {}
+    for model in args.models:
+        args.model = model
+        res = _bench_generate(args, questions[0], [], max(args.runs, 1))
+        print(f"- model={model} p50={res['p50_ms']:.0f}ms p95={res['p95_ms']:.0f}ms tok/s={res['eval_tokens_per_s']:.1f}")
+        out[model] = res
+    return out
+
+
+# --- 결과 비교 ---
+def flatten(obj: Any, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            flat.update(flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        flat[prefix] = float(obj)
+    return flat
+
+
+def _direction(key: str) -> int:
+    """+1: 클수록 좋음, -1: 작을수록 좋음, 0: 비교 안 함."""
+    leaf = key.rsplit(".", 1)[-1]
+    if "throughput" in leaf or leaf.endswith("per_s"):
+        return 1
+    if leaf == "error_rate" or leaf.endswith("_ms") or "_ms_" in leaf:
+        return -1
+    return 0
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float = 5.0
+) -> List[Dict[str, Any]]:
+    """baseline 대비 threshold(비율) 이상 나빠진 지표. ms 지표는 min_delta_ms 미만 차이(측정 잡음)는 무시."""
+    cur, base = flatten(current.get("results", {})), flatten(baseline.get("results", {}))
+    regressions = []
+    for key, old in base.items():
+        d = _direction(key)
+        if d == 0 or key not in cur:
+            continue
+        new = cur[key]
+        if key.endswith("error_rate"):
+            worse = new > old + threshold / 10
+        elif old <= 0:
+            continue
+        elif d < 0 and key.endswith("_ms") and abs(new - old) < min_delta_ms:
+            continue
+        else:
+            change = (new - old) / old
+            worse = change > threshold if d < 0 else change < -threshold
+        if worse:
+            regressions.append({"metric": key, "baseline": old, "current": new,
+                                "change": (new - old) / old if old else None})
+    return regressions
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description="LLM 속도 벤치마크")
-    parser.add_argument("--mode", choices=["e2e", "llm"], default="e2e")
-    parser.add_argument("--question", default="간단한 테스트 질문입니다. 답변을 1-2문장으로 해주세요.")
-    parser.add_argument(
-        "--models",
-        nargs="+",
-        default=["qwen2.5:7b-instruct", "qwen3:8b"],
-        help="비교할 모델들(공백 구분)",
-    )
-    parser.add_argument("--runs", type=int, default=3)
-    parser.add_argument("--server", default="http://localhost:8000/query")
+    parser = argparse.ArgumentParser(description="RAG 부하/지연 벤치마크")
+    parser.add_argument("--mode", choices=["load", "e2e", "stages", "llm"], default="load",
+                        help="e2e = load --concurrency 1 (순차)")
+    parser.add_argument("--question", default=None, help="단일 질문(미지정 시 --questions 파일)")
+    parser.add_argument("--questions", default="eval/examples.csv", help="question 열이 있는 csv 또는 줄 단위 txt")
+    parser.add_argument("--models", nargs="+", default=["qwen2.5:7b-instruct", "qwen3:8b"], help="llm 모드 비교 모델")
+    parser.add_argument("--model", default=None, help="load/stages 모드 생성 모델")
+    parser.add_argument("--runs", type=int, default=20, help="stages/llm 모드 반복 횟수")
+    # load
+    parser.add_argument("--server", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/query")
+    parser.add_argument("--priority", default=None, help="서버 생성 대기열 우선순위(interactive | batch). 거절은 errors의 http_429")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0, help="목표 요청률(req/s). 0이면 동시성만 제한(closed-loop)")
+    parser.add_argument("--poisson", action="store_true", help="요청 간격을 지수 분포로")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--bust-cache", action="store_true", help="질문에 번호를 붙여 캐시 적중 방지")
+    parser.add_argument("--top-k", type=int, default=5)
+    # stages
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--collection", default=None)
+    parser.add_argument("--batch", type=int, default=16, help="배치 임베딩 크기")
+    parser.add_argument("--skip-llm", action="store_true", help="stages 모드에서 생성 단계 생략")
+    # stub / 결과
+    parser.add_argument("--stub", action="store_true", help="Ollama 대신 eval/stub_ollama 사용(stages/llm)")
+    parser.add_argument("--stub-port", type=int, default=11435)
+    parser.add_argument("--out", default=None, help="결과 JSON 저장 경로")
+    parser.add_argument("--baseline", default=None, help="비교할 이전 결과 JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="회귀 판정 비율(0.10 = 10%% 악화)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="이보다 작은 ms 차이는 회귀로 보지 않음")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    from eval import stub_ollama
+    stub_ollama.add_args(parser)
     args = parser.parse_args()
 
+    stub_server = None
+    if args.stub:
+        if args.mode in ("load", "e2e"):
+            print(f"[STUB] load 모드는 서버가 stub을 보도록 실행하세요: "
+                  f"OLLAMA_HOST=http://127.0.0.1:{args.stub_port} uvicorn src.server:app")
+        # src.llm은 import 시점에 OLLAMA_HOST를 읽으므로 먼저 설정
+        os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{args.stub_port}"
+        stub_server = stub_ollama.serve(stub_ollama.from_args(args), port=args.stub_port)
+
+    questions = load_questions(args.questions, args.question)
     if args.mode == "e2e":
-        bench_e2e(args.question, args.models, args.runs, args.server)
+        args.concurrency, args.rate = 1, 0.0
+    if args.mode in ("load", "e2e"):
+        results = bench_load(args, questions)
+    elif args.mode == "stages":
+        results = bench_stages(args, questions)
+        for k, s in results.items():
+            if isinstance(s, dict) and "p50_ms" in s:
+                print(f"- {k:<16} p50={s['p50_ms']:9.2f}ms p95={s['p95_ms']:9.2f}ms p99={s['p99_ms']:9.2f}ms")
     else:
-        bench_llm(args.question, args.models, args.runs)
+        results = bench_llm(args, questions)
+
+    report = {
+        "mode": args.mode,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stub": bool(args.stub),
+        "args": {k: v for k, v in vars(args).items() if isinstance(v, (str, int, float, bool, list, type(None)))},
+        "results": results,
+    }
+    regressions: List[Dict[str, Any]] = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        report["baseline"] = args.baseline
+        report["regressions"] = regressions
+        if regressions:
+            print(f"[REGRESSION] {len(regressions)}개 지표가 {args.threshold:.0%} 이상 악화:")
+            for reg in regressions:
+                ch = f"{reg['change']:+.1%}" if reg["change"] is not None else "n/a"
+                print(f"  {reg['metric']:<40} {reg['baseline']:.2f} → {reg['current']:.2f} ({ch})")
+        else:
+            print(f"[OK] 기준({args.baseline}) 대비 회귀 없음(threshold={args.threshold:.0%})")
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"저장: {args.out}")
+    if stub_server is not None:
+        stub_server.shutdown()
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from src.chunker import RULING_LEVELS, build_chunker, detect_kind
+from src.lexical import LexicalIndex
+from src.retriever import load_config
+
+# 청커 비교 벤치마크: fixed(split_text) vs legal(구조 인식)
+# - 문서당 청크 수, 청크 길이, 구조 단위([n] 판시사항/제N조) 보존율
+# - 검색 적중률: 판시사항 첫 줄로 질의 → top-k 안에 해당 판결(doc@k) / 판시사항 전체가 한 청크로(unit@k)
+#   기본은 BM25(src.lexical), --dense 지정 시 config의 임베딩 모델로 dense 검색
+
+HOLDING_RE = RULING_LEVELS[1].pattern
+ARTICLE_RE = re.compile(r"(?m)^[ \t　﻿]*제\s*\d+\s*조(?:\s*의\s*\d+)?(?:\s*\([^()\n]{1,40}\))?")
+
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", "", s)
+
+
+def load_docs(cases: Path, raw_dir: Path, limit: int) -> List[Tuple[str, str]]:
+    docs: List[Tuple[str, str]] = []
+    if cases.exists():
+        with cases.open("r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                try:
+                    o = json.loads(line)
+                except Exception:
+                    continue
+                text = o.get("full_text") or o.get("summary") or ""
+                if text.strip():
+                    docs.append((o.get("case_no") or f"case-{len(docs)}", text))
+                if limit and len(docs) >= limit:
+                    break
+    if raw_dir.exists():
+        for p in sorted(raw_dir.rglob("*")):
+            if p.suffix.lower() in {".txt", ".md"}:
+                docs.append((p.as_posix(), p.read_text(encoding="utf-8", errors="ignore")))
+    return docs
+
+
+def structural_units(text: str, chunk_size: int) -> List[str]:
+    """chunk_size 안에 들어가는 [n] 판시사항/조문 단위(한 청크에 온전히 들어갈 수 있는 것만)."""
+    rx = ARTICLE_RE if detect_kind(text) == "statute" else HOLDING_RE
+    heads = list(rx.finditer(text))
+    units = []
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(text)
+        u = text[m.start():end].strip()
+        if 20 <= len(u) <= chunk_size:
+            units.append(u)
+    return units
+
+
+def make_queries(docs: List[Tuple[str, str]], chunk_size: int, n: int, seed: int) -> List[Tuple[str, str, str]]:
+    """(질의, 정답 doc_key, 정답 단위 본문). 질의 = 판시사항 앞부분(번호 제거)."""
+    qs = []
+    for key, text in docs:
+        for u in structural_units(text, chunk_size):
+            if not HOLDING_RE.match(u):
+                continue
+            q = re.sub(r"\s+", " ", HOLDING_RE.sub("", u, count=1)).strip()[:80]
+            if len(q) >= 20:
+                qs.append((q, key, u))
+    random.Random(seed).shuffle(qs)
+    return qs[:n]
+
+
+def build_search(ids: List[str], texts: List[str], dense: bool, model: str, device: str):
+    if not dense:
+        index = LexicalIndex()
+        index.add(ids, texts)
+        return lambda q, k: [i for i, _ in index.search(q, top_n=k)]
+
+    import numpy as np
+    from src.embedder import get_embedding_function
+
+    ef = get_embedding_function(model, device)
+    mat = np.asarray(ef(texts), dtype=np.float32)
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True) + 1e-12
+
+    def search(q: str, k: int) -> List[str]:
+        v = np.asarray(ef([q])[0], dtype=np.float32)
+        v /= np.linalg.norm(v) + 1e-12
+        top = np.argsort(-(mat @ v))[:k]
+        return [ids[i] for i in top]
+
+    return search
+
+
+def run(name: str, docs, queries, args, cfg) -> Dict[str, float]:
+    chunker = build_chunker(name, args.chunk_size, args.overlap)
+    t0 = time.perf_counter()
+    ids: List[str] = []
+    texts: List[str] = []
+    owner: Dict[str, str] = {}
+    per_doc: List[int] = []
+    intact = units_total = 0
+    for key, text in docs:
+        parts = chunker.split(text)
+        per_doc.append(len(parts))
+        normed = [_norm(p) for p in parts]
+        for u in structural_units(text, args.chunk_size):
+            units_total += 1
+            nu = _norm(u)
+            intact += any(nu in p for p in normed)
+        for i, p in enumerate(parts):
+            cid = f"{key}#{i}"
+            ids.append(cid)
+            texts.append(p)
+            owner[cid] = key
+    chunk_s = time.perf_counter() - t0
+
+    emb = cfg.get("embedder", cfg.get("embedding", {}))
+    search = build_search(ids, texts, args.dense, emb.get("model", "BAAI/bge-m3"), emb.get("device", "cpu"))
+    by_id = dict(zip(ids, texts))
+    doc_hit = unit_hit = 0
+    for q, key, unit in queries:
+        got = search(q, args.top_k)
+        doc_hit += any(owner[g] == key for g in got)
+        nu = _norm(unit)
+        unit_hit += any(owner[g] == key and nu in _norm(by_id[g]) for g in got)
+
+    lens = [len(t) for t in texts]
+    nq = max(len(queries), 1)
+    return {
+        "chunks": len(texts),
+        "chunks_per_doc_mean": statistics.mean(per_doc) if per_doc else 0.0,
+        "chunks_per_doc_p50": statistics.median(per_doc) if per_doc else 0.0,
+        "chunks_per_doc_max": max(per_doc) if per_doc else 0,
+        "chunk_chars_mean": statistics.mean(lens) if lens else 0.0,
+        "units_intact": intact / max(units_total, 1),
+        f"doc_hit@{args.top_k}": doc_hit / nq,
+        f"unit_hit@{args.top_k}": unit_hit / nq,
+        "chunk_ms_per_doc": chunk_s * 1000 / max(len(docs), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="청커 비교 벤치마크(fixed vs legal)")
+    parser.add_argument("--cases", default="data/raw/cases.jsonl")
+    parser.add_argument("--raw", default="data/raw")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--overlap", type=int, default=None)
+    parser.add_argument("--max-docs", type=int, default=0, help="0=전체")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dense", action="store_true", help="BM25 대신 임베딩 모델로 검색")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="결과 JSON 저장 경로")
+    args = parser.parse_args()
+
+    cfg = load_config(args.config)
+    retr = cfg.get("retriever", {})
+    args.chunk_size = args.chunk_size or int(retr.get("chunk_size", 800))
+    args.overlap = args.overlap if args.overlap is not None else int(retr.get("chunk_overlap", 120))
+
+    docs = load_docs(Path(args.cases), Path(args.raw), args.max_docs)
+    queries = make_queries(docs, args.chunk_size, args.queries, args.seed)
+    print(f"[BENCH] docs={len(docs)} queries={len(queries)} chunk_size={args.chunk_size} overlap={args.overlap} "
+          f"search={'dense' if args.dense else 'bm25'} top_k={args.top_k}")
+
+    results = {name: run(name, docs, queries, args, cfg) for name in ("fixed", "legal")}
+    keys = list(results["fixed"])
+    print(f"{'metric':<24}{'fixed':>12}{'legal':>12}")
+    for k in keys:
+        a, b = results["fixed"][k], results["legal"][k]
+        fmt = (lambda v: f"{v:>12.3f}") if isinstance(a, float) else (lambda v: f"{v:>12}")
+        print(f"{k:<24}{fmt(a)}{fmt(b)}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"저장: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,230 @@
 from __future__ import annotations
 
+import argparse
 import csv
+import json
+import math
+import re
+import time
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
+
+from src.cache import normalize_question
 from src.retriever import Retriever
 
+# 검색 품질 평가(recall@k, MRR, nDCG@k)
+# - 질문 임베딩: 모델별 디스크 캐시(eval/.cache/) → 미스만 한 번의 배치로 계산 → Retriever 임베딩 캐시에 주입
+#   → 설정마다 query_many(배치 검색 1회)로 돌려도 재임베딩 없음
+# - 정답 라벨(csv 열, ';' 구분): relevant_ids(청크 ID 또는 source#chunkN) > relevant_sources(source/case_id/case_no) > keywords
+#   keywords만 있으면 "모든 키워드를 포함한 청크"를 정답으로 보고, 전체 정답 수는 알 수 없으므로 recall@k = hit@k
+# - 설정 비교: --configs dense hybrid hybrid+rerank ... × --collections(청크 크기별로 적재한 컬렉션)
 
 DATA = Path("eval/examples.csv")
+CACHE_DIR = Path("eval/.cache")
+
+# 이름 → Retriever 속성 덮어쓰기
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "dense": {"hybrid": False, "use_reranker": False},
+    "hybrid": {"hybrid": True, "use_reranker": False},
+    "dense+rerank": {"hybrid": False, "use_reranker": True},
+    "hybrid+rerank": {"hybrid": True, "use_reranker": True},
+}
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [s.strip() for s in (value or "").split(";") if s.strip()]
+
+
+def load_rows(path: Path) -> List[Dict[str, Any]]:
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            q = (row.get("question") or "").strip()
+            if not q:
+                continue
+            rows.append({
+                "question": q,
+                "keywords": _split(row.get("keywords")),
+                "relevant_ids": set(_split(row.get("relevant_ids"))),
+                "relevant_sources": set(_split(row.get("relevant_sources"))),
+            })
+    return rows
+
+
+# --- 질문 임베딩 디스크 캐시 ---
+def cache_path(model: str, cache_dir: Path = CACHE_DIR) -> Path:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+    return cache_dir / f"query_emb_{slug}.npz"
+
+
+def embed_questions(retriever: Retriever, questions: Sequence[str], cache_dir: Path = CACHE_DIR) -> Tuple[np.ndarray, int]:
+    """(질문별 임베딩 행렬, 새로 계산한 개수). 캐시에 없는 질문만 한 번의 배치로 임베딩."""
+    path = cache_path(retriever.model_name, cache_dir)
+    cached: Dict[str, np.ndarray] = {}
+    if path.exists():
+        with np.load(path, allow_pickle=False) as z:
+            cached = dict(zip(z["questions"].tolist(), z["vectors"]))
+    keys = [normalize_question(q) for q in questions]
+    missing = list(dict.fromkeys(k for k, q in zip(keys, questions) if k not in cached))
+    if missing:
+        first = {k: q for q, k in zip(questions, keys)}
+        vecs = retriever.embedding_fn([first[k] for k in missing])
+        for k, v in zip(missing, vecs):
+            cached[k] = np.asarray(v, dtype=np.float32)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        names = list(cached)
+        np.savez(tmp, questions=np.array(names), vectors=np.stack([cached[n] for n in names]))
+        tmp.replace(path)
+    return np.stack([cached[k] for k in keys]), len(missing)
+
 
+# --- 지표 ---
+def is_relevant(hit: Dict[str, Any], row: Dict[str, Any]) -> bool:
+    if row["relevant_ids"]:
+        return hit.get("id") in row["relevant_ids"] or hit.get("source_id") in row["relevant_ids"]
+    meta = hit.get("metadata") or {}
+    if row["relevant_sources"]:
+        keys = {meta.get("source"), meta.get("case_id"), meta.get("case_no")}
+        return bool(keys & row["relevant_sources"])
+    if row["keywords"]:
+        text = hit.get("text") or ""
+        return all(kw in text for kw in row["keywords"])
+    return False
 
-def evaluate() -> None:
-    retriever = Retriever("config.yaml")
-    rows = list(csv.DictReader(DATA.open("r", encoding="utf-8")))
+
+def score_row(hits: List[Dict[str, Any]], row: Dict[str, Any], ks: Sequence[int]) -> Dict[str, float]:
+    rel = [is_relevant(h, row) for h in hits]
+    if row["relevant_ids"]:
+        n_rel = len(row["relevant_ids"])
+    else:
+        # 전체 정답 수를 모르면 검색된 정답 수(최소 1)를 기준으로
+        n_rel = max(sum(rel), 1)
+    out: Dict[str, float] = {}
+    first = next((i for i, r in enumerate(rel) if r), None)
+    out["mrr"] = 1.0 / (first + 1) if first is not None else 0.0
+    for k in ks:
+        top = rel[:k]
+        found = sum(top)
+        if row["relevant_ids"]:
+            out[f"recall@{k}"] = found / n_rel
+        else:
+            out[f"recall@{k}"] = 1.0 if found else 0.0
+        dcg = sum(1.0 / math.log2(i + 2) for i, r in enumerate(top) if r)
+        idcg = sum(1.0 / math.log2(i + 2) for i in range(min(n_rel, k)))
+        out[f"ndcg@{k}"] = dcg / idcg if idcg else 0.0
+    # 기존 지표: 상위 k개 청크를 합친 컨텍스트에 모든 키워드가 있는가
+    if row["keywords"]:
+        ctx = "\n".join(h.get("text") or "" for h in hits[: max(ks)])
+        out["context_keyword_recall"] = 1.0 if all(kw in ctx for kw in row["keywords"]) else 0.0
+    return out
+
+
+def run_config(
+    retriever: Retriever,
+    rows: List[Dict[str, Any]],
+    preset: Dict[str, Any],
+    collection: Optional[str],
+    ks: Sequence[int],
+) -> Dict[str, Any]:
+    saved = {k: getattr(retriever, k) for k in preset}
+    for k, v in preset.items():
+        setattr(retriever, k, v)
+    try:
+        t0 = time.perf_counter()
+        results, stats = retriever.query_many_detailed(
+            [r["question"] for r in rows], top_k=max(ks), collection=collection,
+        )
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    finally:
+        for k, v in saved.items():
+            setattr(retriever, k, v)
+
+    per_row = [score_row(hits, row, ks) for hits, row in zip(results, rows)]
+    keys = sorted({k for s in per_row for k in s})
+    metrics = {k: float(np.mean([s[k] for s in per_row if k in s])) for k in keys}
+    n = max(len(rows), 1)
+    return {
+        "metrics": metrics,
+        "ms_per_query": elapsed_ms / n,
+        "embed_ms": stats.get("embed_ms", 0.0),
+        "search_ms": stats.get("search_ms", 0.0),
+        "post_ms_per_query": stats.get("post_ms", 0.0) / n,
+        "per_question": [
+            {"question": row["question"], **s, "top_ids": [h["id"] for h in hits[: max(ks)]]}
+            for row, s, hits in zip(rows, per_row, results)
+        ],
+    }
+
+
+def evaluate(
+    data: Path = DATA,
+    config: str = "config.yaml",
+    configs: Sequence[str] = ("dense", "hybrid"),
+    collections: Sequence[Optional[str]] = (None,),
+    ks: Sequence[int] = (1, 3, 5, 10),
+    cache_dir: Path = CACHE_DIR,
+) -> Dict[str, Any]:
+    retriever = Retriever(config)
+    rows = load_rows(data)
     if not rows:
         print("평가 데이터가 없습니다.")
-        return
+        return {}
 
-    total = len(rows)
-    hit = 0
-    for row in rows:
-        q = (row.get("question") or "").strip()
-        keywords = [s.strip() for s in (row.get("keywords") or "").split(";") if s.strip()]
-        chunks = retriever.query(q, top_k=5)
-        context = "\n".join([c.text for c in chunks])
-        ok = all(kw in context for kw in keywords) if keywords else False
-        hit += 1 if ok else 0
-        print(f"Q: {q}\n - Keywords: {keywords}\n - Hit: {ok}")
+    t0 = time.perf_counter()
+    mat, computed = embed_questions(retriever, [r["question"] for r in rows], cache_dir)
+    embed_ms = (time.perf_counter() - t0) * 1000.0
+    # Retriever 임베딩 캐시에 주입 → query_many는 임베딩 없이 검색만
+    retriever.embed_cache.max_entries = max(retriever.embed_cache.max_entries, len(rows) * 2)
+    for row, vec in zip(rows, mat):
+        retriever.embed_cache.put_vector(retriever.model_name, row["question"], vec)
+    print(f"[EVAL] questions={len(rows)} model={retriever.model_name} "
+          f"embedded={computed} cached={len(rows) - computed} ({embed_ms:.0f}ms)")
 
-    print("\n=== 결과 ===")
-    print(f"Count: {total}")
-    print(f"Hits:  {hit}")
-    print(f"Recall: {hit/total:.2%}")
+    report: Dict[str, Any] = {"questions": len(rows), "model": retriever.model_name, "runs": {}}
+    for col in collections:
+        col_name = col or retriever.collection_name
+        for name in configs:
+            preset = PRESETS.get(name)
+            if preset is None:
+                print(f"알 수 없는 설정: {name} (가능: {', '.join(PRESETS)})")
+                continue
+            res = run_config(retriever, rows, preset, col, ks)
+            report["runs"][f"{col_name}/{name}"] = res
 
+    main_k = 5 if 5 in ks else max(ks)
+    cols = ["mrr", f"recall@{main_k}", f"ndcg@{main_k}"]
+    print(f"{'config':<36}" + "".join(f"{c:>12}" for c in cols) + f"{'ms/query':>12}")
+    for key, res in report["runs"].items():
+        m = res["metrics"]
+        print(f"{key:<36}" + "".join(f"{m.get(c, 0.0):>12.3f}" for c in cols) + f"{res['ms_per_query']:>12.1f}")
+    return report
 
-if __name__ == "__main__":
-    evaluate()
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="검색 품질 평가(recall@k, MRR, nDCG) + 설정 비교")
+    parser.add_argument("--data", default=str(DATA), help="question,keywords[,relevant_ids][,relevant_sources] csv")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--configs", nargs="+", default=["dense", "hybrid"],
+                        help=f"비교할 설정({', '.join(PRESETS)})")
+    parser.add_argument("--collections", nargs="+", default=None,
+                        help="비교할 컬렉션(예: 청크 크기별로 적재한 컬렉션). 기본: config의 collection_name")
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3, 5, 10])
+    parser.add_argument("--cache-dir", default=str(CACHE_DIR))
+    parser.add_argument("--out", default=None, help="결과 JSON 저장 경로")
+    args = parser.parse_args()
+
+    report = evaluate(
+        Path(args.data), args.config, args.configs, args.collections or [None],
+        sorted(set(args.k)), Path(args.cache_dir),
+    )
+    if args.out and report:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"저장: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
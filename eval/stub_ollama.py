@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# GPU 없이 전체 파이프라인을 벤치마크하기 위한 Ollama 대역(stub) 서버
+# - /api/tags, /api/chat, /api/generate(stream/non-stream) 지원, Ollama와 같은 done 통계 필드 반환
+# - 지연 모델: 최초 로드(load_ms) + prefill(캐시되지 않은 프롬프트 토큰 / prefill_tps) + 디코드(답변 토큰 / tps)
+# - 모델별 직전 프롬프트와의 공통 접두부는 KV 캐시로 보고 prefill에서 제외(Ollama 프롬프트 캐시 흉내)
+# - 모델별 동시 처리 수(parallel)를 넘는 요청은 대기(Ollama OLLAMA_NUM_PARALLEL 흉내)
+#
+# 사용: python -m eval.stub_ollama --port 11435 --tps 40 --prefill-tps 1500
+#      OLLAMA_HOST=http://127.0.0.1:11435 uvicorn src.server:app
+
+ANSWER = (
+    "요지: 참고 자료에 따르면 해당 요건이 충족되어야 합니다. "
+    "원문 인용: \"계약의 중요한 내용에 관하여 구체적이고 상세한 설명의무를 진다.\" "
+    "출처: [stub#chunk0] 본 답변은 일반적 정보 제공 목적이며 법률 자문이 아닙니다."
+)
+
+
+def _chars_to_tokens(n_chars: int) -> int:
+    # 한국어 위주 텍스트 기준 대략 1.3자/토큰
+    return max(int(n_chars / 1.3), 1)
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class StubOllama:
+    """지연/캐시 상태를 가진 가짜 Ollama. HTTP 핸들러와 분리해 테스트/벤치마크에서 직접 써도 됨."""
+
+    def __init__(
+        self,
+        models: Optional[List[str]] = None,
+        tps: float = 40.0,
+        prefill_tps: float = 1500.0,
+        load_ms: float = 2000.0,
+        answer_tokens: int = 120,
+        parallel: int = 1,
+        piece_tokens: int = 4,
+    ) -> None:
+        self.models = models or ["qwen3:8b", "qwen2.5:7b-instruct"]
+        self.tps = max(float(tps), 1e-6)
+        self.prefill_tps = max(float(prefill_tps), 1e-6)
+        self.load_ms = float(load_ms)
+        self.answer_tokens = max(int(answer_tokens), 1)
+        self.piece_tokens = max(int(piece_tokens), 1)
+        self.parallel = max(int(parallel), 1)
+        self._loaded: Dict[str, bool] = {}
+        self._last_prompt: Dict[str, str] = {}
+        self._slots: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def has(self, model: str) -> bool:
+        name = model if ":" in model else f"{model}:latest"
+        return name in self.models or model in self.models
+
+    def _slot(self, model: str) -> threading.Semaphore:
+        with self._lock:
+            return self._slots.setdefault(model, threading.Semaphore(self.parallel))
+
+    def _prefill(self, model: str, prompt: str) -> Tuple[int, float, float]:
+        """(평가 토큰 수, prefill 초, 로드 초)"""
+        with self._lock:
+            load_s = 0.0 if self._loaded.get(model) else self.load_ms / 1000.0
+            self._loaded[model] = True
+            cached = _common_prefix(self._last_prompt.get(model, ""), prompt)
+            self._last_prompt[model] = prompt
+        tokens = _chars_to_tokens(len(prompt) - cached)
+        return tokens, tokens / self.prefill_tps, load_s
+
+    def run(self, path: str, payload: Dict[str, Any]):
+        """응답 조각(dict)을 순서대로 반환하는 제너레이터. 마지막 조각은 done=True + 통계."""
+        model = payload.get("model", "")
+        chat = path.endswith("/chat")
+        if chat:
+            prompt = "\n".join(m.get("content") or "" for m in payload.get("messages") or [])
+        else:
+            prompt = (payload.get("system") or "") + "\n" + (payload.get("prompt") or "")
+        limit = int((payload.get("options") or {}).get("num_predict") or -1)
+        n_tokens = self.answer_tokens if limit < 0 else min(limit, self.answer_tokens)
+
+        with self._slot(model):
+            t0 = time.perf_counter()
+            p_tokens, prefill_s, load_s = self._prefill(model, prompt)
+            time.sleep(load_s + prefill_s)
+            t_gen = time.perf_counter()
+            step = max(len(ANSWER) // self.answer_tokens, 1)
+            text = (ANSWER * (n_tokens * step // len(ANSWER) + 1))[: n_tokens * step]
+            for i in range(0, n_tokens, self.piece_tokens):
+                k = min(self.piece_tokens, n_tokens - i)
+                time.sleep(k / self.tps)
+                piece = text[i * step:(i + k) * step]
+                yield {"model": model, "done": False, **self._body(chat, piece)}
+            t_end = time.perf_counter()
+        yield {
+            "model": model,
+            "done": True,
+            **self._body(chat, ""),
+            "total_duration": int((t_end - t0) * 1e9),
+            "load_duration": int(load_s * 1e9),
+            "prompt_eval_count": p_tokens,
+            "prompt_eval_duration": int(prefill_s * 1e9),
+            "eval_count": n_tokens,
+            "eval_duration": int((t_end - t_gen) * 1e9),
+        }
+
+    @staticmethod
+    def _body(chat: bool, text: str) -> Dict[str, Any]:
+        return {"message": {"role": "assistant", "content": text}} if chat else {"response": text}
+
+
+def make_handler(stub: StubOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _json(self, status: int, obj: Dict[str, Any]) -> None:
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path.startswith("/api/tags"):
+                self._json(200, {"models": [{"name": m, "model": m} for m in stub.models]})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            n = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(n) or b"{}")
+            if not (self.path.startswith("/api/chat") or self.path.startswith("/api/generate")):
+                self._json(404, {"error": "not found"})
+                return
+            model = payload.get("model", "")
+            if not stub.has(model):
+                self._json(404, {"error": f"model '{model}' not found"})
+                return
+            parts = stub.run(self.path, payload)
+            if not payload.get("stream", True):
+                text, last = [], {}
+                for d in parts:
+                    text.append((d.get("message") or {}).get("content") or d.get("response") or "")
+                    last = d
+                last.update(StubOllama._body(self.path.endswith("/chat"), "".join(text)))
+                self._json(200, last)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for d in parts:
+                line = (json.dumps(d, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def serve(stub: StubOllama, host: str = "127.0.0.1", port: int = 11435) -> ThreadingHTTPServer:
+    """백그라운드 스레드에서 stub 서버 시작. 반환된 서버의 shutdown()으로 종료."""
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-ollama", daemon=True).start()
+    return server
+
+
+def add_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--stub-models", nargs="+", default=["qwen3:8b", "qwen2.5:7b-instruct"])
+    parser.add_argument("--tps", type=float, default=40.0, help="디코드 속도(토큰/초)")
+    parser.add_argument("--prefill-tps", type=float, default=1500.0, help="prefill 속도(토큰/초)")
+    parser.add_argument("--load-ms", type=float, default=2000.0, help="모델 최초 로드 지연")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--parallel", type=int, default=1, help="모델별 동시 처리 수")
+
+
+def from_args(args: argparse.Namespace) -> StubOllama:
+    return StubOllama(
+        models=args.stub_models, tps=args.tps, prefill_tps=args.prefill_tps,
+        load_ms=args.load_ms, answer_tokens=args.answer_tokens, parallel=args.parallel,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="오프라인 벤치마크용 Ollama stub 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_args(parser)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(from_args(args)))
+    server.daemon_threads = True
+    print(f"[STUB] Ollama stub on http://{args.host}:{args.port} models={args.stub_models} tps={args.tps}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# [RAG][cache]
+# 역할: 반복 질의 비용 절감용 인메모리 캐시.
+# - EmbeddingCache: 정규화 질문 → 임베딩 벡터 (LRU + TTL).
+# - AnswerCache: (컬렉션, 모델, 검색 청크 ID, 정규화 질문) → 답변. 선택적으로 임베딩 유사도 기반 near-dup 조회.
+# - 컬렉션 세대(generation) 파일: 재적재(ingest) 시 갱신 → 서버 프로세스의 답변 캐시가 자동 무효화.
+from __future__ import annotations
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAIL_PUNCT_RE = re.compile(r"[\s?.!？。~]+$")
+
+
+def normalize_question(q: str) -> str:
+    """캐시 키용 질문 정규화: NFC, 소문자, 공백 축약, 끝 문장부호 제거."""
+    q = unicodedata.normalize("NFC", q or "").strip().lower()
+    q = _SPACE_RE.sub(" ", q)
+    return _TRAIL_PUNCT_RE.sub("", q)
+
+
+class LRUCache:
+    """TTL을 지원하는 스레드 안전 LRU. 크기 초과 시 가장 오래 안 쓴 항목부터 제거."""
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600.0) -> None:
+        self.max_entries = max(int(max_entries), 0)
+        self.ttl_s = float(ttl_s)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            ts, value = item
+            if self.ttl_s > 0 and time.monotonic() - ts > self.ttl_s:
+                del self._data[key]
+                self._on_evict(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                old, _ = self._data.popitem(last=False)
+                self._on_evict(old)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._on_evict(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._data):
+                self._on_evict(key)
+            self._data.clear()
+
+    def _on_evict(self, key: Hashable) -> None:
+        """하위 클래스용 훅(보조 인덱스 정리). 락을 잡은 상태로 호출됩니다."""
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": float(len(self._data)),
+            "hits": float(self.hits),
+            "misses": float(self.misses),
+            "evictions": float(self.evictions),
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+class EmbeddingCache(LRUCache):
+    """(모델, 정규화 질문) → 임베딩 벡터."""
+
+    def get_vector(self, model: str, question: str) -> Optional[np.ndarray]:
+        return self.get((model, normalize_question(question)))
+
+    def put_vector(self, model: str, question: str, vector: Any) -> None:
+        self.put((model, normalize_question(question)), np.asarray(vector, dtype=np.float32))
+
+
+AnswerKey = Tuple[str, str, Tuple[str, ...], str]
+
+
+class AnswerCache(LRUCache):
+    """(컬렉션, 모델, 청크 ID들, 정규화 질문) → 답변.
+
+    similarity > 0이면 정확 키가 없을 때 같은 (컬렉션, 모델, 청크 ID들) 그룹 안에서
+    질문 임베딩 코사인 유사도가 임계값 이상인 항목을 재사용합니다.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_s: float = 1800.0, similarity: float = 0.0) -> None:
+        super().__init__(max_entries=max_entries, ttl_s=ttl_s)
+        self.similarity = float(similarity)
+        self.near_hits = 0
+        self.invalidations = 0
+        # (컬렉션, 모델, 청크 ID들) → 키 집합 (near-dup 후보 축소용)
+        self._groups: Dict[Tuple[str, str, Tuple[str, ...]], Set[AnswerKey]] = {}
+        # 컬렉션 → 답변 생성 시점의 세대 값
+        self._generations: Dict[str, float] = {}
+
+    @staticmethod
+    def make_key(collection: str, model: str, chunk_ids: Sequence[str], question: str) -> AnswerKey:
+        return (collection, model, tuple(chunk_ids), normalize_question(question))
+
+    def lookup(
+        self,
+        key: AnswerKey,
+        generation: float = 0.0,
+        qvec: Optional[np.ndarray] = None,
+    ) -> Optional[str]:
+        # 재적재로 세대가 바뀌었으면 해당 컬렉션 답변 전체 무효화
+        if self._generations.get(key[0], generation) != generation:
+            self.invalidate_collection(key[0])
+        hit = self.get(key)
+        if hit is not None or qvec is None or self.similarity <= 0:
+            return hit[0] if hit is not None else None
+
+        group = key[:3]
+        q = _unit(qvec)
+        best, best_sim = None, self.similarity
+        with self._lock:
+            for k in self._groups.get(group, ()):
+                item = self._data.get(k)
+                if item is None:
+                    continue
+                ts, (answer, vec) = item
+                if vec is None or (self.ttl_s > 0 and time.monotonic() - ts > self.ttl_s):
+                    continue
+                sim = float(np.dot(q, vec))
+                if sim >= best_sim:
+                    best, best_sim = k, sim
+            if best is None:
+                return None
+            self._data.move_to_end(best)
+            self.near_hits += 1
+            # get()에서 miss로 집계된 것을 hit로 정정
+            self.misses -= 1
+            self.hits += 1
+            return self._data[best][1][0]
+
+    def store(
+        self,
+        key: AnswerKey,
+        answer: str,
+        generation: float = 0.0,
+        qvec: Optional[np.ndarray] = None,
+    ) -> None:
+        vec = _unit(qvec) if qvec is not None else None
+        self.put(key, (answer, vec))
+        with self._lock:
+            if key in self._data:
+                self._groups.setdefault(key[:3], set()).add(key)
+            self._generations[key[0]] = generation
+
+    def invalidate_collection(self, collection: str) -> int:
+        """해당 컬렉션의 답변을 모두 제거하고 제거 개수를 반환합니다."""
+        with self._lock:
+            keys = [k for k in self._data if k[0] == collection]
+            for k in keys:
+                del self._data[k]
+                self._on_evict(k)
+            self._generations.pop(collection, None)
+            if keys:
+                self.invalidations += 1
+        return len(keys)
+
+    def _on_evict(self, key: Hashable) -> None:
+        group = self._groups.get(key[:3])  # type: ignore[index]
+        if group is not None:
+            group.discard(key)  # type: ignore[arg-type]
+            if not group:
+                del self._groups[key[:3]]  # type: ignore[index]
+
+    def stats(self) -> Dict[str, float]:
+        out = super().stats()
+        out["near_hits"] = float(self.near_hits)
+        out["invalidations"] = float(self.invalidations)
+        return out
+
+
+def _unit(v: Any) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+# --- 컬렉션 세대(generation) 파일 ---
+def generation_path(db_path: str | Path, collection: str) -> Path:
+    return Path(db_path) / "generations" / collection
+
+
+def bump_generation(db_path: str | Path, collection: str) -> None:
+    """컬렉션 내용이 바뀌었음을 기록합니다(ingest 프로세스 → 서버 프로세스 전달)."""
+    p = generation_path(db_path, collection)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(str(time.time()), encoding="utf-8")
+
+
+def read_generation(db_path: str | Path, collection: str) -> float:
+    """세대 값(파일 mtime). 파일이 없으면 0."""
+    try:
+        return generation_path(db_path, collection).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+__all__ = [
+    "normalize_question",
+    "LRUCache",
+    "EmbeddingCache",
+    "AnswerCache",
+    "bump_generation",
+    "read_generation",
+]
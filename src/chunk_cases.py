@@ -1,12 +1,13 @@
 # [RAG][chunker]
-# 역할: TEXT_KEYS에서 본문 추출 후 정규화(BOM 제거/NFC) → chunk_size/overlap으로 분할.
+# 역할: TEXT_KEYS에서 본문 추출 후 정규화(BOM 제거/NFC) → 구조 인식 청커(src.chunker)로 분할.
+# - --chunker legal: 【주 문】/【이 유】, [n] 판시사항, 1./가. 경계 → 문장 → 길이 순 폴백(기본).
+# - --chunker fixed: 기존 chunk_size/overlap 고정 길이 창.
 # TODO:
 # - 인코딩/모지바케 정규화 강화.
-# - 문단/문장 경계 기반 분할 옵션(sentencize) 추가.
 import argparse, json, uuid, datetime, unicodedata
 from pathlib import Path
 from typing import Dict, Any, Iterable, List
-from src.retriever import split_text  # 기존 함수 그대로 재사용
+from src.chunker import build_chunker, chunk_metadata, detect_kind
 
 TEXT_KEYS = ["full_text", "summary", "text", "content", "body", "judgment", "opinion", "raw_text"]
 ID_KEYS   = ["case_id", "case_no", "id", "doc_id", "uid"]
@@ -45,6 +46,7 @@ def main():
     ap.add_argument("--in", dest="inp", required=True, help="원본 cases.jsonl 경로 (data/raw/..)")
     ap.add_argument("--chunk-size", type=int, default=800)
     ap.add_argument("--overlap", type=int, default=120)
+    ap.add_argument("--chunker", choices=["legal", "fixed"], default="legal")
     ap.add_argument("--outdir", default="data/processed", help="청크 파일 저장 폴더")
     args = ap.parse_args()
 
@@ -53,6 +55,7 @@ def main():
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     out_path = outdir / f"chunks_{ts}.jsonl"
 
+    chunker = build_chunker(args.chunker, args.chunk_size, args.overlap)
     total, with_text, chunks_out = 0, 0, 0
     with out_path.open("w", encoding="utf-8") as wf:
         for rec in read_records(src_path):
@@ -64,9 +67,10 @@ def main():
             case_id = pick(rec, ID_KEYS) or f"case-{uuid.uuid4().hex[:8]}"
             source  = rec.get("source") or src_path.as_posix()
 
-            parts = split_text(text, args.chunk_size, args.overlap) or []
-            for i, ch in enumerate(parts):
-                ch = normalize(ch)
+            kind = detect_kind(text)
+            parts = chunker.chunk(text, kind)
+            for i, c in enumerate(parts):
+                ch = normalize(c.text)
                 # ingest에서 바로 쓸 수 있도록 'text' 키로 저장
                 out = {
                     "text": ch,
@@ -74,6 +78,7 @@ def main():
                     "chunk_idx": i,
                     "doc_type": "case",
                     "case_id": case_id,
+                    **chunk_metadata(c, kind),
                 }
                 wf.write(json.dumps(out, ensure_ascii=False) + "\n")
                 chunks_out += 1
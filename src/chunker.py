@@ -0,0 +1,339 @@
+# [RAG][chunker][legal]
+# 역할: 법령/판결 구조 단위 청킹. 고정 길이 창(split_text)이 조문·판시사항을 중간에서 자르는 문제 해결.
+# - 법령: 편 > 장 > 절 > 관 > 조 > 항(①) > 호(1.) > 목(가.) 경계로 분할.
+# - 판결: 【주 문】/【이 유】 등 섹션 > [n] 판시사항 > 1. > 가. > 1) > 가) > (1) 경계로 분할.
+# - 구조 단위가 chunk_size보다 크면 한 단계 아래 구조 → 문장 → 길이(overlap) 순으로 폴백.
+# - 같은 단계의 작은 단위(짧은 조문, 당사자 표시 등)는 chunk_size까지 묶음(상위 경계는 넘지 않음).
+# - 청크마다 구조 경로(예: "제2장 > 제60조 > 제1항")를 남겨 메타데이터(struct_path)로 저장.
+# - 빠른 경로: 구조 표지가 전혀 없으면 정규식 한 번 검사 후 바로 고정 길이 분할.
+# TODO:
+# - 판례공보 쪽머리(쪽번호/"판례공보 2025. 6. 15.") 제거.
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+# chunk_params()에 들어가는 청커 버전. 분할 규칙이 바뀌면 올려서 기존 청크 ID를 무효화
+FIXED_VERSION = "v1"
+LEGAL_VERSION = "legal-v1"
+
+STATUTE = "statute"
+RULING = "ruling"
+PLAIN = "plain"
+
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """고정 길이 창 분할(overlap 포함). 구조가 없는 문서와 최종 폴백에 사용."""
+    if not text:
+        return []
+    chunks: List[str] = []
+    start = 0
+    end = max(chunk_size, 1)
+    length = len(text)
+    while start < length:
+        chunk = text[start:end]
+        chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - chunk_overlap, 0)
+        end = min(start + chunk_size, length)
+    return chunks
+
+
+@dataclass
+class Chunk:
+    text: str
+    path: Tuple[str, ...] = ()
+    unit: str = "structure"  # structure | sentence | line | window
+
+    @property
+    def path_str(self) -> str:
+        return " > ".join(self.path)
+
+
+@dataclass(frozen=True)
+class _Level:
+    name: str
+    pattern: "re.Pattern[str]"
+    carry: bool = False  # 하위 분할된 청크 앞에 이 단계의 제목을 반복(예: "제60조(연차 유급휴가)")
+    container: bool = False  # 편/장/섹션처럼 묶음 단위 → 통째로 들어간 청크에도 하위 범위(제1조~제3조)를 경로에 표시
+
+
+def _line_re(body: str) -> "re.Pattern[str]":
+    # 줄 머리(앞 공백 허용)에서만 인정 → 본문 중간의 "제3조에 따라" 같은 인용은 제외
+    return re.compile(r"(?m)^[ \t　\ufeff]*(" + body + r")")
+
+
+_CIRCLED = "①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮⑯⑰⑱⑲⑳"
+# 줄 머리에 온 조문 인용("제3조에 따른", "제3조 제1항")은 제목이 아님
+_REF_TAIL = r"(?!\s*(?:에|의|및|또는|부터|까지|제\s*\d+\s*[항호]|[,·]))"
+
+STATUTE_LEVELS: Tuple[_Level, ...] = (
+    _Level("편", _line_re(r"제\s*\d+\s*편" + _REF_TAIL), container=True),
+    _Level("장", _line_re(r"제\s*\d+\s*장" + _REF_TAIL), container=True),
+    _Level("절", _line_re(r"제\s*\d+\s*절" + _REF_TAIL), container=True),
+    _Level("관", _line_re(r"제\s*\d+\s*관" + _REF_TAIL), container=True),
+    _Level("조", _line_re(r"제\s*\d+\s*조(?:\s*의\s*\d+)?" + _REF_TAIL + r"(?:\s*\([^()\n]{1,40}\))?"), carry=True),
+    _Level("항", _line_re(f"[{_CIRCLED}]")),
+    _Level("호", _line_re(r"\d{1,3}\.(?=\s)")),
+    _Level("목", _line_re(r"[가-하]\.(?=\s)")),
+)
+
+RULING_LEVELS: Tuple[_Level, ...] = (
+    _Level("섹션", _line_re(r"【[^】\n]{1,30}】"), container=True),
+    _Level("판시", _line_re(r"\[\d{1,2}\]"), carry=True),
+    _Level("1.", _line_re(r"\d{1,2}\.(?=\s)")),
+    _Level("가.", _line_re(r"[가-하]\.(?=\s)")),
+    _Level("1)", _line_re(r"\d{1,2}\)(?=\s)")),
+    _Level("가)", _line_re(r"[가-하]\)(?=\s)")),
+    _Level("(1)", _line_re(r"\(\d{1,2}\)(?=\s)")),
+)
+
+# 구조 표지가 없는 일반 문서는 번호 매김(1. 가. 1) ...)만 사용
+PLAIN_LEVELS: Tuple[_Level, ...] = RULING_LEVELS[2:]
+
+# 빠른 경로/종류 판별용
+_ARTICLE_HEAD = STATUTE_LEVELS[4].pattern
+_RULING_HEAD = re.compile(r"(?m)^[ \t　\ufeff]*(?:【[^】\n]{1,30}】|\[\d{1,2}\])")
+# 문장 끝: "~다." "~함." 등 + 공백, 또는 빈 줄. "2015. 9. 24." 같은 날짜는 자르지 않음
+_SENT_RE = re.compile(r"(?<=[다음함임요까])[.?!][\s]+|\n[ \t]*\n")
+_LINE_RE = re.compile(r"\n")
+
+
+def detect_kind(text: str) -> str:
+    """법령(조문 제목 2개 이상 또는 문서가 조문으로 시작) / 판결 / 일반 텍스트 판별."""
+    heads = _ARTICLE_HEAD.findall(text, 0, 20000)
+    if len(heads) >= 2 or (heads and _ARTICLE_HEAD.match(text)):
+        return STATUTE
+    if _RULING_HEAD.search(text):
+        return RULING
+    return PLAIN
+
+
+def _label(level: _Level, head: str) -> str:
+    head = head.strip()
+    if level.name == "항":
+        return f"제{_CIRCLED.index(head) + 1}항"
+    if level.name == "호":
+        return f"제{head.rstrip('.')}호"
+    if level.name == "목":
+        return f"{head.rstrip('.')}목"
+    if level.name in ("편", "장", "절", "관", "조"):
+        return re.sub(r"\s+", "", head.split("(")[0])
+    if level.name == "섹션":
+        return re.sub(r"\s+", "", head.strip("【】"))
+    return head
+
+
+def _merge_path(a: Tuple[str, ...], b: Tuple[str, ...]) -> Tuple[str, ...]:
+    """묶인 청크의 경로: 공통 접두 + 처음~마지막 라벨(예: 제1조~제3조)."""
+    n = 0
+    while n < len(a) and n < len(b) and a[n] == b[n]:
+        n += 1
+    if n < len(a) and n < len(b):
+        return a[:n] + (f"{a[n].split('~')[0]}~{b[n].split('~')[-1]}",)
+    # 한쪽이 상위 경로(머리말 + 첫 하위 단위)면 하위 단위 라벨까지 유지
+    longer = a if len(a) > len(b) else b
+    return longer[:n + 1]
+
+
+class LegalChunker:
+    """구조 인식 청커. 한 번 만들어 여러 문서에 재사용(정규식은 모듈 로드 시 컴파일)."""
+
+    version = LEGAL_VERSION
+
+    def __init__(self, chunk_size: int = 800, chunk_overlap: int = 120, min_chars: int = 80) -> None:
+        self.chunk_size = max(int(chunk_size), 1)
+        self.chunk_overlap = max(int(chunk_overlap), 0)
+        self.min_chars = max(int(min_chars), 0)
+
+    # ---------------- public ----------------
+    def chunk(self, text: str, kind: Optional[str] = None) -> List[Chunk]:
+        if not text or not text.strip():
+            return []
+        text = text.lstrip("\ufeff")
+        kind = kind or detect_kind(text)
+        # 빠른 경로: chunk_size 이하의 일반 문서는 정규식 검사 없이 통째로
+        if kind == PLAIN and len(text) <= self.chunk_size:
+            return [Chunk(text.strip(), (), "structure")]
+        levels = STATUTE_LEVELS if kind == STATUTE else RULING_LEVELS if kind == RULING else PLAIN_LEVELS
+        out = self._split(text, levels, (), "")
+        return [c for c in out if c.text.strip()]
+
+    def split(self, text: str, kind: Optional[str] = None) -> List[str]:
+        """split_text와 같은 형태(문자열 목록)로 반환."""
+        return [c.text for c in self.chunk(text, kind)]
+
+    # ---------------- internals ----------------
+    def _split(self, text: str, levels: Sequence[_Level], path: Tuple[str, ...], carry: str) -> List[Chunk]:
+        for i, level in enumerate(levels):
+            heads = list(level.pattern.finditer(text))
+            if not heads:
+                continue
+            segs: List[Tuple[Tuple[str, ...], str, str, bool]] = []  # (path, text, heading, carry)
+            pre = text[:heads[0].start(1)]
+            if pre.strip():
+                segs.append((path, pre, "", False))
+            for j, m in enumerate(heads):
+                end = heads[j + 1].start(1) if j + 1 < len(heads) else len(text)
+                seg_text = text[m.start(1):end]
+                seg_path = path + (_label(level, m.group(1)),)
+                if level.container and len(seg_text) <= self.chunk_size:
+                    seg_path += self._span(seg_text[len(m.group(1)):], levels[i+1:])
+                segs.append((seg_path, seg_text, m.group(1).strip(), level.carry))
+            return self._pack(segs, levels[i+1:], carry)
+        return self._by_sentence(text, path, carry)
+
+    @staticmethod
+    def _span(text: str, lower: Sequence[_Level]) -> Tuple[str, ...]:
+        """통째로 들어가는 묶음 단위 안의 첫~마지막 하위 라벨."""
+        for level in lower:
+            heads = [_label(level, m.group(1)) for m in level.pattern.finditer(text)]
+            if heads:
+                return (heads[0],) if len(heads) == 1 else (f"{heads[0]}~{heads[-1]}",)
+        return ()
+
+    def _pack(self, segs, lower: Sequence[_Level], carry: str) -> List[Chunk]:
+        """같은 단계 조각을 chunk_size까지 묶고, 큰 조각은 하위 구조로 재귀 분할."""
+        out: List[Chunk] = []
+        cur_text, cur_path, last_path = "", None, ()
+        limit = self.chunk_size - (len(carry) + 1 if carry else 0)
+
+        def flush() -> None:
+            nonlocal cur_text, cur_path
+            if cur_text.strip():
+                out.append(Chunk(cur_text.strip(), _merge_path(cur_path, last_path), "structure"))
+            cur_text, cur_path = "", None
+
+        for seg_path, seg_text, heading, seg_carry in segs:
+            if len(seg_text) > limit:
+                flush()
+                sub_carry = heading if seg_carry else carry
+                out.extend(self._split(seg_text, lower, seg_path, sub_carry))
+                continue
+            # 자투리(min_chars 미만)는 한도를 min_chars만큼 넘더라도 이웃에 붙임
+            small = min(len(cur_text.strip()), len(seg_text.strip())) < self.min_chars
+            if cur_path is not None and len(cur_text) + len(seg_text) <= limit + (self.min_chars if small else 0):
+                cur_text = cur_text.rstrip() + "\n" + seg_text.lstrip()
+            else:
+                flush()
+                cur_text, cur_path = seg_text, seg_path
+            last_path = seg_path
+        flush()
+        # 재귀 분할된 조각 앞뒤에 남은 작은 구조 청크(제목만 있는 섹션 등)는 이웃 청크와 합침(단위를 자르지는 않음)
+        merged: List[Chunk] = []
+        for c in out:
+            prev = merged[-1] if merged else None
+            if (prev is not None and prev.unit == c.unit == "structure"
+                    and len(prev.text) + len(c.text) + 1 <= limit):
+                prev.text = prev.text + "\n" + c.text
+                prev.path = _merge_path(prev.path, c.path)
+            else:
+                merged.append(c)
+        out = merged
+        # 상위 제목 반복: 조문/판시사항이 여러 청크로 나뉘면 두 번째 청크부터 제목을 앞에 붙임
+        if carry:
+            for c in out:
+                if not c.text.startswith(carry):
+                    c.text = f"{carry} {c.text}"
+        return out
+
+    def _by_sentence(self, text: str, path: Tuple[str, ...], carry: str = "") -> List[Chunk]:
+        """문장 경계 → 줄 경계 → 고정 길이 순으로 chunk_size까지 묶음."""
+        budget = self.chunk_size - (len(carry) + 1 if carry else 0)
+        if len(text) <= budget:
+            return [Chunk(text.strip(), path, "structure")]
+        out = [Chunk(t, path, unit) for t, unit in self._pack_pieces(_pieces(text, _SENT_RE), budget, "sentence") if t]
+        if carry:
+            for c in out:
+                if not c.text.startswith(carry):
+                    c.text = f"{carry} {c.text}"
+        return out
+
+    def _pack_pieces(self, pieces: List[str], budget: int, unit: str) -> List[Tuple[str, str]]:
+        """조각을 budget까지 묶고, 이웃 청크와 overlap 이내의 꼬리 조각을 공유."""
+        out: List[Tuple[str, str]] = []
+        cur: List[str] = []
+        cur_len = 0
+        for s in pieces:
+            if len(s) > budget:
+                if cur:
+                    out.append(("".join(cur).strip(), unit))
+                    cur, cur_len = [], 0
+                if unit == "sentence":
+                    out.extend(self._pack_pieces(_pieces(s, _LINE_RE), budget, "line"))
+                else:
+                    out.extend((w.strip(), "window") for w in split_text(s, budget, self.chunk_overlap))
+                continue
+            if cur and cur_len + len(s) > budget:
+                out.append(("".join(cur).strip(), unit))
+                tail: List[str] = []
+                tail_len = 0
+                for prev in reversed(cur):
+                    if tail_len + len(prev) > self.chunk_overlap or tail_len + len(prev) + len(s) > budget:
+                        break
+                    tail.insert(0, prev)
+                    tail_len += len(prev)
+                cur, cur_len = tail, tail_len
+            cur.append(s)
+            cur_len += len(s)
+        if cur:
+            out.append(("".join(cur).strip(), unit))
+        return out
+
+
+def _pieces(text: str, sep: "re.Pattern[str]") -> List[str]:
+    """구분자를 앞 조각에 붙여 둔 채로 분할(이어 붙이면 원문)."""
+    out: List[str] = []
+    last = 0
+    for m in sep.finditer(text):
+        out.append(text[last:m.end()])
+        last = m.end()
+    if last < len(text):
+        out.append(text[last:])
+    return out
+
+
+class FixedChunker:
+    """기존 고정 길이 분할(split_text)을 같은 인터페이스로 감싼 것."""
+
+    version = FIXED_VERSION
+
+    def __init__(self, chunk_size: int = 800, chunk_overlap: int = 120) -> None:
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def chunk(self, text: str, kind: Optional[str] = None) -> List[Chunk]:
+        return [Chunk(t, (), "window") for t in split_text(text, self.chunk_size, self.chunk_overlap)]
+
+    def split(self, text: str, kind: Optional[str] = None) -> List[str]:
+        return split_text(text, self.chunk_size, self.chunk_overlap)
+
+
+def build_chunker(name: str = "legal", chunk_size: int = 800, chunk_overlap: int = 120):
+    """config.yaml retriever.chunker 값("legal" | "fixed")으로 청커 생성."""
+    if (name or "legal").lower() == "fixed":
+        return FixedChunker(chunk_size, chunk_overlap)
+    return LegalChunker(chunk_size, chunk_overlap)
+
+
+def chunk_metadata(chunk: Chunk, kind: str) -> dict:
+    """청크 메타데이터에 합칠 구조 정보(Chroma 메타는 스칼라만 허용 → 문자열)."""
+    return {"struct_path": chunk.path_str, "struct_kind": kind, "struct_unit": chunk.unit}
+
+
+__all__ = [
+    "split_text",
+    "Chunk",
+    "LegalChunker",
+    "FixedChunker",
+    "build_chunker",
+    "chunk_metadata",
+    "detect_kind",
+    "STATUTE",
+    "RULING",
+    "PLAIN",
+    "FIXED_VERSION",
+    "LEGAL_VERSION",
+]
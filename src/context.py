@@ -0,0 +1,218 @@
+# [RAG][context]
+# 역할: 검색 청크를 모델 컨텍스트 예산(토큰) 안에 점수 순으로 채워 프롬프트용 참고 자료 블록 구성.
+# - 토큰 추정: 모델 계열별 문자/토큰 비율(한글·한자 / 그 외)로 근사. 토크나이저 로드 없이 보수적으로.
+# - 같은 문서의 인접 청크(chunk_idx 연속)는 하나로 합치고, 청킹 overlap(기본 120자) 중복 구간을 잘라냄.
+# - 예산을 넘는 청크는 버리고 개수/토큰을 PackResult로 보고(최고 점수 청크는 잘라서라도 포함).
+# TODO:
+# - (선택) Ollama prompt_eval_count로 모델별 비율 보정.
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# (모델명 접두어, 한글 문자/토큰, 그 외 문자/토큰). 앞에서부터 첫 일치 사용, 모르는 모델은 마지막 기본값.
+# 한글은 어휘에 따라 음절당 0.5~1토큰이라 편차가 크므로 작게(=토큰 많게) 잡는다.
+TOKEN_RATES: List[Tuple[str, float, float]] = [
+    ("exaone", 2.0, 3.5),
+    ("gemma", 1.6, 3.5),
+    ("qwen", 1.2, 3.2),
+    ("llama", 1.0, 3.5),
+    ("mistral", 0.8, 3.0),
+    ("", 1.0, 3.0),
+]
+
+_WIDE_RE = re.compile(r"[가-힣㄰-㆏一-鿿㐀-䶿豈-﫿]")
+# 인접 청크 연결부 탐색 범위: overlap 앞에 붙는 상위 제목(carry) 여유
+_HEAD_SLACK = 80
+_MIN_OVERLAP = 16
+
+
+def _rates(model: Optional[str]) -> Tuple[float, float]:
+    name = (model or "").lower().rsplit("/", 1)[-1]
+    for prefix, wide, other in TOKEN_RATES:
+        if name.startswith(prefix):
+            return wide, other
+    return TOKEN_RATES[-1][1], TOKEN_RATES[-1][2]
+
+
+def _counts(text: str) -> Tuple[int, int]:
+    wide = len(_WIDE_RE.findall(text))
+    return wide, len(text) - wide
+
+
+def _tokens(wide: int, other: int, model: Optional[str]) -> int:
+    wide_rate, other_rate = _rates(model)
+    return int(math.ceil(wide / wide_rate + other / other_rate))
+
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """대상 모델 기준 대략적인 토큰 수(상한 쪽으로 근사)."""
+    if not text:
+        return 0
+    return _tokens(*_counts(text), model)
+
+
+def trim_overlap(prev: str, nxt: str, max_overlap: int = 200) -> str:
+    """prev 끝과 겹치는 nxt 앞부분(overlap, 그 앞의 carry 제목 포함)을 잘라낸 나머지."""
+    a, b = prev.rstrip(), nxt.lstrip()
+    hi = min(len(a), len(b), max_overlap)
+    for k in range(hi, _MIN_OVERLAP - 1, -1):
+        pos = b.find(a[-k:], 0, k + _HEAD_SLACK)
+        if pos >= 0:
+            return b[pos + k:]
+    return b
+
+
+def _doc_key(c: Dict[str, Any]) -> Tuple[Any, Any]:
+    meta = c.get("metadata") or {}
+    return meta.get("source"), meta.get("case_id")
+
+
+def _chunk_idx(c: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int((c.get("metadata") or {}).get("chunk_idx"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _label(c: Dict[str, Any]) -> str:
+    meta = c.get("metadata") or {}
+    return c.get("source_id") or f"{meta.get('source')}#chunk{meta.get('chunk_idx')}"
+
+
+@dataclass
+class PackResult:
+    text: str = ""
+    used: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+    tokens: int = 0
+    dropped_tokens: int = 0
+    trimmed_chars: int = 0
+    budget: int = 0
+    truncated: bool = False
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "context_budget": self.budget,
+            "context_tokens": self.tokens,
+            "context_chunks": len(self.used),
+            "context_dropped": len(self.dropped),
+            "context_dropped_tokens": self.dropped_tokens,
+            "context_trimmed_chars": self.trimmed_chars,
+        }
+
+
+def _groups(chosen: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """선택된 청크를 (문서, chunk_idx 연속) 묶음으로. 묶음 순서는 묶음 내 최고 순위 기준."""
+    rank = {id(c): i for i, c in enumerate(chosen)}
+    by_doc: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+    for c in chosen:
+        by_doc.setdefault(_doc_key(c), []).append(c)
+    groups: List[List[Dict[str, Any]]] = []
+    for items in by_doc.values():
+        items.sort(key=lambda c: (_chunk_idx(c) is None, _chunk_idx(c) or 0))
+        run: List[Dict[str, Any]] = []
+        for c in items:
+            idx = _chunk_idx(c)
+            if run and (idx is None or _chunk_idx(run[-1]) is None or idx != _chunk_idx(run[-1]) + 1):
+                groups.append(run)
+                run = []
+            run.append(c)
+        if run:
+            groups.append(run)
+    groups.sort(key=lambda g: min(rank[id(c)] for c in g))
+    return groups
+
+
+class _Renderer:
+    """묶음 단위 렌더링 + (한글, 그 외) 문자 수 캐시. 청크를 하나씩 더해 보며 예산을 재는 데 사용."""
+
+    def __init__(self, max_overlap: int) -> None:
+        self.max_overlap = max_overlap
+        self._trim: Dict[Tuple[int, int], str] = {}
+        self._parts: Dict[Tuple[int, ...], Tuple[str, int, int, int]] = {}
+
+    def _rest(self, prev: Dict[str, Any], c: Dict[str, Any]) -> str:
+        key = (id(prev), id(c))
+        if key not in self._trim:
+            self._trim[key] = trim_overlap(prev.get("text") or "", (c.get("text") or "").strip(), self.max_overlap)
+        return self._trim[key]
+
+    def part(self, g: List[Dict[str, Any]]) -> Tuple[str, int, int, int]:
+        """(블록 텍스트, 한글 수, 그 외 수, 잘라낸 문자 수)"""
+        key = tuple(id(c) for c in g)
+        if key not in self._parts:
+            texts, trimmed = [(g[0].get("text") or "").strip()], 0
+            for prev, c in zip(g, g[1:]):
+                rest = self._rest(prev, c)
+                trimmed += len((c.get("text") or "").strip()) - len(rest)
+                texts.append(rest)
+            label = _label(g[0]) if len(g) == 1 else f"{_label(g[0])}~{_chunk_idx(g[-1])}"
+            text = f"[{label}]\n" + "\n".join(t for t in texts if t)
+            self._parts[key] = (text, *_counts(text), trimmed)
+        return self._parts[key]
+
+    def render(self, groups: List[List[Dict[str, Any]]], model: Optional[str]) -> Tuple[str, int, int]:
+        """(참고 자료 텍스트, 추정 토큰, 잘라낸 문자 수)"""
+        parts = [self.part(g) for g in groups]
+        wide = sum(p[1] for p in parts)
+        other = sum(p[2] for p in parts) + 2 * max(len(parts) - 1, 0)  # 블록 사이 "\n\n"
+        text = "\n\n".join(p[0] for p in parts)
+        return text, _tokens(wide, other, model), sum(p[3] for p in parts)
+
+
+def pack_context(
+    chunks: Sequence[Dict[str, Any]],
+    budget: int,
+    model: Optional[str] = None,
+    max_overlap: int = 200,
+) -> PackResult:
+    """점수 높은 순으로 예산(토큰)을 채우고, 인접 청크를 합쳐 참고 자료 블록을 만든다.
+
+    budget <= 0이면 예산 없이 전부 사용. 점수가 없는 청크가 섞여 있으면 입력 순서를 순위로 본다.
+    """
+    items = [c for c in chunks if (c.get("text") or "").strip()]
+    if all(isinstance(c.get("score"), (int, float)) for c in items):
+        items.sort(key=lambda c: -float(c["score"]))
+
+    res = PackResult(budget=max(int(budget), 0))
+    renderer = _Renderer(max_overlap)
+    if not res.budget:
+        chosen = items
+        res.text, res.tokens, res.trimmed_chars = renderer.render(_groups(chosen), model)
+    else:
+        chosen = []
+        for c in items:
+            trial = chosen + [c]
+            text, tokens, trimmed = renderer.render(_groups(trial), model)
+            if tokens > res.budget:
+                res.dropped.append(c)
+                continue
+            chosen, res.text, res.tokens, res.trimmed_chars = trial, text, tokens, trimmed
+
+    if not chosen and res.dropped:
+        # 최고 점수 청크 하나도 안 들어가면 예산만큼 잘라서라도 근거로 남김
+        top = dict(res.dropped.pop(0))
+        body = (top.get("text") or "").strip()
+        lo, hi = 0, len(body)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            top["text"] = body[:mid]
+            if estimate_tokens(_Renderer(max_overlap).part([top])[0], model) <= res.budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        top["text"] = body[:lo]
+        chosen = [top]
+        res.text, res.tokens, _ = _Renderer(max_overlap).render([[top]], model)
+        res.truncated = True
+        res.dropped_tokens += estimate_tokens(body[lo:], model)
+
+    res.used = chosen
+    res.dropped_tokens += sum(estimate_tokens(c.get("text") or "", model) for c in res.dropped)
+    return res
+
+
+__all__ = ["TOKEN_RATES", "PackResult", "estimate_tokens", "pack_context", "trim_overlap"]
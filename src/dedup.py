@@ -0,0 +1,293 @@
+# [RAG][ingest][dedup]
+# 역할: 적재 시 near-duplicate 청크 제거(MinHash + LSH 밴딩).
+# - 공백을 지운 본문의 문자 5-gram shingle → MinHash 서명(num_perm개, 고정 seed → 실행 간 동일).
+# - 서명을 bands개 구간으로 나눠 버킷팅 → 같은 버킷 후보만 추정 Jaccard/포함도(containment) 비교.
+# - 판례 재수록/같은 판시사항 반복처럼 기존 청크와 거의 같거나(Jaccard) 기존 청크에 포함된(요약 ⊂ 전문) 새 청크는
+#   임베딩하지 않고 정본(canonical) 청크 ID에 링크만 남김.
+# - vectorstore/dedup/<컬렉션>.npz 로 저장 → 다음 실행에서도 이어서 판정.
+# - 정본 청크가 삭제되면 링크를 끊음 → 그 문서는 다음 적재 때 '변경'으로 감지되어 다시 추가됨.
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+_PRIME = np.uint64(4294967311)  # 2^32보다 큰 소수
+_WS_RE = re.compile(r"\s+")
+
+
+def _shingles(text: str, k: int) -> np.ndarray:
+    s = _WS_RE.sub("", unicodedata.normalize("NFC", text or ""))
+    if len(s) <= k:
+        grams = {s}
+    else:
+        grams = {s[i:i+k] for i in range(len(s) - k + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class NearDupIndex:
+    """청크 ID → MinHash 서명. LSH 버킷으로 후보를 찾아 near-duplicate 정본 ID를 돌려줌."""
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        threshold: float = 0.85,
+        shingle: int = 5,
+        seed: int = 1,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm은 bands의 배수여야 합니다.")
+        self.num_perm = int(num_perm)
+        self.bands = int(bands)
+        self.rows = self.num_perm // self.bands
+        self.threshold = float(threshold)
+        self.shingle = int(shingle)
+        self.seed = int(seed)
+        rng = np.random.RandomState(self.seed)
+        self._a = rng.randint(1, 2**32 - 1, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2**32 - 1, size=self.num_perm, dtype=np.uint64)
+
+        self.ids: List[Optional[str]] = []          # 위치 → 청크 ID(삭제 시 None)
+        self.sizes: List[int] = []                  # shingle 개수(포함도 추정용)
+        self._sigs: List[np.ndarray] = []
+        self.id_to_idx: Dict[str, int] = {}
+        self.buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        # doc_key → {중복 청크 ID: 정본 청크 ID}
+        self.links: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.id_to_idx)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.id_to_idx
+
+    # --- 서명 ---
+    def signature(self, text: str) -> Tuple[np.ndarray, int]:
+        sh = _shingles(text, self.shingle)
+        # (a*x mod p + b) mod p: a, x < 2^32 → 곱이 uint64 범위 안
+        h = ((self._a[:, None] * sh[None, :]) % _PRIME + self._b[:, None]) % _PRIME
+        return h.min(axis=1).astype(np.uint32), int(sh.size)
+
+    def _band_keys(self, sig: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(b, sig[b * self.rows:(b + 1) * self.rows].tobytes()) for b in range(self.bands)]
+
+    # --- 조회/등록 ---
+    def find(self, sig: np.ndarray, size: int) -> Optional[str]:
+        """가장 비슷한 정본 청크 ID(임계값 미만이면 None)."""
+        best, best_score = None, 0.0
+        with self._lock:
+            seen: Set[int] = set()
+            for key in self._band_keys(sig):
+                for idx in self.buckets.get(key, ()):
+                    if idx in seen or self.ids[idx] is None:
+                        continue
+                    seen.add(idx)
+                    j = float(np.mean(self._sigs[idx] == sig))
+                    # 포함도 |A∩B|/|A| = J(|A|+|B|)/((1+J)|A|), A=새 청크
+                    contain = j * (size + self.sizes[idx]) / ((1.0 + j) * max(size, 1))
+                    score = max(j, min(contain, 1.0))
+                    if score >= self.threshold and score > best_score:
+                        best, best_score = self.ids[idx], score
+        return best
+
+    def add(self, chunk_id: str, sig: np.ndarray, size: int) -> None:
+        with self._lock:
+            if chunk_id in self.id_to_idx:
+                return
+            idx = len(self.ids)
+            self.ids.append(chunk_id)
+            self.sizes.append(size)
+            self._sigs.append(sig)
+            self.id_to_idx[chunk_id] = idx
+            for key in self._band_keys(sig):
+                self.buckets.setdefault(key, []).append(idx)
+
+    def check_and_add(self, chunk_id: str, text: str) -> Optional[str]:
+        """near-duplicate면 정본 ID 반환(등록 안 함), 아니면 등록 후 None."""
+        sig, size = self.signature(text)
+        with self._lock:
+            canonical = self.find(sig, size)
+            if canonical is None:
+                self.add(chunk_id, sig, size)
+            return canonical
+
+    def link(self, doc_key: str, dup_id: str, canonical_id: str) -> None:
+        with self._lock:
+            self.links.setdefault(doc_key, {})[dup_id] = canonical_id
+
+    def linked_ids(self, doc_key: str) -> Dict[str, str]:
+        return dict(self.links.get(doc_key) or {})
+
+    def unlink(self, doc_key: str, dup_ids: Iterable[str]) -> None:
+        with self._lock:
+            group = self.links.get(doc_key)
+            if not group:
+                return
+            for d in dup_ids:
+                group.pop(d, None)
+            if not group:
+                self.links.pop(doc_key, None)
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """정본 청크 삭제(버킷에서는 지연 제거). 이 청크를 가리키던 링크도 끊음."""
+        n = 0
+        with self._lock:
+            gone = set()
+            for chunk_id in ids:
+                idx = self.id_to_idx.pop(chunk_id, None)
+                if idx is not None:
+                    self.ids[idx] = None
+                    gone.add(chunk_id)
+                    n += 1
+            if gone:
+                for doc_key in list(self.links):
+                    group = {d: c for d, c in self.links[doc_key].items() if c not in gone}
+                    if group:
+                        self.links[doc_key] = group
+                    else:
+                        self.links.pop(doc_key)
+        return n
+
+    @property
+    def duplicates(self) -> int:
+        return sum(len(g) for g in self.links.values())
+
+    # --- 영속화 ---
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            live = [i for i, cid in enumerate(self.ids) if cid is not None]
+            sigs = np.stack([self._sigs[i] for i in live]) if live else np.zeros((0, self.num_perm), np.uint32)
+            meta = {
+                "num_perm": self.num_perm, "bands": self.bands, "threshold": self.threshold,
+                "shingle": self.shingle, "seed": self.seed, "links": self.links,
+            }
+            ids = np.array([self.ids[i] for i in live], dtype=object)
+            sizes = np.array([self.sizes[i] for i in live], dtype=np.int64)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(tmp, sigs=sigs, sizes=sizes, ids=ids.astype(str), meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | Path, threshold: Optional[float] = None) -> "NearDupIndex":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            idx = cls(
+                num_perm=int(meta["num_perm"]), bands=int(meta["bands"]),
+                threshold=float(threshold if threshold is not None else meta["threshold"]),
+                shingle=int(meta["shingle"]), seed=int(meta["seed"]),
+            )
+            for cid, sig, size in zip(data["ids"].tolist(), data["sigs"], data["sizes"].tolist()):
+                idx.add(cid, sig.astype(np.uint32), int(size))
+        idx.links = {k: dict(v) for k, v in (meta.get("links") or {}).items()}
+        return idx
+
+
+def index_path(db_path: str | Path, collection_name: str) -> Path:
+    """벡터스토어 옆(하위 dedup/)에 컬렉션별 서명 파일."""
+    return Path(db_path) / "dedup" / f"{collection_name}.npz"
+
+
+def load_or_create(db_path: str | Path, collection_name: str, **kwargs) -> NearDupIndex:
+    p = index_path(db_path, collection_name)
+    if p.exists():
+        try:
+            return NearDupIndex.load(p, threshold=kwargs.get("threshold"))
+        except Exception:
+            import traceback; traceback.print_exc()
+    return NearDupIndex(**kwargs)
+
+
+def from_retriever(retriever) -> Optional[NearDupIndex]:
+    """config.yaml `dedup:` 설정으로 현재 컬렉션의 인덱스를 로드. enabled=false면 None."""
+    cfg = retriever.config.get("dedup") or {}
+    if not cfg.get("enabled", True):
+        return None
+    return load_or_create(
+        retriever.db_path,
+        retriever.collection_name,
+        num_perm=int(cfg.get("num_perm", 64)),
+        bands=int(cfg.get("bands", 16)),
+        threshold=float(cfg.get("threshold", 0.85)),
+        shingle=int(cfg.get("shingle", 5)),
+    )
+
+
+def save_for(retriever, index: Optional[NearDupIndex]) -> None:
+    if index is not None:
+        index.save(index_path(retriever.db_path, retriever.collection_name))
+
+
+def build_from_collection(collection, index: NearDupIndex, batch: int = 1000) -> List[Tuple[str, str]]:
+    """기존 컬렉션을 순서대로 등록. 이미 들어 있는 near-duplicate (중복 ID, 정본 ID) 목록 반환."""
+    dups: List[Tuple[str, str]] = []
+    offset = 0
+    while True:
+        got = collection.get(include=["documents", "metadatas"], limit=batch, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        docs = got.get("documents") or [""] * len(ids)
+        metas = got.get("metadatas") or [{}] * len(ids)
+        for cid, text, meta in zip(ids, docs, metas):
+            canonical = index.check_and_add(cid, text or "")
+            if canonical is not None:
+                index.link((meta or {}).get("doc_key") or cid.split("#")[0], cid, canonical)
+                dups.append((cid, canonical))
+        offset += len(ids)
+    return dups
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="기존 컬렉션으로 near-duplicate 인덱스 구축(--prune: 중복 청크 삭제)")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--collection", default=None, help="대상 컬렉션(기본: config 값)")
+    ap.add_argument("--prune", action="store_true", help="찾은 중복 청크를 컬렉션/BM25 인덱스에서 삭제")
+    args = ap.parse_args()
+
+    from .retriever import Retriever
+
+    r = Retriever(args.config, collection_name=args.collection)
+    cfg = r.config.get("dedup") or {}
+    index = NearDupIndex(
+        num_perm=int(cfg.get("num_perm", 64)),
+        bands=int(cfg.get("bands", 16)),
+        threshold=float(cfg.get("threshold", 0.85)),
+        shingle=int(cfg.get("shingle", 5)),
+    )
+    dups = build_from_collection(r.collection, index)
+    print(f"[INFO] {r.collection_name}: 청크 {len(index) + len(dups)}개 중 near-duplicate {len(dups)}개")
+    if args.prune and dups:
+        r.delete_documents([d for d, _ in dups])
+        r.save_lexical()
+        print(f"[INFO] 중복 청크 {len(dups)}개 삭제(정본 링크 유지)")
+    elif dups:
+        # 삭제하지 않으면 기존 중복은 그대로 두고 링크만 기록(이후 적재분부터 건너뜀)
+        print("[HINT] --prune 으로 기존 중복을 삭제할 수 있습니다.")
+    save_for(r, index)
+    print(f"[DONE] → {index_path(r.db_path, r.collection_name)}")
+
+
+__all__ = [
+    "NearDupIndex",
+    "index_path",
+    "load_or_create",
+    "from_retriever",
+    "save_for",
+    "build_from_collection",
+]
+
+
+if __name__ == "__main__":
+    main()
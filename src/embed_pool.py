@@ -0,0 +1,100 @@
+# [RAG][ingest][embed_pool]
+# 역할: 적재(ingest)용 병렬 임베딩. Chroma 임베딩 함수(단일 프로세스) 대신 워커 프로세스 풀에서 계산.
+# - 워커마다 SentenceTransformer 1개 로드, torch 스레드 수를 제한(코어 과다 구독 방지).
+# - 길이가 비슷한 텍스트끼리 배치 → 패딩 낭비 감소. 결과는 원래 순서로 복원.
+# - 계산된 벡터는 collection.add(embeddings=...)로 바로 전달.
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+_MODEL: Any = None
+
+
+def _init_worker(model_name: str, device: str, torch_threads: int) -> None:
+    global _MODEL
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(max(int(torch_threads), 1))
+    _MODEL = SentenceTransformer(model_name, device=device)
+
+
+def _encode(texts: List[str], batch_size: int) -> List[List[float]]:
+    # Chroma SentenceTransformerEmbeddingFunction 기본값(normalize_embeddings=False)과 동일하게 계산
+    vecs = _MODEL.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return vecs.tolist()
+
+
+def length_batches(texts: Sequence[str], batch_size: int) -> List[List[int]]:
+    """길이순 정렬 후 batch_size씩 묶은 인덱스 목록."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    bs = max(int(batch_size), 1)
+    return [order[i:i+bs] for i in range(0, len(order), bs)]
+
+
+class ParallelEmbedder:
+    """프로세스 풀 기반 임베딩. with 문 또는 close()로 풀을 정리하세요."""
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "cpu",
+        workers: int = 2,
+        batch_size: int = 32,
+        torch_threads: Optional[int] = None,
+    ) -> None:
+        self.model_name = model_name
+        self.device = device
+        self.workers = max(int(workers), 1)
+        self.batch_size = max(int(batch_size), 1)
+        cpus = os.cpu_count() or 1
+        self.torch_threads = torch_threads or max(cpus // self.workers, 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # fork 후 torch 스레드풀 교착을 피하기 위해 spawn 사용
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.device, self.torch_threads),
+            )
+        return self._pool
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        pool = self._get_pool()
+        batches = length_batches(texts, self.batch_size)
+        futures = [pool.submit(_encode, [texts[i] for i in idx], self.batch_size) for idx in batches]
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        for idx, fut in zip(batches, futures):
+            for i, vec in zip(idx, fut.result()):
+                out[i] = vec
+        return out  # type: ignore[return-value]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self) -> "ParallelEmbedder":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def from_retriever(retriever, workers: int, batch_size: int = 32) -> Optional[ParallelEmbedder]:
+    """Retriever와 같은 (모델, 디바이스)로 풀 생성. workers<=0이면 None(Chroma 내장 임베딩 사용)."""
+    if workers <= 0:
+        return None
+    return ParallelEmbedder(retriever.model_name, retriever.device, workers=workers, batch_size=batch_size)
+
+
+__all__ = ["ParallelEmbedder", "length_batches", "from_retriever"]
@@ -0,0 +1,49 @@
+# [RAG][embedder]
+# 역할: 프로세스 전역 임베딩 모델 레지스트리.
+# - (model, device) 키당 SentenceTransformer를 한 번만 로드하고 모든 Retriever가 공유.
+# - 컬렉션이 늘어나도 모델 메모리/기동 시간은 늘지 않음.
+# - chromadb/torch import도 첫 get_embedding_function 호출까지 미룸(서버 import 시간 단축).
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from chromadb.utils import embedding_functions
+
+
+EmbedderKey = Tuple[str, str]
+
+_EMBEDDERS: Dict[EmbedderKey, embedding_functions.SentenceTransformerEmbeddingFunction] = {}
+_LOCK = threading.Lock()
+
+
+def get_embedding_function(
+    model_name: str,
+    device: str = "cpu",
+) -> embedding_functions.SentenceTransformerEmbeddingFunction:
+    """(model, device)별로 하나의 임베딩 함수를 반환합니다. 최초 호출 시에만 모델을 로드합니다."""
+    key: EmbedderKey = (model_name, device)
+    fn = _EMBEDDERS.get(key)
+    if fn is not None:
+        return fn
+    with _LOCK:
+        # 다른 스레드가 먼저 로드했을 수 있으므로 재확인
+        fn = _EMBEDDERS.get(key)
+        if fn is None:
+            from chromadb.utils import embedding_functions
+
+            fn = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=model_name,
+                device=device,
+            )
+            _EMBEDDERS[key] = fn
+    return fn
+
+
+def loaded_embedders() -> List[EmbedderKey]:
+    """현재 로드된 (model, device) 목록."""
+    return list(_EMBEDDERS.keys())
+
+
+__all__ = ["get_embedding_function", "loaded_embedders"]
@@ -0,0 +1,357 @@
+# [RAG][ingest][extract]
+# 역할: data/raw 의 PDF/TXT 본문 추출(PDF는 프로세스 풀) + PDF 디스크 추출 캐시.
+# - 캐시 키: (경로, 크기, mtime) 일치 → 해시 계산 없이 재사용. 불일치 시 내용 해시(sha1)로 다시 조회
+#   → touch/복사/이름 변경된 파일도 재추출하지 않음. 추출기 버전(EXTRACTOR_VERSION)이 바뀌면 전부 무효.
+# - 큰 PDF는 페이지 구간(pages_per_task) 단위로 나눠 여러 워커가 동시에 추출.
+# - iter_documents(): 파일이 끝나는 순서대로 문서를 내보냄 → 추출이 도는 동안 청킹/임베딩 진행.
+# - 파일별 추출 시간/페이지 수/실패는 ExtractReport로 집계(적재 리포트에 포함).
+# TODO:
+# - (선택) 스캔 PDF(텍스트 없음) OCR 폴백.
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 추출 방식이 바뀌면 올려서 캐시 무효화
+EXTRACTOR_VERSION = "pypdf-v1"
+
+TEXT_SUFFIXES = {".txt", ".md"}
+PDF_SUFFIX = ".pdf"
+CACHE_DIR = Path("data/processed/extract_cache")
+
+
+def read_pdf_pages(path: Path, start: int = 0, end: Optional[int] = None) -> Tuple[List[str], int]:
+    """[start, end) 페이지 본문 목록과 추출 실패 페이지 수. 실패한 페이지는 빈 문자열."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(str(path))
+    pages = reader.pages
+    end = len(pages) if end is None else min(end, len(pages))
+    texts: List[str] = []
+    failed = 0
+    for i in range(start, end):
+        try:
+            texts.append(pages[i].extract_text() or "")
+        except Exception:
+            texts.append("")
+            failed += 1
+    return texts, failed
+
+
+def read_pdf(path: Path) -> str:
+    return "\n".join(read_pdf_pages(path)[0])
+
+
+def read_txt(path: Path) -> str:
+    return path.read_text(encoding="utf-8", errors="ignore")
+
+
+def pdf_page_count(path: Path) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(str(path)).pages)
+
+
+def file_hash(path: Path, block: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(block)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def _init_worker() -> None:
+    # 워커가 여러 개일 때 BLAS/토크나이저 스레드 과다 구독 방지
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+
+def _mp_context():
+    # 추출 워커는 torch를 쓰지 않으므로 fork 가능(spawn은 워커마다 __main__=src.ingest → torch/chromadb를 다시 import).
+    # fork가 없는 Windows에서만 spawn.
+    return mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+
+
+def _extract_task(path: str, start: int, end: Optional[int]) -> Dict[str, Any]:
+    """워커 프로세스에서 실행. 예외는 밖으로 던지지 않고 error 문자열로 반환."""
+    t0 = time.perf_counter()
+    try:
+        texts, failed = read_pdf_pages(Path(path), start, end)
+        return {"texts": texts, "failed_pages": failed, "ms": (time.perf_counter() - t0) * 1000.0}
+    except Exception as e:
+        return {"texts": [], "failed_pages": 0, "ms": (time.perf_counter() - t0) * 1000.0,
+                "error": f"{type(e).__name__}: {e}"}
+
+
+class ExtractCache:
+    """추출 결과 디스크 캐시. index.json(경로 → 크기/mtime/해시) + texts/<해시>.txt"""
+
+    def __init__(self, root: Path = CACHE_DIR, version: str = EXTRACTOR_VERSION) -> None:
+        self.root = Path(root)
+        self.version = version
+        self.index_path = self.root / "index.json"
+        self.text_dir = self.root / "texts"
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+            if data.get("version") == version:
+                self.entries = data.get("files") or {}
+        except FileNotFoundError:
+            pass
+        except Exception:
+            traceback.print_exc()
+
+    def _text_path(self, digest: str) -> Path:
+        return self.text_dir / f"{digest}.txt"
+
+    @staticmethod
+    def stat_key(path: Path) -> Tuple[int, int]:
+        st = path.stat()
+        return st.st_size, st.st_mtime_ns
+
+    def lookup(self, path: Path) -> Tuple[Optional[str], Optional[str]]:
+        """(캐시된 본문 또는 None, 내용 해시 또는 None). 해시는 (크기, mtime)이 다를 때만 계산."""
+        size, mtime = self.stat_key(path)
+        ent = self.entries.get(str(path))
+        if ent and ent.get("size") == size and ent.get("mtime_ns") == mtime:
+            text = self._read(ent.get("sha1"))
+            if text is not None:
+                return text, ent["sha1"]
+        digest = file_hash(path)
+        text = self._read(digest)
+        if text is not None:
+            # 내용은 같고 mtime/경로만 바뀐 파일 → 인덱스만 갱신
+            self._set(path, size, mtime, digest, ent.get("pages") if ent else None)
+        return text, digest
+
+    def _read(self, digest: Optional[str]) -> Optional[str]:
+        if not digest:
+            return None
+        try:
+            return self._text_path(digest).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def _set(self, path: Path, size: int, mtime: int, digest: str, pages: Optional[int]) -> None:
+        self.entries[str(path)] = {"size": size, "mtime_ns": mtime, "sha1": digest, "pages": pages}
+        self._dirty = True
+
+    def store(self, path: Path, digest: str, text: str, pages: Optional[int] = None) -> None:
+        self.text_dir.mkdir(parents=True, exist_ok=True)
+        tp = self._text_path(digest)
+        tmp = tp.with_suffix(".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        tmp.replace(tp)
+        size, mtime = self.stat_key(path)
+        self._set(path, size, mtime, digest, pages)
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": self.version, "files": self.entries}, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.index_path)
+        self._dirty = False
+
+
+@dataclass
+class ExtractReport:
+    files: int = 0
+    cached: int = 0
+    extracted: int = 0
+    failed: int = 0
+    failed_pages: int = 0
+    extract_ms: float = 0.0     # 워커 추출 시간 합(CPU 관점)
+    wall_ms: float = 0.0        # 첫 파일 시작 ~ 마지막 파일 완료
+    per_file: List[Dict[str, Any]] = field(default_factory=list)
+    failures: List[Dict[str, str]] = field(default_factory=list)
+
+    def as_dict(self, top: int = 10) -> Dict[str, Any]:
+        slow = sorted((f for f in self.per_file if not f.get("cached")), key=lambda f: -f["ms"])[:top]
+        return {
+            "files": self.files,
+            "cached": self.cached,
+            "extracted": self.extracted,
+            "failed": self.failed,
+            "failed_pages": self.failed_pages,
+            "extract_ms": round(self.extract_ms, 1),
+            "wall_ms": round(self.wall_ms, 1),
+            "slowest": slow,
+            "failures": self.failures,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"파일={self.files} (캐시={self.cached}, 추출={self.extracted}, 실패={self.failed}, "
+            f"실패 페이지={self.failed_pages}) 추출합={self.extract_ms / 1000.0:.1f}s 경과={self.wall_ms / 1000.0:.1f}s"
+        )
+
+
+def list_sources(raw_dir: Path) -> List[Path]:
+    return sorted(
+        p for p in raw_dir.rglob("*")
+        if p.is_file() and (p.suffix.lower() == PDF_SUFFIX or p.suffix.lower() in TEXT_SUFFIXES)
+    )
+
+
+@dataclass
+class _Pending:
+    path: Path
+    digest: Optional[str]
+    t0: float
+    parts: List[Optional[Dict[str, Any]]]
+    left: int
+
+
+def iter_documents(
+    raw_dir: Path,
+    workers: int = 0,
+    cache: Optional[ExtractCache] = None,
+    report: Optional[ExtractReport] = None,
+    pages_per_task: int = 64,
+) -> Iterator[Dict[str, Any]]:
+    """{"source", "text"} 문서를 추출이 끝나는 순서대로 생성.
+
+    workers<=0이면 os.cpu_count()개 워커. 캐시 적중 문서는 풀을 거치지 않고 바로 나갑니다.
+    추출에 실패한 파일은 건너뛰고 report.failures에 남깁니다.
+    """
+    report = report if report is not None else ExtractReport()
+    t_start = time.perf_counter()
+    paths = list_sources(raw_dir)
+    report.files += len(paths)
+    todo: List[Tuple[Path, Optional[str]]] = []
+
+    for p in paths:
+        if p.suffix.lower() in TEXT_SUFFIXES:
+            # 텍스트 파일은 읽기만 하면 되므로 캐시/풀을 거치지 않음
+            t0 = time.perf_counter()
+            try:
+                text = read_txt(p)
+            except Exception as e:
+                report.failed += 1
+                report.failures.append({"source": str(p), "error": f"{type(e).__name__}: {e}"})
+                continue
+            ms = (time.perf_counter() - t0) * 1000.0
+            report.extracted += 1
+            report.extract_ms += ms
+            report.per_file.append({"source": str(p), "ms": round(ms, 1), "cached": False})
+            yield {"source": str(p), "text": text}
+            continue
+        text, digest = None, None
+        if cache is not None:
+            try:
+                text, digest = cache.lookup(p)
+            except Exception as e:
+                report.failed += 1
+                report.failures.append({"source": str(p), "error": f"{type(e).__name__}: {e}"})
+                continue
+        if text is not None:
+            report.cached += 1
+            report.per_file.append({"source": str(p), "ms": 0.0, "cached": True})
+            yield {"source": str(p), "text": text}
+        else:
+            todo.append((p, digest))
+
+    if not todo:
+        report.wall_ms += (time.perf_counter() - t_start) * 1000.0
+        if cache is not None:
+            cache.save()
+        return
+
+    n_workers = workers if workers > 0 else (os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=_mp_context(), initializer=_init_worker)
+    futures: Dict[Future, Tuple[_Pending, int]] = {}
+    try:
+        # 큰 PDF부터 제출 → 마지막에 큰 파일 하나만 남는 꼬리 지연 감소
+        todo.sort(key=lambda x: -x[0].stat().st_size)
+        for p, digest in todo:
+            ranges: List[Tuple[int, Optional[int]]] = [(0, None)]
+            if pages_per_task > 0:
+                try:
+                    n_pages = pdf_page_count(p)
+                    ranges = [(s, s + pages_per_task) for s in range(0, n_pages, pages_per_task)] or [(0, None)]
+                except Exception:
+                    # 여기서 못 열면 워커에서 다시 시도하고 오류를 기록
+                    pass
+            pend = _Pending(p, digest, time.perf_counter(), [None] * len(ranges), len(ranges))
+            for i, (s, e) in enumerate(ranges):
+                futures[pool.submit(_extract_task, str(p), s, e)] = (pend, i)
+
+        remaining = set(futures)
+        while remaining:
+            done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                pend, i = futures.pop(fut)
+                try:
+                    pend.parts[i] = fut.result()
+                except Exception as e:
+                    # 워커 프로세스가 죽은 경우 등
+                    pend.parts[i] = {"texts": [], "failed_pages": 0, "ms": 0.0, "error": f"{type(e).__name__}: {e}"}
+                pend.left -= 1
+                if pend.left:
+                    continue
+                doc = _finish(pend, cache, report)
+                if doc is not None:
+                    yield doc
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        report.wall_ms += (time.perf_counter() - t_start) * 1000.0
+        if cache is not None:
+            cache.save()
+
+
+def _finish(pend: _Pending, cache: Optional[ExtractCache], report: ExtractReport) -> Optional[Dict[str, Any]]:
+    parts = [x for x in pend.parts if x is not None]
+    ms = sum(x["ms"] for x in parts)
+    report.extract_ms += ms
+    errors = [x["error"] for x in parts if x.get("error")]
+    source = str(pend.path)
+    if errors:
+        report.failed += 1
+        report.failures.append({"source": source, "error": errors[0]})
+        report.per_file.append({"source": source, "ms": round(ms, 1), "cached": False, "error": errors[0]})
+        return None
+    texts = [t for x in parts for t in x["texts"]]
+    failed_pages = sum(x["failed_pages"] for x in parts)
+    text = "\n".join(texts)
+    report.extracted += 1
+    report.failed_pages += failed_pages
+    report.per_file.append({
+        "source": source,
+        "ms": round(ms, 1),
+        "wall_ms": round((time.perf_counter() - pend.t0) * 1000.0, 1),
+        "pages": len(texts),
+        "failed_pages": failed_pages,
+        "cached": False,
+    })
+    if cache is not None:
+        try:
+            cache.store(pend.path, pend.digest or file_hash(pend.path), text, len(texts))
+        except Exception:
+            traceback.print_exc()
+    return {"source": source, "text": text}
+
+
+__all__ = [
+    "EXTRACTOR_VERSION",
+    "CACHE_DIR",
+    "read_pdf",
+    "read_pdf_pages",
+    "read_txt",
+    "ExtractCache",
+    "ExtractReport",
+    "list_sources",
+    "iter_documents",
+]
@@ -0,0 +1,204 @@
+# [RAG][ingest][incremental]
+# 역할: 내용 주소(content-addressed) 청크 ID + 문서 단위 증분 동기화.
+# - 청크 ID = <doc_key>#sha1(청킹 파라미터 + 청크 본문)[:16]  (doc_key: case_id 또는 source 경로)
+# - 문서 해시(doc_hash)가 같으면 임베딩 없이 스킵, 바뀌었으면 새/변경 청크만 임베딩하고 사라진 청크 삭제.
+# - dedup(src.dedup.NearDupIndex)을 넘기면 기존 청크의 near-duplicate인 새 청크는 임베딩하지 않고 정본에 링크.
+# - 결과를 added / skipped / updated / removed / duplicates 로 집계.
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+# 청킹 로직이 바뀌면 올려서 기존 ID를 무효화
+CHUNKER_VERSION = "v1"
+
+
+def chunk_params(chunk_size: int, chunk_overlap: int, chunker: str = CHUNKER_VERSION) -> str:
+    return f"{chunker}:{chunk_size}:{chunk_overlap}"
+
+
+def _sha1(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8", "ignore")).hexdigest()
+
+
+def doc_hash(text: str, params: str) -> str:
+    """문서 전체 본문 + 청킹 파라미터 해시. 같으면 청크 구성이 동일함을 보장."""
+    return _sha1(f"{params}\x1f{text}")[:16]
+
+
+def make_chunk_ids(doc_key: str, chunks: Sequence[str], params: str) -> List[str]:
+    """결정적 청크 ID. 같은 문서 안에서 본문이 같은 청크가 반복되면 순번을 덧붙임."""
+    ids: List[str] = []
+    seen: Dict[str, int] = {}
+    for ch in chunks:
+        h = _sha1(f"{params}\x1f{ch}")[:16]
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        ids.append(f"{doc_key}#{h}" if n == 0 else f"{doc_key}#{h}-{n}")
+    return ids
+
+
+@dataclass
+class DocUnit:
+    """동기화 단위(문서 1개 = 청크 여러 개)."""
+    doc_key: str
+    doc_hash: str
+    ids: List[str]
+    chunks: List[str]
+    metadatas: List[Dict[str, Any]]
+
+
+def build_doc(
+    doc_key: str,
+    text: str,
+    chunks: List[str],
+    metadatas: List[Dict[str, Any]],
+    params: str,
+    doc_meta: Optional[Dict[str, Any]] = None,
+) -> DocUnit:
+    """청크 ID를 만들고 메타데이터에 doc_key/doc_hash를 채운 DocUnit 생성.
+
+    doc_meta(법원/선고일 등 문서 단위 메타)는 모든 청크에 복사되고 doc_hash에도 반영됩니다.
+    → 메타만 바뀐 문서는 '변경'으로 감지되어 재임베딩 없이 메타만 갱신됩니다.
+    """
+    doc_meta = {k: v for k, v in (doc_meta or {}).items() if v is not None and v != ""}
+    hash_params = params
+    if doc_meta:
+        hash_params += "\x1f" + json.dumps(doc_meta, ensure_ascii=False, sort_keys=True)
+    dh = doc_hash(text, hash_params)
+    for m in metadatas:
+        m.update(doc_meta)
+        m["doc_key"] = doc_key
+        m["doc_hash"] = dh
+    return DocUnit(doc_key, dh, make_chunk_ids(doc_key, chunks, params), chunks, metadatas)
+
+
+_COUNTERS = ("added", "skipped", "updated", "removed", "duplicates", "docs_new", "docs_changed", "docs_unchanged")
+
+
+@dataclass
+class IngestReport:
+    added: int = 0
+    skipped: int = 0
+    updated: int = 0
+    removed: int = 0
+    duplicates: int = 0
+    docs_new: int = 0
+    docs_changed: int = 0
+    docs_unchanged: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def merge(self, other: "IngestReport") -> None:
+        for k in _COUNTERS:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = {k: getattr(self, k) for k in _COUNTERS}
+        out.update(self.extra)
+        return out
+
+    def __str__(self) -> str:
+        return (
+            f"청크 추가={self.added}, 스킵={self.skipped}, 메타갱신={self.updated}, 삭제={self.removed}, "
+            f"중복제외={self.duplicates} "
+            f"(문서 신규={self.docs_new}, 변경={self.docs_changed}, 동일={self.docs_unchanged})"
+        )
+
+
+def _existing_by_doc(collection, doc_keys: List[str], batch: int = 256) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """doc_key별 {chunk_id: metadata} (임베딩/본문 없이 메타만 조회)."""
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for i in range(0, len(doc_keys), batch):
+        part = doc_keys[i:i+batch]
+        where = {"doc_key": part[0]} if len(part) == 1 else {"doc_key": {"$in": part}}
+        got = collection.get(where=where, include=["metadatas"])
+        for _id, meta in zip(got.get("ids") or [], got.get("metadatas") or []):
+            meta = meta or {}
+            out.setdefault(meta.get("doc_key"), {})[_id] = meta
+    return out
+
+
+def sync_documents(retriever, docs: List[DocUnit], embedder=None, dedup=None) -> IngestReport:
+    """문서 묶음을 컬렉션과 동기화. 신규/변경 청크만 add(=임베딩)합니다.
+
+    embedder(ParallelEmbedder 등 .embed(texts) 제공)가 있으면 벡터를 직접 계산해 전달합니다.
+    dedup(NearDupIndex)이 있으면 near-duplicate 청크는 add하지 않고 정본 청크에 링크합니다.
+    """
+    report = IngestReport()
+    if not docs:
+        return report
+    existing = _existing_by_doc(retriever.collection, [d.doc_key for d in docs])
+
+    add_docs: List[str] = []
+    add_metas: List[Dict[str, Any]] = []
+    add_ids: List[str] = []
+    upd_ids: List[str] = []
+    upd_metas: List[Dict[str, Any]] = []
+    del_ids: List[str] = []
+    # 변경 없는 문서라도 BM25/near-duplicate 인덱스에 빠진 청크는 다시 등록(인덱스 저장 전에 중단된 ingest 재개 시)
+    lexical = retriever.get_lexical()
+    lex_ids: List[str] = []
+    lex_docs: List[str] = []
+
+    for d in docs:
+        old = existing.get(d.doc_key) or {}
+        linked = dedup.linked_ids(d.doc_key) if dedup is not None else {}
+        if not old and not linked:
+            report.docs_new += 1
+        elif set(old) | set(linked) == set(d.ids) and all(m.get("doc_hash") == d.doc_hash for m in old.values()):
+            report.docs_unchanged += 1
+            report.skipped += len(d.ids)
+            for _id, ch in zip(d.ids, d.chunks):
+                if _id in old and _id not in lexical:
+                    lex_ids.append(_id); lex_docs.append(ch)
+                if _id in old and dedup is not None and _id not in dedup:
+                    # 컬렉션에 있는 청크 = 정본 → 검사 없이 등록(이후 재수록본이 이 청크에 링크되도록)
+                    dedup.add(_id, *dedup.signature(ch))
+            continue
+        else:
+            report.docs_changed += 1
+        for _id, ch, meta in zip(d.ids, d.chunks, d.metadatas):
+            if _id in old:
+                # 본문 동일 → 임베딩 재사용, 위치/해시 메타만 갱신
+                upd_ids.append(_id); upd_metas.append(meta)
+            elif _id in linked:
+                report.duplicates += 1
+            elif dedup is not None and (canonical := dedup.check_and_add(_id, ch)) is not None:
+                dedup.link(d.doc_key, _id, canonical)
+                report.duplicates += 1
+            else:
+                add_ids.append(_id); add_docs.append(ch); add_metas.append(meta)
+        new_ids = set(d.ids)
+        del_ids.extend(_id for _id in old if _id not in new_ids)
+        if linked:
+            dedup.unlink(d.doc_key, [_id for _id in linked if _id not in new_ids])
+
+    if lex_ids:
+        lexical.add(lex_ids, lex_docs)
+    if del_ids:
+        retriever.delete_documents(del_ids)
+        if dedup is not None:
+            dedup.remove(del_ids)
+    if upd_ids:
+        retriever.update_metadatas(upd_ids, upd_metas)
+    if add_ids:
+        embeddings = embedder.embed(add_docs) if embedder is not None else None
+        retriever.add_documents(add_docs, add_metas, add_ids, embeddings=embeddings)
+    report.added += len(add_ids)
+    report.updated += len(upd_ids)
+    report.removed += len(del_ids)
+    return report
+
+
+__all__ = [
+    "CHUNKER_VERSION",
+    "chunk_params",
+    "doc_hash",
+    "make_chunk_ids",
+    "DocUnit",
+    "build_doc",
+    "IngestReport",
+    "sync_documents",
+]
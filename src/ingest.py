@@ -1,80 +1,94 @@
 from __future__ import annotations
 
+import argparse
 import json
-import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-import yaml
-from pypdf import PdfReader
-
-from .retriever import Retriever, split_text, load_config
+from .retriever import Retriever
+from .chunker import STATUTE, chunk_metadata, detect_kind
+from .incremental import IngestReport, build_doc, chunk_params, sync_documents
+from .embed_pool import from_retriever
+from .extract import ExtractCache, ExtractReport, iter_documents, read_pdf, read_txt  # noqa: F401 (하위 호환)
+from . import dedup as dedup_index
 
 
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
+# 추출이 끝난 문서를 이 개수만큼 모아 동기화(임베딩) → 나머지 PDF 추출과 겹쳐서 진행
+SYNC_BATCH_DOCS = 16
 
 
-def read_pdf(path: Path) -> str:
-    reader = PdfReader(str(path))
-    texts: List[str] = []
-    for page in reader.pages:
-        try:
-            texts.append(page.extract_text() or "")
-        except Exception:
-            texts.append("")
-    return "\n".join(texts)
-
-
-def read_txt(path: Path) -> str:
-    return path.read_text(encoding="utf-8", errors="ignore")
-
-
-def collect_documents(raw_dir: Path) -> List[Dict]:
-    docs: List[Dict] = []
-    for p in raw_dir.rglob("*"):
-        if not p.is_file():
-            continue
-        text = ""
-        if p.suffix.lower() == ".pdf":
-            text = read_pdf(p)
-        elif p.suffix.lower() in {".txt", ".md"}:
-            text = read_txt(p)
-        else:
-            continue
-        docs.append({"source": str(p), "text": text})
-    return docs
+def collect_documents(raw_dir: Path, workers: int = 0, cache: Optional[ExtractCache] = None) -> List[Dict]:
+    return list(iter_documents(raw_dir, workers=workers, cache=cache))
 
 
 def main() -> None:
-    config = load_config("config.yaml")
-    chunk_size = int(config.get("retriever", {}).get("chunk_size", 800))
-    chunk_overlap = int(config.get("retriever", {}).get("chunk_overlap", 120))
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=0, help="임베딩 워커 프로세스 수(0=Chroma 내장 단일 프로세스)")
+    ap.add_argument("--embed-batch-size", type=int, default=32, help="워커당 임베딩 배치 크기")
+    ap.add_argument("--no-dedup", action="store_true", help="near-duplicate 청크 제거 끄기")
+    ap.add_argument("--extract-workers", type=int, default=0, help="PDF 추출 워커 프로세스 수(0=CPU 코어 수)")
+    ap.add_argument("--pages-per-task", type=int, default=64, help="큰 PDF를 나눠 추출할 페이지 수(0=파일 단위)")
+    ap.add_argument("--no-extract-cache", action="store_true", help="추출 캐시(data/processed/extract_cache) 사용 안 함")
+    args = ap.parse_args()
 
     retriever = Retriever("config.yaml")
+    chunker = retriever.make_chunker()
 
     RAW_DIR.mkdir(parents=True, exist_ok=True)
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
-    docs = collect_documents(RAW_DIR)
-    if not docs:
-        print("data/raw/ 에 파일이 없습니다. PDF/TXT 파일을 추가한 뒤 다시 실행하세요.")
+    # 청크 ID = source 경로 + 본문 해시 + 청킹 파라미터 → 바뀐 파일의 바뀐 청크만 임베딩
+    params = chunk_params(chunker.chunk_size, chunker.chunk_overlap, chunker.version)
+    cache = None if args.no_extract_cache else ExtractCache()
+    extract_report = ExtractReport()
+    dedup = None if args.no_dedup else dedup_index.from_retriever(retriever)
+    embedder = from_retriever(retriever, args.workers, args.embed_batch_size)
+    report = IngestReport()
+    units = []
+    pending = []
+    try:
+        # 추출이 끝난 문서부터 바로 청킹, SYNC_BATCH_DOCS개씩 동기화
+        docs = iter_documents(
+            RAW_DIR, workers=args.extract_workers, cache=cache,
+            report=extract_report, pages_per_task=args.pages_per_task,
+        )
+        for doc in docs:
+            text = doc["text"]
+            source = doc["source"]
+            kind = detect_kind(text)
+            parts = chunker.chunk(text, kind)
+            chunks = [c.text for c in parts]
+            metas = [{"source": source, "chunk_idx": idx, **chunk_metadata(c, kind)} for idx, c in enumerate(parts)]
+            # doc_type: 조문 구조가 있으면 statute, 그 외 document (검색 필터용)
+            doc_meta = {"doc_type": "statute" if kind == STATUTE else "document"}
+            unit = build_doc(source, text, chunks, metas, params, doc_meta=doc_meta)
+            units.append(unit)
+            pending.append(unit)
+            if len(pending) >= SYNC_BATCH_DOCS:
+                report.merge(sync_documents(retriever, pending, embedder=embedder, dedup=dedup))
+                pending = []
+        if pending:
+            report.merge(sync_documents(retriever, pending, embedder=embedder, dedup=dedup))
+    finally:
+        if embedder is not None:
+            embedder.close()
+    if not units:
+        if extract_report.failures:
+            print(f"추출: {extract_report}")
+            for f in extract_report.failures:
+                print(f"  실패: {f['source']} ({f['error']})")
+        else:
+            print("data/raw/ 에 파일이 없습니다. PDF/TXT 파일을 추가한 뒤 다시 실행하세요.")
         return
+    retriever.save_lexical()
+    dedup_index.save_for(retriever, dedup)
 
-    all_chunks: List[str] = []
-    all_metas: List[Dict] = []
-
-    for doc in docs:
-        text = doc["text"]
-        source = doc["source"]
-        chunks = split_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        for idx, ch in enumerate(chunks):
-            all_chunks.append(ch)
-            all_metas.append({"source": source, "chunk_idx": idx})
-
-    ids = [str(uuid.uuid4()) for _ in all_chunks]
-    retriever.add_documents(documents=all_chunks, metadatas=all_metas, ids=ids)
+    all_chunks = [ch for u in units for ch in u.chunks]
+    all_metas = [m for u in units for m in u.metadatas]
+    ids = [i for u in units for i in u.ids]
 
     # processed 저장
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -83,9 +97,20 @@ def main() -> None:
         for ident, text, meta in zip(ids, all_chunks, all_metas):
             f.write(json.dumps({"id": ident, "text": text, "metadata": meta}, ensure_ascii=False) + "\n")
 
-    print(f"문서 수: {len(docs)}, 청크 수: {len(all_chunks)}")
-    print(f"저장: {out_path}")
-
+    # 적재 리포트: 동기화 결과 + 파일별 추출 시간/실패
+    report.extra["extract"] = extract_report.as_dict()
+    report_path = PROCESSED_DIR / f"ingest_report_{timestamp}.json"
+    report_path.write_text(
+        json.dumps({**report.as_dict(), "extract_files": extract_report.per_file}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+
+    print(f"문서 수: {len(units)}, 청크 수: {len(all_chunks)}")
+    print(f"추출: {extract_report}")
+    for f in extract_report.failures:
+        print(f"  실패: {f['source']} ({f['error']})")
+    print(f"동기화: {report}")
+    print(f"저장: {out_path}, 리포트: {report_path}")
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,24 @@
 # [RAG][ingest]
 # 역할: 원본 케이스(JSON/JSONL)에서 텍스트 추출 → 청크 → Chroma upsert.
-# TODO:
-# - existing-ID 조회로 증분 인덱싱(중복 스킵).
-# - SimHash/임베딩 유사도 기반 near-duplicate 제거.
-# - 배치 add + 진행률 로그 + --max N 옵션.
-# - 실패 라인 로그 파일로 저장(skipped_lines.log).
-import argparse, json, uuid, hashlib, itertools
+# - 레코드를 지연(스트리밍) 읽기 → 레코드 경계 기준 고정 크기 배치로 임베딩/add → 메모리 사용량 일정.
+# - --save-every 배치마다(와 종료 시) BM25/dedup 인덱스 + 체크포인트 저장(JSONL은 바이트 오프셋, 반복된 case_id 번호,
+#   이미 나온 case_id 블룸 필터(<체크포인트>.seen, 고정 크기))
+#   → 중단 후 재실행 시 마지막 저장 지점부터 재개(그 뒤 이미 들어간 배치는 doc_hash로 스킵).
+# - --workers N: 임베딩을 N개 워커 프로세스에서 길이순 배치로 계산(src.embed_pool).
+# - 파싱 실패 라인은 skipped_lines.log에 기록, 진행률/처리량 로그 출력, --max N 지원.
+# - 청크는 src.chunker(기본 legal: 【이 유】/[n] 판시사항 경계)로 분할, 구조 경로를 메타데이터에 저장.
+# - 청크 ID는 case_id + 청크 본문 해시 + 청킹 파라미터로 결정 → 재실행 시 변경분만 임베딩(src.incremental).
+# - 법원/선고일(date, date_num)/판결·결정/사건번호를 청크 메타에 저장 → Retriever.query(filters=...)에서 where로 필터.
+# - MinHash/LSH near-duplicate 제거(src.dedup): 재수록/반복 판시사항 청크는 임베딩하지 않고 정본에 링크.
+import argparse, json, hashlib, itertools, time
+import os
 from pathlib import Path
-from typing import Dict, Any, Iterable, List
-from src.retriever import Retriever, split_text
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from src.retriever import Retriever, date_num
+from src.chunker import chunk_metadata, detect_kind
+from src.incremental import DocUnit, IngestReport, build_doc, chunk_params, sync_documents
+from src.embed_pool import from_retriever
+from src import dedup as dedup_index
 
 TEXT_KEYS = ["text", "content", "body", "judgment", "opinion", "raw_text", "full_text", "summary"]
 ID_KEYS   = ["case_id", "id", "doc_id", "uid", "case_no"]
@@ -35,34 +45,211 @@ def pick(d: Dict[str, Any], keys: List[str]) -> str:
             return v.strip()
     return ""
 
-def read_records(p: Path) -> Iterable[Dict[str, Any]]:
-    """JSONL도, JSON 배열 파일도 모두 지원"""
-    s = p.read_text(encoding="utf-8", errors="ignore").lstrip()
-    if s.startswith("["):
-        arr = json.loads(s)
-        for obj in arr:
-            if isinstance(obj, dict):
-                yield obj
-    else:
-        for line in s.splitlines():
-            line = line.strip()
+class SkipLog:
+    """파싱 실패 라인을 파일에 남깁니다(최초 기록 시에만 파일 생성)."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.count = 0
+        self._f = None
+
+    def write(self, where: str, reason: str, raw: str) -> None:
+        if self._f is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._f = self.path.open("a", encoding="utf-8")
+        self._f.write(f"{where}\t{reason}\t{raw[:500]}\n")
+        self.count += 1
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+MAX_ITEM_CHARS = 64 << 20  # 배열 원소 하나가 이보다 크면 손상된 것으로 간주
+
+def _is_json_array(p: Path) -> bool:
+    with p.open("rb") as bf:
+        head = bf.read(4096).decode("utf-8", errors="ignore")
+    return head.lstrip("﻿ \t\r\n").startswith("[")
+
+def _iter_json_array(f, skip: Optional[SkipLog], chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """JSON 배열 파일을 통째로 읽지 않고 원소 단위로 디코딩."""
+    dec = json.JSONDecoder()
+    buf, eof = f.read(chunk_size), False
+    pos = buf.index("[") + 1
+    idx = 0
+    while True:
+        # 공백/구분자 건너뛰기
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            more = f.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+        if pos >= len(buf) or buf[pos] == "]":
+            return
+        try:
+            obj, end = dec.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof or len(buf) - pos > MAX_ITEM_CHARS:
+                if skip is not None:
+                    skip.write(f"item#{idx}", "json_error", buf[pos:])
+                return
+            more = f.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield obj
+        idx += 1
+        pos = end
+
+def read_records(
+    p: Path,
+    start_offset: int = 0,
+    skip: Optional[SkipLog] = None,
+) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """JSONL도, JSON 배열 파일도 모두 지원. (레코드, 재개 위치)를 지연 반환.
+
+    재개 위치는 JSONL이면 다음 라인의 바이트 오프셋, JSON 배열이면 다음 원소 번호입니다.
+    """
+    if _is_json_array(p):
+        with p.open("r", encoding="utf-8", errors="ignore") as f:
+            for i, obj in enumerate(_iter_json_array(f, skip)):
+                if i < start_offset:
+                    continue
+                if isinstance(obj, dict):
+                    yield obj, i + 1
+                elif skip is not None:
+                    skip.write(f"item#{i}", "not_object", json.dumps(obj, ensure_ascii=False))
+        return
+
+    with p.open("rb") as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for raw in f:
+            offset += len(raw)
+            line = raw.decode("utf-8", errors="ignore").strip().lstrip("﻿")
             if not line:
                 continue
             try:
                 obj = json.loads(line)
-            except Exception:
+            except Exception as e:
+                if skip is not None:
+                    skip.write(f"byte@{offset - len(raw)}", f"json_error:{e.__class__.__name__}", line)
                 continue
             if isinstance(obj, dict):
-                yield obj
+                yield obj, offset
+            elif skip is not None:
+                skip.write(f"byte@{offset - len(raw)}", "not_object", line)
+
+def case_meta(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """검색 필터용 문서 메타(법원/선고일/판결·결정/사건번호). 없는 값은 넣지 않음(Chroma는 None 불가)."""
+    meta: Dict[str, Any] = {}
+    for k in ("court", "decision_type", "case_no"):
+        v = obj.get(k)
+        if isinstance(v, str) and v.strip():
+            meta[k] = v.strip()
+    dn = date_num(obj.get("date") or obj.get("decision_date"))
+    # 원본에 사건번호에서 잘못 뽑힌 날짜(예: 2267-00-04, 2050-07-03)가 섞여 있음 → 미래 날짜는 버림
+    if dn and dn // 10000 > time.localtime().tm_year:
+        dn = None
+    if dn:
+        meta["date"] = f"{dn // 10000:04d}-{dn // 100 % 100:02d}-{dn % 100:02d}"
+        meta["date_num"] = dn  # where {"date_num": {"$gte": ...}} 범위 필터용
+    return meta
 
 def short_hash(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8", "ignore")).hexdigest()[:10]
 
+class SeenFilter:
+    """이미 나온 case_id(블룸 필터, 고정 크기 → 덤프 크기와 무관한 메모리/저장 비용).
+
+    드물게 처음 나온 case_id를 '나온 적 있음'으로 오판하면 case_id~n 키가 붙을 뿐 기존 문서를 덮어쓰지 않고,
+    같은 파일이면 항상 같은 판정(결정적)이라 재개/재실행해도 doc_key가 바뀌지 않습니다.
+    """
+
+    BITS = 1 << 27  # 16MB, case_id 1천만 개에서 오판율 약 0.2%
+    K = 7
+
+    def __init__(self) -> None:
+        self.array = bytearray(self.BITS // 8)
+
+    def _positions(self, key: str) -> Iterator[int]:
+        d = hashlib.blake2b(key.encode("utf-8", "ignore"), digest_size=4 * self.K).digest()
+        for i in range(0, 4 * self.K, 4):
+            yield int.from_bytes(d[i:i + 4], "little") % self.BITS
+
+    def add(self, key: str) -> bool:
+        """key 등록. 이미 (아마도) 나온 적 있으면 True."""
+        seen = True
+        for pos in self._positions(key):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.array[byte] & bit:
+                seen = False
+                self.array[byte] |= bit
+        return seen
+
+    def save(self, path: Path, tag: int) -> None:
+        """tag(=체크포인트 resume_at)와 함께 저장 → 체크포인트와 짝이 맞는지 로드 때 확인."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".seen.tmp")
+        with tmp.open("wb") as f:
+            f.write(int(tag).to_bytes(8, "little"))
+            f.write(self.array)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, tag: int) -> Optional["SeenFilter"]:
+        """저장된 필터. 없거나 tag/크기가 맞지 않으면 None."""
+        try:
+            raw = path.read_bytes()
+        except OSError:
+            return None
+        if len(raw) != 8 + cls.BITS // 8 or int.from_bytes(raw[:8], "little") != tag:
+            return None
+        f = cls()
+        f.array[:] = raw[8:]
+        return f
+
+# --- 체크포인트 ---
+def checkpoint_path(p: Path, collection: str) -> Path:
+    return Path("data/processed/checkpoints") / f"{collection}__{p.name}.json"
+
+def load_checkpoint(path: Path, src: Path) -> Dict[str, Any]:
+    """같은 입력 파일(경로+크기)에 대한 체크포인트만 유효."""
+    if not path.exists():
+        return {}
+    try:
+        ck = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if ck.get("path") != src.as_posix() or ck.get("size") != src.stat().st_size:
+        print(f"[WARN] 입력 파일이 바뀌어 체크포인트를 무시합니다: {path.as_posix()}")
+        return {}
+    return ck
+
+def save_checkpoint(path: Path, data: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--path", required=True)
     ap.add_argument("--config", default="config.yaml")
     ap.add_argument("--collection", default=None, help="override collection name")
+    ap.add_argument("--batch-size", type=int, default=256, help="배치당 청크 수(레코드 경계에서 끊음)")
+    ap.add_argument("--save-every", type=int, default=20, help="BM25/dedup 인덱스와 체크포인트를 저장할 배치 간격(종료 시에는 항상 저장)")
+    ap.add_argument("--max", type=int, default=None, help="이번 실행에서 처리할 최대 레코드 수(재개 시 체크포인트 이후부터 셈)")
+    ap.add_argument("--checkpoint", default=None, help="체크포인트 파일(기본: data/processed/checkpoints/)")
+    ap.add_argument("--restart", action="store_true", help="체크포인트를 무시하고 처음부터")
+    ap.add_argument("--skip-log", default="data/processed/skipped_lines.log")
+    ap.add_argument("--workers", type=int, default=0, help="임베딩 워커 프로세스 수(0=Chroma 내장 단일 프로세스)")
+    ap.add_argument("--embed-batch-size", type=int, default=32, help="워커당 임베딩 배치 크기")
+    ap.add_argument("--no-dedup", action="store_true", help="near-duplicate 청크 제거 끄기")
     args = ap.parse_args()
 
     # Retriever 준비
@@ -72,59 +259,153 @@ def main():
     if not p.exists():
         raise FileNotFoundError(p)
 
-    docs, metas, ids = [], [], []
-    total, used, skipped_no_text = 0, 0, 0
+    ck_path = Path(args.checkpoint) if args.checkpoint else checkpoint_path(p, r.collection_name)
+    ck = {} if args.restart else load_checkpoint(ck_path, p)
+    # case_id 반복 판정: 나온 적 있는 id는 블룸 필터(.seen), 반복 번호는 실제로 반복된 id만 체크포인트에 저장
+    seen_path = ck_path.with_suffix(".seen")
+    seen = SeenFilter.load(seen_path, int(ck.get("resume_at", 0))) if ck else None
+    if seen is None:
+        seen = SeenFilter()
+        if "key_counts" in ck:
+            # 예전 체크포인트(모든 case_id의 반복 횟수)에서 이전
+            for k, v in ck["key_counts"].items():
+                seen.add(str(k))
+            ck["key_repeats"] = {k: v for k, v in ck["key_counts"].items() if int(v) > 1}
+        elif ck.get("resume_at"):
+            # 필터와 체크포인트 짝이 안 맞으면 반복 번호를 이어갈 수 없음 → 처음부터(이미 들어간 문서는 doc_hash로 스킵)
+            print(f"[WARN] case_id 기록({seen_path.as_posix()})이 체크포인트와 맞지 않아 처음부터 다시 적재합니다")
+            ck = {}
+    stats = {"total": 0, "with_text": 0, "no_text": 0, "chunks": 0}
+    stats.update(ck.get("stats") or {})
+    report = IngestReport()
+    for k, v in (ck.get("report") or {}).items():
+        if hasattr(report, k):
+            setattr(report, k, v)
+    resume_at = int(ck.get("resume_at", 0))
+    if resume_at:
+        print(f"[INFO] 체크포인트에서 재개: resume_at={resume_at}, 누적 추가={report.added}")
 
-    print(f"[INFO] loading from {p.as_posix()} ...")
-    for obj in read_records(p):
-        total += 1
-        text = pick(obj, TEXT_KEYS)
-        if not text:
-            skipped_no_text += 1
-            continue
+    skip = SkipLog(Path(args.skip_log))
+    size = p.stat().st_size
+    is_jsonl = not _is_json_array(p)
+    chunker = r.make_chunker()
+    params = chunk_params(chunker.chunk_size, chunker.chunk_overlap, chunker.version)
+
+    print(f"[INFO] loading from {p.as_posix()} ... (batch={args.batch_size}, chunk_size={r.chunk_size}, overlap={r.chunk_overlap}, chunker={r.chunker_name})")
+    batch: List[DocUnit] = []
+    batch_chunks = 0
+    # 반복된 case_id의 마지막 번호(case_id~n)만 체크포인트에 저장 → 재개 후에도 같은 doc_key가 나옴
+    key_repeats: Dict[str, int] = {str(k): int(v) for k, v in (ck.get("key_repeats") or {}).items()}
+    t0 = time.perf_counter()
+    seen_records, seen_chunks = 0, 0  # 이번 실행분(처리량 계산, --max 기준)
+
+    unsaved = 0  # 인덱스/체크포인트 저장 이후 동기화한 배치 수
+
+    def persist(position: int) -> None:
+        """BM25/dedup 인덱스 저장 후에만 resume_at 전진(인덱스 전체를 다시 쓰므로 --save-every 배치마다)."""
+        nonlocal unsaved
+        r.save_lexical()
+        dedup_index.save_for(r, dedup)
+        seen.save(seen_path, position)
+        save_checkpoint(ck_path, {
+            "path": p.as_posix(),
+            "size": size,
+            "collection": r.collection_name,
+            "resume_at": position,
+            "stats": stats,
+            "report": report.as_dict(),
+            "key_repeats": key_repeats,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        unsaved = 0
 
-        case_id = pick(obj, ID_KEYS) or f"case-{uuid.uuid4().hex[:8]}"
-        source  = obj.get("source") or p.as_posix()
-        record_uid = uuid.uuid4().hex # Generate a unique ID for each record
+    def commit(position: int) -> None:
+        """현재 배치를 동기화(N배치마다 저장). 실패하면 예외 전파(체크포인트는 마지막 저장 지점 그대로)."""
+        nonlocal batch_chunks, unsaved
+        report.merge(sync_documents(r, batch, embedder=embedder, dedup=dedup))
+        unsaved += 1
+        if unsaved >= max(args.save_every, 1):
+            persist(position)
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        pct = f"{position / size:.1%}" if is_jsonl and size else f"item {position}"
+        print(f"[PROG] {pct} records={stats['total']} chunks={stats['chunks']} added={report.added} skipped={report.skipped} dup={report.duplicates} "
+              f"| {seen_chunks / elapsed:.1f} chunks/s, {seen_records / elapsed:.1f} rec/s")
+        batch.clear()
+        batch_chunks = 0
 
-        chunks = split_text(text, r.chunk_size, r.chunk_overlap) or []
-        base = f"{case_id}:{record_uid}" # Use the unique record ID in the base
-        for i, ch in enumerate(chunks):
-            docs.append(ch)
-            metas.append({
+    dedup = None if args.no_dedup else dedup_index.from_retriever(r)
+    if dedup is not None:
+        print(f"[INFO] near-duplicate 제거: 등록 청크 {len(dedup)}개, 링크 {dedup.duplicates}개, 임계값 {dedup.threshold}")
+    embedder = from_retriever(r, args.workers, args.embed_batch_size)
+    if embedder is not None:
+        print(f"[INFO] 병렬 임베딩: workers={embedder.workers}, batch={embedder.batch_size}, torch_threads={embedder.torch_threads}")
+
+    try:
+        # last_done: 끝까지 처리한 마지막 레코드 다음 위치(--max로 멈출 때 읽기만 한 레코드를 건너뛰지 않도록 이것만 체크포인트)
+        last_done = resume_at
+        for obj, position in read_records(p, start_offset=resume_at, skip=skip):
+            if args.max is not None and seen_records >= args.max:
+                break
+            stats["total"] += 1
+            seen_records += 1
+            text = pick(obj, TEXT_KEYS)
+            if not text:
+                stats["no_text"] += 1
+                last_done = position
+                continue
+
+            # case_id가 없으면 본문 해시로 결정적 ID
+            case_id = pick(obj, ID_KEYS) or f"case-{short_hash(text)}"
+            source  = obj.get("source") or p.as_posix()
+            # 같은 파일 안에서 case_id가 반복되면(재수록 등) 별도 문서로 구분
+            if seen.add(case_id):
+                n = key_repeats.get(case_id, 1) + 1
+                key_repeats[case_id] = n
+                doc_key = f"{case_id}~{n}"
+            else:
+                doc_key = case_id
+
+            kind = detect_kind(text)
+            parts = chunker.chunk(text, kind)
+            chunks = [c.text for c in parts]
+            metas = [{
                 "source": source,
                 "chunk_idx": i,
                 "doc_type": "case",
                 "case_id": case_id,
-            })
-            ids.append(f"{base}#c{i}")
-        used += 1
+                **chunk_metadata(c, kind),
+            } for i, c in enumerate(parts)]
+            batch.append(build_doc(doc_key, text, chunks, metas, params, doc_meta=case_meta(obj)))
+            batch_chunks += len(chunks)
+            stats["with_text"] += 1
+            stats["chunks"] += len(chunks)
+            seen_chunks += len(chunks)
+            last_done = position
 
-    print(f"[INFO] records total={total}, with_text={used}, no_text={skipped_no_text}")
-    print(f"[INFO] chunks to add={len(docs)} (chunk_size={r.chunk_size}, overlap={r.chunk_overlap})")
+            # 레코드 경계에서만 커밋 → 재개 시 레코드가 반쯤 들어가는 일이 없음
+            if batch_chunks >= args.batch_size:
+                commit(last_done)
 
-    if not docs:
-        print("[HINT] 본문 키 후보:", TEXT_KEYS)
-        print("[HINT] 첫 몇 줄을 확인해 보세요: PowerShell ⇒  Get-Content data\raw\cases.jsonl -TotalCount 3")
-        raise SystemExit("추출된 청크가 없습니다. 데이터 키 이름을 확인하세요.")
+        if batch:
+            commit(last_done)
+        if unsaved:
+            persist(last_done)
+    finally:
+        skip.close()
+        if embedder is not None:
+            embedder.close()
 
-    # --- 증분 인덱싱 로직 ---
-    existing = get_existing_ids(r, ids)
-    if existing:
-        print(f"[INFO] 이미 존재하는 ID {len(existing)}건은 건너뜁니다.")
+    print(f"[INFO] records total={stats['total']}, with_text={stats['with_text']}, no_text={stats['no_text']}")
+    if skip.count:
+        print(f"[INFO] 파싱 실패 {skip.count}줄 → {skip.path.as_posix()}")
 
-    flt_docs, flt_metas, flt_ids = [], [], []
-    for d, m, _id in zip(docs, metas, ids):
-        if _id in existing:
-            continue
-        flt_docs.append(d); flt_metas.append(m); flt_ids.append(_id)
+    if not stats["chunks"]:
+        print("[HINT] 본문 키 후보:", TEXT_KEYS)
+        print("[HINT] 첫 몇 줄을 확인해 보세요: PowerShell ⇒  Get-Content data\\raw\\cases.jsonl -TotalCount 3")
+        raise SystemExit("추출된 청크가 없습니다. 데이터 키 이름을 확인하세요.")
 
-    if not flt_docs:
-        print("[INFO] 추가할 신규 청크가 없습니다.")
-        return
+    elapsed = time.perf_counter() - t0
+    print(f"[DONE] {report} ({elapsed:.1f}s, 체크포인트: {ck_path.as_posix()})")
 
-    r.add_documents(flt_docs, flt_metas, flt_ids)
-    print(f"[DONE] 신규 {len(flt_docs)}개 청크 추가")
-    
 if __name__ == "__main__":
     main()
@@ -0,0 +1,250 @@
+# [RAG][lexical]
+# 역할: 한국어 법률 문서용 BM25 역색인(inverted index). 벡터 검색이 놓치는 정확 매칭 보완.
+# - 토크나이저: 한글 문자 bigram + 영문/숫자 토큰 + 사건번호(2023다250746)/조문(제23조의2) 통째 토큰.
+# - 질의 토큰의 posting만 순회(rank-bm25처럼 전체 문서 스캔하지 않음).
+# - vectorstore 경로 아래 lexical/<컬렉션>.json.gz 로 저장, 첫 검색 시 지연 로드.
+# - Retriever.add_documents()가 호출될 때 증분 갱신 → save()로 영속화.
+from __future__ import annotations
+
+import argparse
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# 사건번호: 2023다250746, 2019도1234, 2020헌마123 등 (연도 + 사건부호 + 일련번호)
+CASE_NO_RE = re.compile(r"(?<!\d)\d{2,4}\s?([가-힣]{1,3})\s?\d{1,7}")
+# 사건부호로 볼 수 없는 단위/조문 글자(예: '23조의2', '2025년 3월')
+NOT_CASE_CODE = set("조항호년월일원명세개시분차회장편절관")
+# 조문: 제23조, 제23조의2, 제 5 조
+ARTICLE_RE = re.compile(r"제\s?\d+\s?조(?:\s?의\s?\d+)?")
+WORD_RE = re.compile(r"[가-힣]+|[a-z]+|\d+")
+HANGUL_RE = re.compile(r"[가-힣]")
+
+
+def tokenize(text: str) -> List[str]:
+    """BM25용 토큰화. 형태소 분석기 없이 문자 n-gram으로 조사/어미 변화를 흡수합니다."""
+    if not text:
+        return []
+    tokens: List[str] = []
+    # 사건번호/조문은 공백 제거 후 하나의 토큰으로(정확 매칭 시 높은 IDF)
+    for m in CASE_NO_RE.finditer(text):
+        if NOT_CASE_CODE.intersection(m.group(1)):
+            continue
+        tokens.append(re.sub(r"\s+", "", m.group()))
+    for m in ARTICLE_RE.finditer(text):
+        tokens.append(re.sub(r"\s+", "", m.group()))
+    for w in WORD_RE.findall(text.lower()):
+        if HANGUL_RE.match(w) and len(w) > 1:
+            tokens.extend(w[i:i+2] for i in range(len(w) - 1))
+        else:
+            tokens.append(w)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 역색인. postings: token -> {doc_idx: tf}."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.doc_lens: List[int] = []
+        self.id_to_idx: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_len = 0
+        self.deleted: set[int] = set()  # 삭제된 문서 번호(posting은 compact 때 정리)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_ids) - len(self.deleted)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.id_to_idx
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> int:
+        """새 문서를 색인합니다. 이미 있는 ID는 건너뛰며, 추가된 개수를 반환합니다."""
+        added = 0
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if doc_id in self.id_to_idx:
+                    continue
+                idx = len(self.doc_ids)
+                toks = tokenize(text or "")
+                self.doc_ids.append(doc_id)
+                self.doc_lens.append(len(toks))
+                self.id_to_idx[doc_id] = idx
+                self.total_len += len(toks)
+                for tok, tf in Counter(toks).items():
+                    self.postings.setdefault(tok, {})[idx] = tf
+                added += 1
+        return added
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """문서를 삭제 표시합니다. 같은 ID를 다시 add하면 새 번호로 색인됩니다."""
+        removed = 0
+        with self._lock:
+            for doc_id in ids:
+                idx = self.id_to_idx.pop(doc_id, None)
+                if idx is None:
+                    continue
+                self.deleted.add(idx)
+                self.total_len -= self.doc_lens[idx]
+                removed += 1
+        return removed
+
+    def compact(self) -> None:
+        """삭제 표시된 문서의 posting을 제거하고 번호를 다시 매깁니다."""
+        with self._lock:
+            if not self.deleted:
+                return
+            remap: Dict[int, int] = {}
+            doc_ids: List[str] = []
+            doc_lens: List[int] = []
+            for old, doc_id in enumerate(self.doc_ids):
+                if old in self.deleted:
+                    continue
+                remap[old] = len(doc_ids)
+                doc_ids.append(doc_id)
+                doc_lens.append(self.doc_lens[old])
+            postings: Dict[str, Dict[int, int]] = {}
+            for tok, plist in self.postings.items():
+                kept = {remap[i]: tf for i, tf in plist.items() if i in remap}
+                if kept:
+                    postings[tok] = kept
+            self.doc_ids, self.doc_lens, self.postings = doc_ids, doc_lens, postings
+            self.id_to_idx = {d: i for i, d in enumerate(doc_ids)}
+            self.total_len = sum(doc_lens)
+            self.deleted = set()
+
+    def search(self, query: str, top_n: int = 30) -> List[Tuple[str, float]]:
+        """(doc_id, bm25 점수) 상위 top_n개."""
+        n_docs = len(self)
+        if n_docs <= 0:
+            return []
+        deleted = self.deleted
+        avgdl = (self.total_len / n_docs) or 1.0
+        scores: Dict[int, float] = {}
+        for tok, qtf in Counter(tokenize(query)).items():
+            plist = self.postings.get(tok)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = math.log(1.0 + max(n_docs - df + 0.5, 0.0) / (df + 0.5))
+            for idx, tf in plist.items():
+                if idx in deleted:
+                    continue
+                dl = self.doc_lens[idx]
+                denom = tf + self.k1 * (1.0 - self.b + self.b * dl / avgdl)
+                scores[idx] = scores.get(idx, 0.0) + qtf * idf * tf * (self.k1 + 1.0) / denom
+        best = heapq.nlargest(top_n, scores.items(), key=lambda kv: kv[1])
+        return [(self.doc_ids[idx], sc) for idx, sc in best]
+
+    # --- 영속화 ---
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.compact()
+        with self._lock:
+            data = {
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lens": self.doc_lens,
+                # JSON 키는 문자열이므로 posting은 [idx, tf] 평탄 리스트로 저장
+                "postings": {t: [v for kv in p.items() for v in kv] for t, p in self.postings.items()},
+            }
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "LexicalIndex":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        idx = cls(k1=float(data.get("k1", 1.5)), b=float(data.get("b", 0.75)))
+        idx.doc_ids = list(data.get("doc_ids", []))
+        idx.doc_lens = [int(x) for x in data.get("doc_lens", [])]
+        idx.id_to_idx = {d: i for i, d in enumerate(idx.doc_ids)}
+        idx.total_len = sum(idx.doc_lens)
+        idx.postings = {
+            t: dict(zip(flat[0::2], flat[1::2])) for t, flat in (data.get("postings") or {}).items()
+        }
+        return idx
+
+
+def index_path(db_path: str | Path, collection_name: str) -> Path:
+    """벡터스토어 옆(하위 lexical/)에 컬렉션별 인덱스 파일."""
+    return Path(db_path) / "lexical" / f"{collection_name}.json.gz"
+
+
+def load_or_create(db_path: str | Path, collection_name: str) -> LexicalIndex:
+    p = index_path(db_path, collection_name)
+    if p.exists():
+        try:
+            return LexicalIndex.load(p)
+        except Exception:
+            import traceback; traceback.print_exc()
+    return LexicalIndex()
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """여러 순위 목록을 RRF(1/(k+rank))로 합산해 (id, 점수) 내림차순으로 반환."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def build_from_collection(collection, batch: int = 1000, index: Optional[LexicalIndex] = None) -> LexicalIndex:
+    """기존 Chroma 컬렉션 전체를 읽어 인덱스를 (재)구축합니다."""
+    if index is None:
+        index = LexicalIndex()
+    offset = 0
+    while True:
+        got = collection.get(include=["documents"], limit=batch, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        index.add(ids, got.get("documents") or [""] * len(ids))
+        offset += len(ids)
+    return index
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="기존 컬렉션으로부터 BM25 역색인 재구축")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--collection", default=None, help="대상 컬렉션(기본: config 값)")
+    args = ap.parse_args()
+
+    from .retriever import Retriever
+
+    r = Retriever(args.config, collection_name=args.collection)
+    index = build_from_collection(r.collection)
+    out = index_path(r.db_path, r.collection_name)
+    index.save(out)
+    print(f"[DONE] {r.collection_name}: 문서 {len(index)}개, 토큰 {len(index.postings)}종 → {out}")
+
+
+__all__ = [
+    "tokenize",
+    "LexicalIndex",
+    "index_path",
+    "load_or_create",
+    "reciprocal_rank_fusion",
+    "build_from_collection",
+]
+
+
+if __name__ == "__main__":
+    main()
+
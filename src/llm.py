@@ -4,12 +4,55 @@
 # - 내부사고 출력 금지: stop 토큰 + strip_think 필수 적용.
 # - (선택) JSON 스키마 강제 및 검증.
 # - (선택) 인용문 자동 샘플링 + 출처 바인딩 강화.
+# 스트리밍: answer_question_stream()이 Ollama 스트림 토큰을 ThinkFilter + LeakFilter(LEAK_PATTERNS)로 걸러 순차 반환(LLM_DEADLINE에서 중단).
+# 폴백: 설치 모델 목록(ModelCatalog) + 엔드포인트/모델별 서킷브레이커 + 전체 데드라인(LLM_DEADLINE).
+# 비동기: *_async 함수는 keep-alive 풀을 가진 공유 httpx.AsyncClient + 모델별 동시성 제한(세마포어) 사용.
+# 컨텍스트: 참고 자료는 num_ctx - 답변 예약 - 고정 프롬프트 토큰 안에서 점수 순으로 채움(src/context.py).
+# 프롬프트 캐시: chat/generate 모두 [SYSTEM_PROMPT(고정) → 참고 자료 → 질문] 순서, 모델별 옵션/keep_alive도 고정
+#   → 같은 모델의 요청끼리 바이트 단위로 같은 접두부를 공유해 Ollama KV 캐시가 prefill을 재사용.
+#   configure()로 config.yaml의 llm 설정(모델별 num_ctx/keep_alive, 예열 모델)을 반영, warmup_async()로 예열.
 import os
+import json
+import asyncio
+import httpx
 import requests
 import re
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple
+
+from .context import PackResult, estimate_tokens, pack_context
+from .llm_guard import CONNECTION, ENDPOINT_MISSING, NOT_FOUND, CircuitBreaker, ModelCatalog, canonical_model, classify_error
+from .llm_stats import PromptEvalStats
+from .metrics import (
+    LLM_CALL_SECONDS, LLM_CALLS, LLM_EVAL_SECONDS, LLM_EVAL_TOKENS, LLM_LOAD_SECONDS,
+    LLM_PROMPT_EVAL_SECONDS, LLM_PROMPT_TOKENS, span,
+)
 
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+# 모델별 동시 생성 수 / 커넥션 풀 크기
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "16"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "180"))
+# 폴백 체인 전체에 걸친 최대 대기 시간(초)
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", "200"))
+# 컨텍스트 창 / 답변용 예약 토큰 / 참고 자료 예산(0이면 앞의 둘과 고정 프롬프트로 자동 계산)
+LLM_NUM_CTX = int(os.environ.get("LLM_NUM_CTX", "4096"))
+LLM_ANSWER_TOKENS = int(os.environ.get("LLM_ANSWER_TOKENS", "768"))
+LLM_CONTEXT_TOKENS = int(os.environ.get("LLM_CONTEXT_TOKENS", "0"))
+# 모델을 메모리에 유지할 시간(Ollama keep_alive). 언로드되면 KV 캐시도 사라짐
+LLM_KEEP_ALIVE = os.environ.get("LLM_KEEP_ALIVE", "5m")
+# 1이면 컨텍스트를 잘라낸 요청마다 패킹 결과를 출력(평소에는 응답 timings의 context_* 값으로 확인)
+LLM_DEBUG = os.environ.get("LLM_DEBUG", "0") == "1"
+
+PROMPT_STATS = PromptEvalStats()
+CATALOG = ModelCatalog(ttl_s=float(os.environ.get("LLM_CATALOG_TTL", "300")))
+BREAKER = CircuitBreaker(
+    threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "3")),
+    reset_s=float(os.environ.get("LLM_BREAKER_RESET", "30")),
+)
+
+# 동기 경로도 커넥션 재사용(keep-alive)
+_SESSION = requests.Session()
 
 SYS = (
     "너는 법률·규정 기반 RAG 어시스턴트다. 내부 사고/분석 과정은 절대 출력하지 마라.\n"
@@ -17,96 +60,704 @@ SYS = (
     "출처는 [파일명#chunk번호] 형식으로 표기한다.\n"
     "자료에 없으면 그 사실을 말하고 필요한 문서를 제안한다. 마지막 줄에 면책 문구를 붙인다."
 )
+FORMAT_RULE = "형식: 요지 → (필요시) 원문 인용 → 출처 표기"
+# 모든 요청이 공유하는 고정 접두부(요청마다 바뀌는 내용을 넣지 말 것)
+SYSTEM_PROMPT = SYS + "\n" + FORMAT_RULE
+CONTEXT_HEADER = "아래 참고 자료만 사용하여 답하라:\n"
 
 CHAT_OPTIONS = {
     "temperature": 0.2,
-    "num_ctx": 4096,
-    "keep_alive": "5m",
+    "num_ctx": LLM_NUM_CTX,
     # ⛔️ think 관련 stop 제거합니다. 정답이 잘립니다.
     # "stop": ["</think>", "<think>", "<|assistant_thought|>", "```thinking"]
 }
+# 모델별 덮어쓰기: canonical 모델명 → {"num_ctx": ..., "keep_alive": ..., 기타 options}
+MODEL_OVERRIDES: Dict[str, Dict[str, Any]] = {}
+WARMUP_MODELS: List[str] = []
+_MODEL_SETTINGS: Dict[str, Tuple[Dict[str, Any], str]] = {}
+
+# 모델 호출이 모두 실패/빈 응답일 때의 대체 문구(캐시하지 않음)
+EMPTY_ANSWER = "자료에 없음 또는 모델 응답이 비었습니다."
 
-THINK_PATTERNS = [
-    (r"<think>.*?</think>", re.S | re.I),
-    (r"<\|assistant_thought\|.*?(?:<\|assistant\|>|$)", re.S | re.I),
-    (r"```thinking.*?```", re.S | re.I),
-    # 모델이 실수로 JSON을 그대로 내보낼 때 방어
+# 내부 사고 구간 (열림, 닫힘). 닫힘이 없으면 끝까지 제거.
+THINK_MARKERS: List[Tuple[str, str]] = [
+    ("<think>", "</think>"),
+    ("<|assistant_thought|", "<|assistant|>"),
+    ("```thinking", "```"),
+]
+
+# 모델이 실수로 JSON을 그대로 내보낼 때 방어(전체 문자열 후처리용)
+LEAK_PATTERNS = [
     (r"\"sources\"\s*:\s*\[.*?\]", re.S | re.I),
     (r"\"metadata\"\s*:\s*\{.*?\}", re.S | re.I),
 ]
 
+
+class ThinkFilter:
+    """스트림 청크 경계를 넘어서는 <think>…</think> 구간을 점진적으로 제거하는 필터.
+
+    feed(chunk)는 지금 내보내도 안전한 텍스트만 반환하고, 마커 일부일 수 있는
+    꼬리 문자열은 다음 청크까지 보류합니다. 마지막에 flush()를 호출하세요.
+    """
+
+    def __init__(self, markers: Optional[List[Tuple[str, str]]] = None) -> None:
+        self.markers = [(o.lower(), c.lower()) for o, c in (markers or THINK_MARKERS)]
+        self._buf = ""
+        self._close: Optional[str] = None  # 사고 구간 안이면 기다리는 닫힘 마커
+        self._started = False  # 앞쪽 공백 제거용
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        out: List[str] = []
+        while self._buf:
+            low = self._buf.lower()
+            if self._close is not None:
+                i = low.find(self._close)
+                if i < 0:
+                    # 닫힘 마커가 청크 경계에 걸칠 수 있으므로 꼬리만 보존
+                    keep = len(self._close) - 1
+                    self._buf = self._buf[-keep:] if keep else ""
+                    break
+                self._buf = self._buf[i + len(self._close):]
+                self._close = None
+                continue
+            pos, hit = -1, None
+            for o, c in self.markers:
+                i = low.find(o)
+                if i >= 0 and (pos < 0 or i < pos):
+                    pos, hit = i, (o, c)
+            if hit is not None:
+                out.append(self._buf[:pos])
+                self._buf = self._buf[pos + len(hit[0]):]
+                self._close = hit[1]
+                continue
+            hold = self._partial_open(low)
+            out.append(self._buf[:len(self._buf) - hold])
+            self._buf = self._buf[len(self._buf) - hold:]
+            break
+        return self._emit("".join(out))
+
+    def flush(self) -> str:
+        rest = "" if self._close is not None else self._buf
+        self._buf, self._close = "", None
+        return self._emit(rest)
+
+    def _partial_open(self, low: str) -> int:
+        """버퍼 끝이 열림 마커의 앞부분과 겹치는 최대 길이."""
+        best = 0
+        for o, _ in self.markers:
+            for n in range(min(len(o) - 1, len(low)), best, -1):
+                if low.endswith(o[:n]):
+                    best = n
+                    break
+        return best
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+# LEAK_PATTERNS의 시작부(키 + 여는 괄호)와 키 이름: 스트림에서 청크 경계를 넘어 제거할 때 사용
+_LEAK_OPEN = re.compile(r"\"(sources|metadata)\"\s*:\s*([\[{])", re.I)
+_LEAK_KEYS = ('"sources"', '"metadata"')
+
+
+class LeakFilter:
+    """스트림용 LEAK_PATTERNS 적용: 원문 "sources": [...] / "metadata": {...} 조각을 청크 경계를 넘어 제거.
+
+    키의 앞부분일 수 있는 꼬리와 아직 닫히지 않은 조각은 보류합니다.
+    끝까지 닫히지 않으면 _strip_think와 마찬가지로 그대로 내보냅니다(flush).
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        out: List[str] = []
+        while True:
+            m = _LEAK_OPEN.search(self._buf)
+            if m is None:
+                hold = self._partial_key(self._buf)
+                out.append(self._buf[:len(self._buf) - hold])
+                self._buf = self._buf[len(self._buf) - hold:]
+                break
+            out.append(self._buf[:m.start()])
+            end = self._buf.find("]" if m.group(2) == "[" else "}", m.end())
+            if end < 0:
+                self._buf = self._buf[m.start():]
+                break
+            self._buf = self._buf[end + 1:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        rest, self._buf = self._buf, ""
+        return rest
+
+    @staticmethod
+    def _partial_key(buf: str) -> int:
+        """버퍼 끝에서 누출 키("sources" 등 + 공백/콜론)의 시작일 수 있는 길이."""
+        q = buf.find('"', max(len(buf) - 64, 0))
+        while q >= 0:
+            tail = buf[q:].lower()
+            for key in _LEAK_KEYS:
+                if key.startswith(tail) or (tail.startswith(key) and re.fullmatch(r"\s*(:\s*)?", tail[len(key):])):
+                    return len(buf) - q
+            q = buf.find('"', q + 1)
+        return 0
+
+
 def _strip_think(text: str) -> str:
     if not text:
         return text
-    for pat, flags in THINK_PATTERNS:
+    f = ThinkFilter()
+    text = f.feed(text) + f.flush()
+    for pat, flags in LEAK_PATTERNS:
         text = re.sub(pat, "", text, flags=flags)
     return text.strip()
 
-def _chat(model: str, prompt: str) -> str:
-    payload = {
+def configure(llm_cfg: Optional[Dict[str, Any]]) -> None:
+    """config.yaml의 llm 섹션 반영: num_ctx/keep_alive 기본값, models(모델별 덮어쓰기), warmup(예열 모델)."""
+    global LLM_KEEP_ALIVE
+    cfg = llm_cfg or {}
+    if cfg.get("num_ctx"):
+        CHAT_OPTIONS["num_ctx"] = int(cfg["num_ctx"])
+    if cfg.get("keep_alive") is not None:
+        LLM_KEEP_ALIVE = str(cfg["keep_alive"])
+    MODEL_OVERRIDES.clear()
+    for name, opts in (cfg.get("models") or {}).items():
+        MODEL_OVERRIDES[canonical_model(name)] = dict(opts or {})
+    # warmup: []은 "예열 안 함"(키가 없을 때만 기본 모델 예열)
+    WARMUP_MODELS[:] = list(cfg["warmup"] or []) if "warmup" in cfg else ([cfg["model"]] if cfg.get("model") else [])
+    _MODEL_SETTINGS.clear()
+
+def model_settings(model: str) -> Tuple[Dict[str, Any], str]:
+    """모델별 (options, keep_alive). 같은 모델에는 항상 같은 값을 보내야 Ollama가 재로드하지 않음."""
+    hit = _MODEL_SETTINGS.get(model)
+    if hit is None:
+        opts = dict(CHAT_OPTIONS)
+        over = dict(MODEL_OVERRIDES.get(canonical_model(model)) or {})
+        keep_alive = str(over.pop("keep_alive", LLM_KEEP_ALIVE))
+        opts.update(over)
+        hit = _MODEL_SETTINGS[model] = (opts, keep_alive)
+    return hit
+
+def _chat_payload(model: str, prompt: str, stream: bool) -> Dict[str, Any]:
+    options, keep_alive = model_settings(model)
+    return {
         "model": model,
-        "stream": False,
-        "options": CHAT_OPTIONS,
+        "stream": stream,
+        "options": options,
+        "keep_alive": keep_alive,
         "messages": [
-            {"role": "system", "content": SYS},
-            {"role": "user", "content": prompt + "\n\n형식: 요지 → (필요시) 원문 인용 → 출처 표기"}
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
         ]
     }
-    r = requests.post(f"{OLLAMA_HOST}/api/chat", json=payload, timeout=180)
+
+def _generate_payload(model: str, prompt: str, stream: bool) -> Dict[str, Any]:
+    # system을 분리해 넘기면 chat과 같은 템플릿 토큰열이 되어 폴백 시에도 접두부 캐시를 재사용
+    options, keep_alive = model_settings(model)
+    return {
+        "model": model,
+        "system": SYSTEM_PROMPT,
+        "prompt": prompt,
+        "stream": stream,
+        "options": options,
+        "keep_alive": keep_alive,
+    }
+
+def _observe(payload: Dict[str, Any], data: Dict[str, Any], sink: Optional[Dict[str, Any]] = None) -> None:
+    """완료 응답의 prompt_eval_count/duration 등을 모델별로 기록(접두부 재사용 확인 + /metrics + 요청별 sink)."""
+    try:
+        model = payload["model"]
+        prompt = (payload.get("messages") or [{}])[-1].get("content") or payload.get("prompt") or ""
+        PROMPT_STATS.record(model, data, estimate_tokens(SYSTEM_PROMPT + prompt, model))
+        row = {
+            "prompt_eval_ms": float(data.get("prompt_eval_duration") or 0) / 1e6,
+            "prompt_eval_tokens": float(data.get("prompt_eval_count") or 0),
+            "eval_ms": float(data.get("eval_duration") or 0) / 1e6,
+            "eval_tokens": float(data.get("eval_count") or 0),
+            "load_ms": float(data.get("load_duration") or 0) / 1e6,
+        }
+        LLM_PROMPT_EVAL_SECONDS.observe(row["prompt_eval_ms"] / 1000.0, model=model)
+        LLM_EVAL_SECONDS.observe(row["eval_ms"] / 1000.0, model=model)
+        LLM_LOAD_SECONDS.observe(row["load_ms"] / 1000.0, model=model)
+        LLM_PROMPT_TOKENS.inc(row["prompt_eval_tokens"], model=model)
+        LLM_EVAL_TOKENS.inc(row["eval_tokens"], model=model)
+        if sink is not None:
+            for k, v in row.items():
+                sink[k] = sink.get(k, 0.0) + v
+    except Exception:
+        pass
+
+def _piece(data: Dict[str, Any]) -> str:
+    """chat(message.content) / generate(response) 응답 공통 텍스트 추출."""
+    return (data.get("message") or {}).get("content") or data.get("response") or ""
+
+def _chat(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> str:
+    payload = _chat_payload(model, prompt, stream=False)
+    r = _SESSION.post(f"{OLLAMA_HOST}/api/chat", json=payload, timeout=(5.0, timeout))
     r.raise_for_status()
     data = r.json()
+    _observe(payload, data, sink)
     return ((data.get("message") or {}).get("content") or "").strip()
 
-def _generate(model: str, prompt: str) -> str:
-    payload = {
-        "model": model,
-        "prompt": SYS + "\n\n" + prompt + "\n\n형식: 요지 → (필요시) 원문 인용 → 출처 표기",
-        "stream": False,
-        "options": CHAT_OPTIONS
-    }
-    r = requests.post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=180)
+def _generate(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> str:
+    payload = _generate_payload(model, prompt, stream=False)
+    r = _SESSION.post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=(5.0, timeout))
     r.raise_for_status()
     data = r.json()
+    _observe(payload, data, sink)
     return (data.get("response") or "").strip()
 
-def build_context(chunks: List[Dict[str, Any]]) -> str:
-    # 딕셔너리 전체가 아니라 텍스트만, 사람이 읽을 수 있는 출처 표기로 구성
-    parts = []
-    for c in chunks:
-        src = c.get("source_id") or f"{(c.get('metadata') or {}).get('source')}#chunk{(c.get('metadata') or {}).get('chunk_idx')}"
-        txt = (c.get("text") or "").strip()
-        if not txt:
-            continue
-        parts.append(f"[{src}]\n{txt}")
-    return "\n\n".join(parts)
-
-def answer_question(question: str, retrieved_chunks: List[Dict[str, Any]], model_name: str) -> str:
-    context = build_context(retrieved_chunks)
-    prompt = (
-        f"질문: {question}\n\n"
-        f"아래 참고 자료만 사용하여 답하라:\n{context if context else '(참고 자료 없음)'}"
-    )
+def _stream(path: str, payload: Dict[str, Any], timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """Ollama NDJSON 스트림에서 텍스트 조각만 꺼내 반환."""
+    with _SESSION.post(f"{OLLAMA_HOST}{path}", json=payload, stream=True, timeout=(5.0, timeout)) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            piece = _piece(data)
+            if piece:
+                yield piece
+            if data.get("done"):
+                _observe(payload, data, sink)
+                break
+
+def _chat_stream(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    return _stream("/api/chat", _chat_payload(model, prompt, stream=True), timeout, sink)
+
+def _generate_stream(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    return _stream("/api/generate", _generate_payload(model, prompt, stream=True), timeout, sink)
+
+# --- 비동기 클라이언트 ---
+_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+_MODEL_SLOTS: Dict[str, asyncio.Semaphore] = {}
+
+def get_async_client() -> httpx.AsyncClient:
+    """프로세스 공유 AsyncClient(keep-alive 커넥션 풀). 최초 호출 시 생성."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT.is_closed:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            base_url=OLLAMA_HOST,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _ASYNC_CLIENT
+
+def async_client_open() -> bool:
+    """공유 AsyncClient가 생성되어 열려 있는지(/readyz 보고용, 새로 만들지 않음)."""
+    return _ASYNC_CLIENT is not None and not _ASYNC_CLIENT.is_closed
+
+async def aclose_async_client() -> None:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
 
-    # 1차 시도 (chat)
+def _model_slot(model: str) -> asyncio.Semaphore:
+    """모델별 동시 생성 수 제한. 초과 요청은 Ollama가 아닌 여기서 대기."""
+    sem = _MODEL_SLOTS.get(model)
+    if sem is None:
+        sem = _MODEL_SLOTS[model] = asyncio.Semaphore(max(LLM_MAX_CONCURRENCY, 1))
+    return sem
+
+class SlotWaitTimeout(Exception):
+    """데드라인 안에 모델 슬롯을 받지 못함. 대기열이 밀린 것이지 Ollama 장애가 아니므로 서킷에 기록하지 않음."""
+
+async def _acquire_slot(model: str, deadline: Optional[float], sink: Optional[Dict[str, Any]]) -> None:
+    """모델 슬롯 획득. deadline(time.monotonic 기준)까지 못 받으면 SlotWaitTimeout."""
+    sem = _model_slot(model)
+    with span("llm_queue", sink):
+        if deadline is None:
+            await sem.acquire()
+            return
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=max(deadline - time.monotonic(), 0.0))
+        except asyncio.TimeoutError:
+            raise SlotWaitTimeout(f"{model} 생성 슬롯 대기 중 데드라인 초과") from None
+
+async def _apost(
+    path: str,
+    payload: Dict[str, Any],
+    timeout: float = LLM_TIMEOUT,
+    sink: Optional[Dict[str, Any]] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    await _acquire_slot(payload["model"], deadline, sink)
+    try:
+        if deadline is not None:
+            # 슬롯 대기로 쓴 시간만큼 HTTP 타임아웃을 줄여 데드라인을 지킴
+            timeout = min(timeout, max(deadline - time.monotonic(), 0.001))
+        r = await get_async_client().post(path, json=payload, timeout=httpx.Timeout(timeout, connect=5.0))
+        r.raise_for_status()
+        data = r.json()
+    finally:
+        _model_slot(payload["model"]).release()
+    _observe(payload, data, sink)
+    return data
+
+async def _achat(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None, deadline: Optional[float] = None) -> str:
+    data = await _apost("/api/chat", _chat_payload(model, prompt, stream=False), timeout, sink, deadline)
+    return ((data.get("message") or {}).get("content") or "").strip()
+
+async def _agenerate(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None, deadline: Optional[float] = None) -> str:
+    data = await _apost("/api/generate", _generate_payload(model, prompt, stream=False), timeout, sink, deadline)
+    return (data.get("response") or "").strip()
+
+async def _astream(path: str, payload: Dict[str, Any], timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    with span("llm_queue", sink):
+        await _model_slot(payload["model"]).acquire()
+    try:
+        async with get_async_client().stream(
+            "POST", path, json=payload, timeout=httpx.Timeout(timeout, connect=5.0)
+        ) as r:
+            if r.status_code >= 400:
+                await r.aread()  # classify_error가 오류 본문(모델 없음 여부)을 볼 수 있도록
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                piece = _piece(data)
+                if piece:
+                    yield piece
+                if data.get("done"):
+                    _observe(payload, data, sink)
+                    break
+    finally:
+        _model_slot(payload["model"]).release()
+
+def _achat_stream(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    return _astream("/api/chat", _chat_payload(model, prompt, stream=True), timeout, sink)
+
+def _agenerate_stream(model: str, prompt: str, timeout: float = LLM_TIMEOUT, sink: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    return _astream("/api/generate", _generate_payload(model, prompt, stream=True), timeout, sink)
+
+# --- 설치 모델 목록 조회(캐시) ---
+def _tag_names(data: Dict[str, Any]) -> List[str]:
+    return [m.get("name") or m.get("model") or "" for m in (data.get("models") or [])]
+
+def refresh_catalog() -> None:
+    """TTL이 지났으면 /api/tags로 설치 모델 목록 갱신(실패는 '알 수 없음'으로 기록)."""
+    if not CATALOG.is_stale():
+        return
     try:
-        ans = _chat(model_name, prompt)
+        r = _SESSION.get(f"{OLLAMA_HOST}/api/tags", timeout=(2.0, 5.0))
+        r.raise_for_status()
+        CATALOG.update(_tag_names(r.json()))
     except Exception:
-        ans = ""
+        CATALOG.update(None)
 
-    # 2차 시도 (generate)
-    if not ans:
-        try:
-            ans = _generate(model_name, prompt)
-        except Exception:
-            ans = ""
+async def refresh_catalog_async() -> None:
+    if not CATALOG.is_stale():
+        return
+    try:
+        r = await get_async_client().get("/api/tags", timeout=httpx.Timeout(5.0, connect=2.0))
+        r.raise_for_status()
+        CATALOG.update(_tag_names(r.json()))
+    except Exception:
+        CATALOG.update(None)
 
-    # 3차 시도: instruct 변형
-    if not ans and not model_name.endswith("-instruct"):
-        try_model = model_name + "-instruct"
+# --- 예열 ---
+WARMUP_RESULTS: Dict[str, Dict[str, Any]] = {}
+
+async def warmup_async(models: Optional[List[str]] = None, timeout: float = LLM_TIMEOUT) -> Dict[str, Dict[str, Any]]:
+    """모델을 (요청과 같은 options/keep_alive로) 로드하고 고정 접두부를 한 번 평가해 KV 캐시에 올림.
+
+    설치되지 않은 모델은 건너뜀. 결과(로드/접두부 평가 ms 또는 오류)는 WARMUP_RESULTS에도 남김.
+    """
+    await refresh_catalog_async()
+    for model in dict.fromkeys(models if models is not None else WARMUP_MODELS):
+        if CATALOG.has(model) is False:
+            WARMUP_RESULTS[model] = {"ok": False, "error": "not installed"}
+            continue
+        payload = _chat_payload(model, CONTEXT_HEADER, stream=False)
+        payload["options"] = {**payload["options"], "num_predict": 1}
+        t0 = time.perf_counter()
         try:
-            ans = _chat(try_model, prompt) or _generate(try_model, prompt)
-        except Exception:
-            pass
+            async with _model_slot(model):
+                r = await get_async_client().post("/api/chat", json=payload, timeout=httpx.Timeout(timeout, connect=5.0))
+                r.raise_for_status()
+                data = r.json()
+            WARMUP_RESULTS[model] = {
+                "ok": True,
+                "total_ms": (time.perf_counter() - t0) * 1000.0,
+                "load_ms": float(data.get("load_duration") or 0) / 1e6,
+                "prefix_tokens": data.get("prompt_eval_count"),
+                "prefix_eval_ms": float(data.get("prompt_eval_duration") or 0) / 1e6,
+            }
+        except Exception as e:
+            WARMUP_RESULTS[model] = {"ok": False, "error": str(e)}
+        print(f"[LLM] warmup {model}: {WARMUP_RESULTS[model]}")
+    return WARMUP_RESULTS
+
+def build_context(chunks: List[Dict[str, Any]], model: Optional[str] = None, budget: int = 0) -> str:
+    # 딕셔너리 전체가 아니라 텍스트만, 사람이 읽을 수 있는 출처 표기로 구성(budget=0이면 전부)
+    return pack_context(chunks, budget, model).text
+
+def _prompt(question: str, context: str) -> str:
+    # 질문을 끝에 둠: 고정 접두부(CONTEXT_HEADER) 뒤로 참고 자료가 먼저 와서 같은 자료의 후속 질문도 캐시 재사용
+    return (
+        f"{CONTEXT_HEADER}{context if context else '(참고 자료 없음)'}\n\n"
+        f"질문: {question}"
+    )
+
+def context_budget(question: str, model: Optional[str] = None) -> int:
+    """참고 자료에 쓸 수 있는 토큰 수: num_ctx - 답변 예약 - (시스템 프롬프트 + 질문 + 형식 지시)."""
+    if LLM_CONTEXT_TOKENS > 0:
+        return LLM_CONTEXT_TOKENS
+    num_ctx = int(model_settings(model)[0].get("num_ctx") or LLM_NUM_CTX) if model else LLM_NUM_CTX
+    fixed = estimate_tokens(SYSTEM_PROMPT + _prompt(question, ""), model)
+    # 채팅 템플릿 토큰(역할 태그 등) 여유
+    return max(num_ctx - LLM_ANSWER_TOKENS - fixed - 32, 256)
+
+def pack_prompt(question: str, retrieved_chunks: List[Dict[str, Any]], model: Optional[str] = None) -> Tuple[str, PackResult]:
+    """예산 안으로 참고 자료를 채운 프롬프트 + 패킹 결과(사용/버린 청크·토큰)."""
+    pack = pack_context(retrieved_chunks, context_budget(question, model), model)
+    if LLM_DEBUG and (pack.dropped or pack.truncated):
+        print(f"[LLM] context packed: {len(pack.used)} chunks/{pack.tokens} tok, "
+              f"dropped {len(pack.dropped)} chunks/{pack.dropped_tokens} tok (budget {pack.budget})")
+    return _prompt(question, pack.text), pack
+
+def build_prompt(question: str, retrieved_chunks: List[Dict[str, Any]], model: Optional[str] = None) -> str:
+    return pack_prompt(question, retrieved_chunks, model)[0]
+
+def _fallback_chain(model_name: str) -> List[Tuple[str, str]]:
+    """(엔드포인트, 모델) 시도 순서: chat → generate → instruct 변형 chat → generate."""
+    chain = [("chat", model_name), ("generate", model_name)]
+    if not model_name.endswith("-instruct"):
+        chain += [("chat", model_name + "-instruct"), ("generate", model_name + "-instruct")]
+    return chain
+
+def _plan(model_name: str) -> List[Tuple[str, str]]:
+    """설치되지 않은 모델(목록 기준)과 서킷이 열린 엔드포인트/모델을 제외한 시도 목록."""
+    plan = []
+    for kind, model in _fallback_chain(model_name):
+        if CATALOG.has(model) is False:
+            continue
+        if not (BREAKER.allow(f"endpoint:{kind}") and BREAKER.allow(f"model:{model}")):
+            continue
+        plan.append((kind, model))
+    return plan
+
+def _call_done(kind: str, model: str, t0: float, stats: Optional[Dict[str, Any]]) -> None:
+    """폴백 체인 시도 1회의 소요 시간 기록."""
+    LLM_CALL_SECONDS.observe(time.perf_counter() - t0, endpoint=kind, model=model)
+    if stats is not None:
+        stats["llm_attempts"] = stats.get("llm_attempts", 0.0) + 1
+
+def _on_success(kind: str, model: str) -> None:
+    LLM_CALLS.inc(endpoint=kind, model=model, outcome="ok")
+    BREAKER.success(f"endpoint:{kind}")
+    BREAKER.success(f"model:{model}")
+
+def _on_failure(kind: str, model: str, exc: BaseException) -> bool:
+    """실패 기록. True면 체인 전체 중단(Ollama 자체 불통)."""
+    cls = classify_error(exc)
+    LLM_CALLS.inc(endpoint=kind, model=model, outcome=cls)
+    if cls == NOT_FOUND:
+        # 없는 모델은 타임아웃을 기다리지 않고 다음 후보로(서킷 카운트 X)
+        CATALOG.mark_missing(model)
+        return False
+    if cls == ENDPOINT_MISSING:
+        # 엔드포인트가 없음(/api/chat 없는 구버전 등): 엔드포인트 서킷만 세고 같은 모델의 다른 엔드포인트는 계속 시도
+        BREAKER.failure(f"endpoint:{kind}")
+        return False
+    BREAKER.failure(f"endpoint:{kind}")
+    BREAKER.failure(f"model:{model}")
+    return cls == CONNECTION
+
+def answer_question(question: str, retrieved_chunks: List[Dict[str, Any]], model_name: str, stats: Optional[Dict[str, Any]] = None) -> str:
+    with span("pack", stats):
+        prompt, pack = pack_prompt(question, retrieved_chunks, model_name)
+    if stats is not None:
+        stats.update(pack.stats())
+    calls = {"chat": _chat, "generate": _generate}
+    refresh_catalog()
+    deadline = time.monotonic() + LLM_DEADLINE
+
+    ans = ""
+    with span("llm", stats):
+        for kind, model in _plan(model_name):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            t_call = time.perf_counter()
+            try:
+                ans = calls[kind](model, prompt, timeout=min(LLM_TIMEOUT, remaining), sink=stats)
+                _on_success(kind, model)
+            except Exception as e:
+                ans = ""
+                if _on_failure(kind, model, e):
+                    break
+            finally:
+                _call_done(kind, model, t_call, stats)
+            if ans:
+                break
 
     ans = _strip_think(ans or "")
-    return ans if ans else "자료에 없음 또는 모델 응답이 비었습니다."
+    return ans if ans else EMPTY_ANSWER
+
+async def answer_question_async(question: str, retrieved_chunks: List[Dict[str, Any]], model_name: str, stats: Optional[Dict[str, Any]] = None) -> str:
+    """answer_question의 비동기 버전(공유 커넥션 풀 + 모델별 동시성 제한)."""
+    with span("pack", stats):
+        prompt, pack = pack_prompt(question, retrieved_chunks, model_name)
+    if stats is not None:
+        stats.update(pack.stats())
+    calls = {"chat": _achat, "generate": _agenerate}
+    await refresh_catalog_async()
+    deadline = time.monotonic() + LLM_DEADLINE
+
+    ans = ""
+    with span("llm", stats):
+        for kind, model in _plan(model_name):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            t_call = time.perf_counter()
+            try:
+                # 모델 슬롯 대기 시간까지 데드라인에 포함(대기만으로 초과하면 SlotWaitTimeout)
+                ans = await calls[kind](model, prompt, timeout=min(LLM_TIMEOUT, remaining), sink=stats, deadline=deadline)
+                _on_success(kind, model)
+            except SlotWaitTimeout:
+                # 슬롯을 못 받은 채 데드라인 소진: 서킷 실패로 세지 않고 체인 종료
+                ans = ""
+                LLM_CALLS.inc(endpoint=kind, model=model, outcome="queue_timeout")
+                break
+            except Exception as e:
+                ans = ""
+                if _on_failure(kind, model, e):
+                    break
+            finally:
+                _call_done(kind, model, t_call, stats)
+            if ans:
+                break
+
+    ans = _strip_think(ans or "")
+    return ans if ans else EMPTY_ANSWER
+
+
+def answer_question_stream(question: str, retrieved_chunks: List[Dict[str, Any]], model_name: str, stats: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """answer_question의 스트리밍 버전. 사고 구간을 걸러낸 텍스트 조각을 순서대로 반환.
+
+    첫 조각을 내보내기 전에 실패하면 chat → generate → instruct 변형 순으로 재시도하고,
+    이미 일부를 보낸 뒤의 실패는 그대로 종료합니다(중복 출력 방지).
+    """
+    with span("pack", stats):
+        prompt, pack = pack_prompt(question, retrieved_chunks, model_name)
+    if stats is not None:
+        stats.update(pack.stats())
+    calls = {"chat": _chat_stream, "generate": _generate_stream}
+    refresh_catalog()
+    deadline = time.monotonic() + LLM_DEADLINE
+
+    emitted = False
+    t_start = time.perf_counter()
+    with span("llm", stats):
+        for kind, model in _plan(model_name):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            f, leak = ThinkFilter(), LeakFilter()
+            t_call = time.perf_counter()
+            pieces = calls[kind](model, prompt, timeout=min(LLM_TIMEOUT, remaining), sink=stats)
+            try:
+                for piece in pieces:
+                    out = leak.feed(f.feed(piece))
+                    if out:
+                        if not emitted and stats is not None:
+                            stats["llm_first_token_ms"] = (time.perf_counter() - t_start) * 1000.0
+                        emitted = True
+                        yield out
+                    # 읽기 타임아웃은 조각 사이 간격만 제한 → 토큰이 계속 나와도 데드라인에서 끊음
+                    if time.monotonic() > deadline:
+                        if stats is not None:
+                            stats["llm_deadline_hit"] = 1.0
+                        break
+                out = leak.feed(f.flush()) + leak.flush()
+                if out:
+                    emitted = True
+                    yield out
+                _on_success(kind, model)
+            except Exception as e:
+                stop = _on_failure(kind, model, e)
+                if emitted:
+                    return
+                if stop:
+                    break
+                continue
+            finally:
+                pieces.close()
+                _call_done(kind, model, t_call, stats)
+            if emitted:
+                return
+    if not emitted:
+        yield EMPTY_ANSWER
+
+
+async def answer_question_stream_async(question: str, retrieved_chunks: List[Dict[str, Any]], model_name: str, stats: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """answer_question_stream의 비동기 버전."""
+    with span("pack", stats):
+        prompt, pack = pack_prompt(question, retrieved_chunks, model_name)
+    if stats is not None:
+        stats.update(pack.stats())
+    calls = {"chat": _achat_stream, "generate": _agenerate_stream}
+    await refresh_catalog_async()
+    deadline = time.monotonic() + LLM_DEADLINE
+
+    emitted = False
+    t_start = time.perf_counter()
+    with span("llm", stats):
+        for kind, model in _plan(model_name):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            f, leak = ThinkFilter(), LeakFilter()
+            t_call = time.perf_counter()
+            pieces = calls[kind](model, prompt, timeout=min(LLM_TIMEOUT, remaining), sink=stats)
+            try:
+                async for piece in pieces:
+                    out = leak.feed(f.feed(piece))
+                    if out:
+                        if not emitted and stats is not None:
+                            stats["llm_first_token_ms"] = (time.perf_counter() - t_start) * 1000.0
+                        emitted = True
+                        yield out
+                    # 읽기 타임아웃은 조각 사이 간격만 제한 → 토큰이 계속 나와도 데드라인에서 끊음
+                    if time.monotonic() > deadline:
+                        if stats is not None:
+                            stats["llm_deadline_hit"] = 1.0
+                        break
+                out = leak.feed(f.flush()) + leak.flush()
+                if out:
+                    emitted = True
+                    yield out
+                _on_success(kind, model)
+            except Exception as e:
+                stop = _on_failure(kind, model, e)
+                if emitted:
+                    return
+                if stop:
+                    break
+                continue
+            finally:
+                # 중간에 끊어도 HTTP 스트림/모델 슬롯을 바로 반납
+                await pieces.aclose()
+                _call_done(kind, model, t_call, stats)
+            if emitted:
+                return
+    if not emitted:
+        yield EMPTY_ANSWER
@@ -0,0 +1,153 @@
+# [RAG][generation][guard]
+# 역할: LLM 폴백 체인(chat → generate → instruct)이 실패를 "분 단위"가 아니라 "밀리초 단위"로 처리하도록 보조.
+# - ModelCatalog: Ollama /api/tags 결과를 TTL 동안 캐시 → 설치되지 않은 모델은 호출 없이 건너뜀.
+# - CircuitBreaker: 엔드포인트(chat/generate)별, 모델별 연속 실패 시 일정 시간 차단(half-open 1회 시도).
+# - classify_error: 예외를 not_found / endpoint_missing / connection / timeout / http / other 로 분류.
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+import httpx
+import requests
+
+
+def canonical_model(name: str) -> str:
+    """Ollama 모델명 정규화: 태그가 없으면 ':latest'."""
+    name = (name or "").strip()
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelCatalog:
+    """설치된 모델 목록 캐시. 조회 실패 시에는 '알 수 없음(None)'으로 두어 호출을 막지 않음."""
+
+    def __init__(self, ttl_s: float = 300.0, retry_s: float = 10.0) -> None:
+        self.ttl_s = ttl_s
+        self.retry_s = retry_s  # 조회 실패 후 재시도 간격
+        self._models: Optional[Set[str]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        age = time.monotonic() - self._checked_at
+        return age > (self.ttl_s if self._models is not None else self.retry_s)
+
+    def update(self, names: Optional[Iterable[str]]) -> None:
+        """names=None이면 조회 실패로 기록."""
+        with self._lock:
+            self._models = {canonical_model(n) for n in names} if names is not None else None
+            self._checked_at = time.monotonic()
+
+    def has(self, model: str) -> Optional[bool]:
+        """True/False = 목록 기준 설치 여부, None = 목록을 모름."""
+        models = self._models
+        if models is None:
+            return None
+        return canonical_model(model) in models
+
+    def mark_missing(self, model: str) -> None:
+        """호출 결과 'model not found'였던 모델을 목록에서 제거."""
+        with self._lock:
+            if self._models is not None:
+                self._models.discard(canonical_model(model))
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "models": sorted(self._models) if self._models is not None else None,
+            "age_s": time.monotonic() - self._checked_at if self._checked_at else None,
+        }
+
+
+class CircuitBreaker:
+    """키별 연속 실패 카운터. threshold회 연속 실패 시 reset_s 동안 open."""
+
+    def __init__(self, threshold: int = 3, reset_s: float = 30.0) -> None:
+        self.threshold = max(int(threshold), 1)
+        self.reset_s = float(reset_s)
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        with self._lock:
+            opened = self._opened_at.get(key)
+            if opened is None:
+                return True
+            if time.monotonic() - opened >= self.reset_s:
+                # half-open: 한 번만 시도 허용, 실패하면 다시 open
+                self._opened_at[key] = time.monotonic()
+                return True
+            return False
+
+    def success(self, key: str) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_at.pop(key, None)
+
+    def failure(self, key: str) -> None:
+        with self._lock:
+            n = self._failures.get(key, 0) + 1
+            self._failures[key] = n
+            if n >= self.threshold:
+                self._opened_at[key] = time.monotonic()
+
+    def state(self, key: str) -> str:
+        opened = self._opened_at.get(key)
+        if opened is None:
+            return "closed"
+        return "open" if time.monotonic() - opened < self.reset_s else "half-open"
+
+    def snapshot(self) -> Dict[str, str]:
+        return {k: self.state(k) for k in list(self._opened_at)}
+
+
+NOT_FOUND = "not_found"
+ENDPOINT_MISSING = "endpoint_missing"  # 본문 없는 404: 모델이 아니라 엔드포인트가 없음(예: /api/chat 없는 구버전 Ollama)
+CONNECTION = "connection"
+TIMEOUT = "timeout"
+HTTP = "http"
+OTHER = "other"
+
+
+def classify_error(exc: BaseException) -> str:
+    """requests/httpx 예외를 폴백 정책용 범주로 분류."""
+    text = str(exc).lower()
+    status = None
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        text = (exc.response.text or "").lower()
+    elif isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        try:
+            text = exc.response.text.lower()
+        except Exception:
+            text = ""
+    # HTTP 오류는 응답 본문만 봄(예외 메시지의 'Not Found'는 엔드포인트가 없을 때도 나옴).
+    # Ollama의 모델 없음: 404 + {"error": "model \"x\" not found, try pulling it first"}
+    if "model" in text and "not found" in text:
+        return NOT_FOUND
+    if status == 404:
+        return ENDPOINT_MISSING
+    # 연결 실패를 타임아웃보다 먼저: ConnectTimeout은 Timeout의 하위 클래스이지만 Ollama 불통(체인 중단)으로 봐야 함
+    if isinstance(exc, (requests.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)):
+        return CONNECTION
+    if isinstance(exc, (requests.Timeout, httpx.TimeoutException)):
+        return TIMEOUT
+    if status is not None:
+        return HTTP
+    return OTHER
+
+
+__all__ = [
+    "canonical_model",
+    "ModelCatalog",
+    "CircuitBreaker",
+    "classify_error",
+    "NOT_FOUND",
+    "ENDPOINT_MISSING",
+    "CONNECTION",
+    "TIMEOUT",
+    "HTTP",
+    "OTHER",
+]
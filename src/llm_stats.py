@@ -0,0 +1,71 @@
+# [RAG][generation][stats]
+# 역할: Ollama 완료 응답의 prefill/생성 통계를 모델별로 누적 → 프롬프트 접두부(KV 캐시) 재사용 여부 확인.
+# - prompt_eval_count: Ollama가 실제로 평가한 프롬프트 토큰 수(캐시로 재사용된 접두부는 빠짐).
+# - 추정 프롬프트 토큰(src/context.estimate_tokens) 대비 평가 토큰 비율로 재사용률을 근사.
+# - load_duration이 크면(기본 500ms 이상) 모델 콜드 로드로 집계.
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional
+
+_NS_PER_MS = 1_000_000
+
+
+class PromptEvalStats:
+    """모델별 prompt_eval / eval / load 누적치. 스레드 안전."""
+
+    def __init__(self, cold_load_ms: float = 500.0) -> None:
+        self.cold_load_ms = float(cold_load_ms)
+        self._models: Dict[str, Dict[str, float]] = {}
+        self._last: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, data: Dict[str, Any], prompt_tokens_est: Optional[int] = None) -> None:
+        """data = Ollama 완료 응답(done=true). 통계 필드가 없으면 무시."""
+        if "prompt_eval_count" not in data and "prompt_eval_duration" not in data:
+            return
+        evaluated = float(data.get("prompt_eval_count") or 0)
+        row = {
+            "prompt_tokens_est": float(prompt_tokens_est or 0),
+            "prompt_eval_tokens": evaluated,
+            "prompt_eval_ms": float(data.get("prompt_eval_duration") or 0) / _NS_PER_MS,
+            "eval_tokens": float(data.get("eval_count") or 0),
+            "eval_ms": float(data.get("eval_duration") or 0) / _NS_PER_MS,
+            "load_ms": float(data.get("load_duration") or 0) / _NS_PER_MS,
+        }
+        with self._lock:
+            agg = self._models.setdefault(model, {"requests": 0.0, "cold_loads": 0.0, **{k: 0.0 for k in row}})
+            agg["requests"] += 1
+            agg["cold_loads"] += row["load_ms"] >= self.cold_load_ms
+            for k, v in row.items():
+                agg[k] += v
+            self._last[model] = row
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for model, agg in self._models.items():
+                n = max(agg["requests"], 1.0)
+                est = agg["prompt_tokens_est"]
+                out[model] = {
+                    "requests": agg["requests"],
+                    "cold_loads": agg["cold_loads"],
+                    "prompt_eval_tokens_avg": agg["prompt_eval_tokens"] / n,
+                    "prompt_eval_ms_avg": agg["prompt_eval_ms"] / n,
+                    "prompt_tokens_est_avg": est / n,
+                    # 1 - 평가 토큰/추정 토큰: 접두부가 캐시에서 재사용된 비율(추정치라 0~1로 자름)
+                    "prefix_reuse_est": min(max(1.0 - agg["prompt_eval_tokens"] / est, 0.0), 1.0) if est else 0.0,
+                    "eval_tokens_per_s": agg["eval_tokens"] * 1000.0 / agg["eval_ms"] if agg["eval_ms"] else 0.0,
+                    "load_ms_avg": agg["load_ms"] / n,
+                    "last_prompt_eval_tokens": self._last[model]["prompt_eval_tokens"],
+                    "last_prompt_eval_ms": self._last[model]["prompt_eval_ms"],
+                }
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._last.clear()
+
+
+__all__ = ["PromptEvalStats"]
@@ -0,0 +1,788 @@
+# [RAG][vectorstore][local]
+# 역할: Chroma 대신 쓰는 내장 벡터 인덱스(vectorstore.provider: local). SQLite/HNSW 없이 NumPy만 사용.
+# - 벡터: <path>/local/<컬렉션>/vectors.bin (float16, 또는 int8 + 행별 scale) → np.memmap으로 열어 필요한 페이지만 메모리에 올림.
+# - 메타/본문: rows.jsonl(추가/수정/삭제 로그, 본문은 오프셋만) + docs.bin(UTF-8, 필요할 때만 디코드).
+# - 검색: 블록 단위 행렬곱 전수 검색. 행 수가 ivf_min_rows 이상이면 IVF(k-means 분할, nprobe개 리스트만 검사).
+#   IVF 구축 뒤 추가된 행은 가장 가까운 리스트를 ivf_tail.bin에 기록 → 재구축 전까지도 프로브된 리스트만 검사.
+# - 거리 공간(space): cosine(1-cos, 저장 시 정규화) | l2(제곱 L2) | ip(1-내적) → Chroma hnsw:space와 같은 값이라
+#   Retriever의 1/(1+d) 점수를 그대로 사용. 마이그레이션은 원본 컬렉션의 space를 따름.
+# - Chroma Collection과 같은 메서드(add/get/query/update/delete/count/peek)와 where/where_document 부분집합 지원.
+# - 쓰기는 한 프로세스(ingest) 가정. 읽는 쪽(서버)은 manifest.json이 바뀌면 다시 로드.
+# TODO:
+# - (선택) IVF 리스트 순서로 vectors.bin 재배치(디스크 지역성).
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+import threading
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vectorstore import VectorStore
+
+DTYPES: Dict[str, Any] = {"float16": np.float16, "int8": np.int8}
+SPACES = ("cosine", "l2", "ip")
+# 전수 검색 블록 크기(행). 블록마다 float32로 풀어서 행렬곱 → 메모리 사용 상한
+BLOCK_ROWS = 32768
+# 삭제된 행 비율이 이 값을 넘으면 커밋 시 파일 재작성
+COMPACT_DEAD_RATIO = 0.3
+# IVF 구축 후 새로 추가된 행(꼬리)이 이 비율을 넘으면 재구축
+IVF_REBUILD_RATIO = 0.2
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    tmp.replace(path)
+
+
+def _write_at(path: Path, offset: int, data: bytes) -> None:
+    """offset 위치에 덮어쓰기(중단된 이전 쓰기의 찌꺼기는 manifest 범위 밖이라 무시됨)."""
+    with open(path, "r+b" if path.exists() else "wb") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def quantize(x: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """float32 행렬 → (저장용 배열, int8이면 행별 scale)."""
+    if dtype == "int8":
+        amax = np.abs(x).max(axis=1)
+        scale = np.where(amax > 0, amax / 127.0, 1.0).astype(np.float32)
+        q = np.clip(np.rint(x / scale[:, None]), -127, 127).astype(np.int8)
+        return q, scale
+    return x.astype(np.float16), None
+
+
+# --- where / where_document (Chroma 부분집합) ---
+_NUM_OPS = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}
+
+
+class _Columns:
+    """메타데이터 열 캐시(키별 object 배열 / 숫자 배열). 변경 시 새로 만듦."""
+
+    def __init__(self, metas: List[Optional[Dict[str, Any]]], n: int) -> None:
+        self.metas = metas
+        self.n = n
+        self._obj: Dict[str, np.ndarray] = {}
+        self._num: Dict[str, np.ndarray] = {}
+
+    def obj(self, key: str) -> np.ndarray:
+        col = self._obj.get(key)
+        if col is None:
+            col = np.empty(self.n, dtype=object)
+            col[:] = [(m or {}).get(key) for m in self.metas[: self.n]]
+            self._obj[key] = col
+        return col
+
+    def num(self, key: str) -> np.ndarray:
+        col = self._num.get(key)
+        if col is None:
+            col = np.array(
+                [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in self.obj(key)],
+                dtype=np.float64,
+            )
+            self._num[key] = col
+        return col
+
+
+def _field_mask(key: str, cond: Any, cols: _Columns) -> np.ndarray:
+    n = cols.n
+    if not isinstance(cond, dict):
+        cond = {"$eq": cond}
+    mask = np.ones(n, dtype=bool)
+    for op, val in cond.items():
+        if op in _NUM_OPS:
+            with np.errstate(invalid="ignore"):
+                mask &= _NUM_OPS[op](cols.num(key), float(val))
+        elif op in ("$eq", "$ne"):
+            hit = np.fromiter((v == val for v in cols.obj(key)), dtype=bool, count=n)
+            mask &= hit if op == "$eq" else ~hit
+        elif op in ("$in", "$nin"):
+            vals = set(val)
+            hit = np.fromiter((v in vals for v in cols.obj(key)), dtype=bool, count=n)
+            mask &= hit if op == "$in" else ~hit
+        else:
+            raise ValueError(f"지원하지 않는 where 연산자: {op}")
+    return mask
+
+
+def where_mask(where: Optional[Dict[str, Any]], cols: _Columns) -> np.ndarray:
+    if not where:
+        return np.ones(cols.n, dtype=bool)
+    mask = np.ones(cols.n, dtype=bool)
+    for key, cond in where.items():
+        if key == "$and":
+            for sub in cond:
+                mask &= where_mask(sub, cols)
+        elif key == "$or":
+            any_ = np.zeros(cols.n, dtype=bool)
+            for sub in cond:
+                any_ |= where_mask(sub, cols)
+            mask &= any_
+        else:
+            mask &= _field_mask(key, cond, cols)
+    return mask
+
+
+def doc_match(where_document: Dict[str, Any], text: str) -> bool:
+    for op, val in where_document.items():
+        if op == "$contains":
+            ok = val in text
+        elif op == "$not_contains":
+            ok = val not in text
+        elif op == "$and":
+            ok = all(doc_match(w, text) for w in val)
+        elif op == "$or":
+            ok = any(doc_match(w, text) for w in val)
+        else:
+            raise ValueError(f"지원하지 않는 where_document 연산자: {op}")
+        if not ok:
+            return False
+    return True
+
+
+# --- 검색 ---
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norm > 0, norm, 1.0)
+
+
+def _dequant(vecs: np.ndarray, scales: Optional[np.ndarray], rows: Any) -> np.ndarray:
+    x = np.asarray(vecs[rows], dtype=np.float32)
+    if scales is not None:
+        x *= scales[rows][:, None]
+    return x
+
+
+def exact_search(
+    vecs: np.ndarray,
+    scales: Optional[np.ndarray],
+    norms: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    rows: Optional[np.ndarray] = None,
+    n: Optional[int] = None,
+    space: str = "l2",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """거리 상위 k개 (행 번호 [nq, k'], 거리 [nq, k']). rows=None이면 앞 n행 전체를 연속 블록으로 읽음.
+
+    space=cosine이면 vecs/queries가 이미 정규화되어 있어야 함(거리 = 1 - 내적).
+    """
+    nq = queries.shape[0]
+    qn = (queries * queries).sum(axis=1)
+    best_d = np.empty((nq, 0), dtype=np.float32)
+    best_i = np.empty((nq, 0), dtype=np.int64)
+    total = (vecs.shape[0] if n is None else n) if rows is None else len(rows)
+    for s in range(0, total, BLOCK_ROWS):
+        e = min(s + BLOCK_ROWS, total)
+        idx = np.arange(s, e) if rows is None else rows[s:e]
+        x = _dequant(vecs, scales, slice(s, e) if rows is None else idx)
+        dots = queries @ x.T
+        if space == "l2":
+            d = (norms[idx][None, :] + qn[:, None] - 2.0 * dots).astype(np.float32)
+        else:
+            d = (1.0 - dots).astype(np.float32)
+        cat_d = np.concatenate([best_d, d], axis=1)
+        cat_i = np.concatenate([best_i, np.broadcast_to(idx, d.shape)], axis=1)
+        if cat_d.shape[1] > k:
+            part = np.argpartition(cat_d, k - 1, axis=1)[:, :k]
+            best_d = np.take_along_axis(cat_d, part, axis=1)
+            best_i = np.take_along_axis(cat_i, part, axis=1)
+        else:
+            best_d, best_i = cat_d, cat_i
+    order = np.argsort(best_d, axis=1, kind="stable")
+    best_d = np.take_along_axis(best_d, order, axis=1)
+    return np.take_along_axis(best_i, order, axis=1), np.maximum(best_d, 0.0) if space != "ip" else best_d
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    cn = (centroids * centroids).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int64)
+    for s in range(0, len(x), block):
+        out[s:s + block] = np.argmin(cn[None, :] - 2.0 * (x[s:s + block] @ centroids.T), axis=1)
+    return out
+
+
+def kmeans(x: np.ndarray, nlist: int, iters: int = 8, seed: int = 0) -> np.ndarray:
+    """간단한 Lloyd k-means. 빈 클러스터는 임의의 점으로 다시 시드."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty][:, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids.astype(np.float32)
+
+
+class LocalCollection:
+    """memmap 기반 컬렉션. Chroma Collection 대신 그대로 쓸 수 있는 메서드만 구현."""
+
+    def __init__(
+        self,
+        root: Path,
+        name: str,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+        dtype: str = "float16",
+        ivf_min_rows: int = 20000,
+        nprobe: int = 8,
+        space: str = "cosine",
+    ) -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"지원하지 않는 dtype: {dtype} (가능: {', '.join(DTYPES)})")
+        if space not in SPACES:
+            raise ValueError(f"지원하지 않는 space: {space} (가능: {', '.join(SPACES)})")
+        self.default_space = space
+        self.name = name
+        self.root = Path(root)
+        self.embedding_function = embedding_function
+        self.default_dtype = dtype
+        self.ivf_min_rows = int(ivf_min_rows)
+        self.nprobe = max(int(nprobe), 1)
+        # 커밋 후 자동 압축/IVF (재)구축. 대량 변환 중에는 끄고 마지막에 build_index()
+        self.auto_maintain = True
+        self._lock = threading.RLock()
+        self._seen_manifest: Optional[int] = None
+        self._load()
+
+    # --- 파일/상태 ---
+    def _path(self, name: str) -> Path:
+        return self.root / name
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self._path("manifest.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+
+    def _manifest_stamp(self) -> Optional[int]:
+        try:
+            return self._path("manifest.json").stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self) -> None:
+        self._seen_manifest = self._manifest_stamp()
+        m = self._read_manifest()
+        self.dim: Optional[int] = m.get("dim")
+        self.dtype: str = m.get("dtype") or self.default_dtype
+        self.space: str = m.get("space") or self.default_space
+        n = int(m.get("rows", 0))
+        self._docs_bytes = int(m.get("docs_bytes", 0))
+        self._log_bytes = int(m.get("log_bytes", 0))
+        self._ids: List[Optional[str]] = [None] * n
+        self._metas: List[Optional[Dict[str, Any]]] = [None] * n
+        self._doc_off: List[int] = [0] * n
+        self._doc_len: List[int] = [0] * n
+        alive = np.zeros(n, dtype=bool)
+        self._row: Dict[str, int] = {}
+        if self._log_bytes:
+            with open(self._path("rows.jsonl"), "rb") as f:
+                data = f.read(self._log_bytes)
+            for line in data.splitlines():
+                rec = json.loads(line)
+                op, _id = rec["op"], rec["id"]
+                if op == "add":
+                    i = rec["row"]
+                    self._ids[i], self._metas[i] = _id, rec.get("m")
+                    self._doc_off[i], self._doc_len[i] = rec["o"], rec["l"]
+                    alive[i] = True
+                    self._row[_id] = i
+                elif op == "upd":
+                    i = self._row.get(_id)
+                    if i is not None:
+                        self._metas[i] = rec.get("m")
+                elif op == "del":
+                    i = self._row.pop(_id, None)
+                    if i is not None:
+                        alive[i] = False
+        self.n = n
+        self._alive = alive
+        self._scales = np.fromfile(self._path("scales.bin"), dtype=np.float32, count=n) if n and self.dtype == "int8" else None
+        self._norms = np.fromfile(self._path("norms.bin"), dtype=np.float32, count=n) if n else np.zeros(0, np.float32)
+        self._open_maps()
+        self._cols = _Columns(self._metas, n)
+        self._ivf = self._load_ivf()
+
+    def _open_maps(self) -> None:
+        n, dim = self.n, self.dim
+        self._vecs = (
+            np.memmap(self._path("vectors.bin"), dtype=DTYPES[self.dtype], mode="r", shape=(n, dim))
+            if n and dim else None
+        )
+        self._docs = np.memmap(self._path("docs.bin"), dtype=np.uint8, mode="r") if self._docs_bytes else None
+
+    def _load_ivf(self) -> Optional[Dict[str, np.ndarray]]:
+        path = self._path("ivf.npz")
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as z:
+                ivf = {k: z[k] for k in ("centroids", "order", "offsets", "rows")}
+            built = int(ivf["rows"])
+            if built > self.n or ivf["centroids"].shape[1] != self.dim:
+                return None
+            tail = self._path("ivf_tail.bin")
+            count = self.n - built
+            ivf["tail"] = (
+                np.fromfile(tail, dtype=np.int32, count=count).astype(np.int64)
+                if count and tail.exists() else np.zeros(0, np.int64)
+            )
+            return ivf
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _refresh(self) -> None:
+        # 다른 프로세스(ingest)가 커밋했으면 다시 로드
+        if self._manifest_stamp() != self._seen_manifest:
+            self._load()
+
+    def _commit(self) -> None:
+        m = {
+            "dim": self.dim, "dtype": self.dtype, "space": self.space, "rows": self.n,
+            "docs_bytes": self._docs_bytes, "log_bytes": self._log_bytes,
+        }
+        self.root.mkdir(parents=True, exist_ok=True)
+        _atomic_write(self._path("manifest.json"), json.dumps(m).encode("utf-8"))
+        self._seen_manifest = self._manifest_stamp()
+        self._cols = _Columns(self._metas, self.n)
+
+    def _doc_reader(self) -> Callable[[int], str]:
+        """현재 상태에 묶인 본문 읽기 함수(이후 다시 로드/압축돼도 같은 스냅숏을 읽음)."""
+        docs, off, ln = self._docs, self._doc_off, self._doc_len
+
+        def read(i: int) -> str:
+            if docs is None or not ln[i]:
+                return ""
+            return bytes(docs[off[i]:off[i] + ln[i]]).decode("utf-8")
+        return read
+
+    def _doc(self, i: int) -> str:
+        return self._doc_reader()(i)
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        _write_at(self._path("rows.jsonl"), self._log_bytes, data)
+        self._log_bytes += len(data)
+
+    def set_space(self, space: str) -> None:
+        """빈 컬렉션의 거리 공간 지정(마이그레이션 시 원본 컬렉션과 맞춤)."""
+        if space not in SPACES:
+            raise ValueError(f"지원하지 않는 space: {space} (가능: {', '.join(SPACES)})")
+        with self._lock:
+            self._refresh()
+            if self.n and space != self.space:
+                raise ValueError(f"비어 있지 않은 컬렉션의 space는 바꿀 수 없습니다: {self.space} → {space}")
+            self.space = space
+
+    # --- Chroma 호환 API ---
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._row)
+
+    def add(
+        self,
+        ids: Sequence[str],
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+        documents: Optional[Sequence[str]] = None,
+        **_: Any,
+    ) -> None:
+        ids = [str(i) for i in ids]
+        docs = list(documents) if documents is not None else [""] * len(ids)
+        metas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            self._refresh()
+            # Chroma처럼 이미 있는 ID는 무시
+            keep, seen = [], set()
+            for j, _id in enumerate(ids):
+                if _id not in self._row and _id not in seen:
+                    keep.append(j)
+                    seen.add(_id)
+            if not keep:
+                return
+            if embeddings is not None:
+                vecs = np.asarray([embeddings[j] for j in keep], dtype=np.float32)
+            elif self.embedding_function is not None:
+                vecs = np.asarray(self.embedding_function([docs[j] for j in keep]), dtype=np.float32)
+            else:
+                raise ValueError("embeddings 또는 embedding_function이 필요합니다.")
+            self._append([ids[j] for j in keep], vecs, [docs[j] for j in keep], [metas[j] for j in keep])
+            self._commit()
+            self._maybe_maintain()
+
+    def _append(self, ids: List[str], vecs: np.ndarray, docs: List[str], metas: List[Optional[Dict[str, Any]]]) -> None:
+        if vecs.ndim != 2 or len(vecs) != len(ids):
+            raise ValueError("임베딩 개수/형태가 ids와 맞지 않습니다.")
+        if self.dim is None:
+            self.dim = int(vecs.shape[1])
+        elif vecs.shape[1] != self.dim:
+            raise ValueError(f"임베딩 차원 불일치: {vecs.shape[1]} != {self.dim}")
+        self.root.mkdir(parents=True, exist_ok=True)
+        start = self.n
+        if self.space == "cosine":
+            vecs = _normalize(vecs)
+        q, scales = quantize(vecs, self.dtype)
+        stored = _dequant(q, scales, slice(None))
+        norms = (stored ** 2).sum(axis=1).astype(np.float32)
+        _write_at(self._path("vectors.bin"), start * self.dim * q.itemsize, q.tobytes())
+        _write_at(self._path("norms.bin"), start * 4, norms.tobytes())
+        if scales is not None:
+            _write_at(self._path("scales.bin"), start * 4, scales.tobytes())
+        ivf = self._ivf
+        if ivf is not None and start == int(ivf["rows"]) + len(ivf["tail"]):
+            # IVF 구축 이후 행: 가장 가까운 리스트에 배정(새 dict → 검색 중인 스냅숏은 그대로)
+            assign = _nearest(stored, ivf["centroids"])
+            _write_at(self._path("ivf_tail.bin"), len(ivf["tail"]) * 4, assign.astype(np.int32).tobytes())
+            self._ivf = {**ivf, "tail": np.concatenate([ivf["tail"], assign])}
+
+        blobs = [(d or "").encode("utf-8") for d in docs]
+        records = []
+        off = self._docs_bytes
+        for k, (_id, blob, meta) in enumerate(zip(ids, blobs, metas)):
+            records.append({"op": "add", "id": _id, "row": start + k, "o": off, "l": len(blob), "m": meta})
+            self._doc_off.append(off)
+            self._doc_len.append(len(blob))
+            off += len(blob)
+        _write_at(self._path("docs.bin"), self._docs_bytes, b"".join(blobs))
+        self._docs_bytes = off
+        self._append_log(records)
+
+        for k, (_id, meta) in enumerate(zip(ids, metas)):
+            self._ids.append(_id)
+            self._metas.append(meta)
+            self._row[_id] = start + k
+        self.n = start + len(ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._norms = np.concatenate([self._norms, norms])
+        if scales is not None:
+            self._scales = scales if self._scales is None else np.concatenate([self._scales, scales])
+        self._open_maps()
+
+    def update(
+        self,
+        ids: Sequence[str],
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+        documents: Optional[Sequence[str]] = None,
+        **_: Any,
+    ) -> None:
+        ids = [str(i) for i in ids]
+        with self._lock:
+            self._refresh()
+            if documents is None and embeddings is None:
+                # 메타만 갱신(증분 적재의 일반 경우): 로그 한 줄씩
+                records = []
+                for j, _id in enumerate(ids):
+                    i = self._row.get(_id)
+                    if i is None or metadatas is None:
+                        continue
+                    self._metas[i] = metadatas[j]
+                    records.append({"op": "upd", "id": _id, "m": metadatas[j]})
+                if records:
+                    self._append_log(records)
+                    self._commit()
+                return
+            # 본문/벡터가 바뀌면 삭제 후 같은 ID로 다시 추가
+            present = [j for j, _id in enumerate(ids) if _id in self._row]
+            if not present:
+                return
+            new_docs = [documents[j] if documents is not None else self._doc(self._row[ids[j]]) for j in present]
+            new_metas = [metadatas[j] if metadatas is not None else self._metas[self._row[ids[j]]] for j in present]
+            if embeddings is not None:
+                vecs = np.asarray([embeddings[j] for j in present], dtype=np.float32)
+            elif self.embedding_function is not None:
+                vecs = np.asarray(self.embedding_function(new_docs), dtype=np.float32)
+            else:
+                raise ValueError("embeddings 또는 embedding_function이 필요합니다.")
+            self._delete_rows([ids[j] for j in present])
+            self._append([ids[j] for j in present], vecs, new_docs, new_metas)
+            self._commit()
+            self._maybe_maintain()
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None, **_: Any) -> None:
+        with self._lock:
+            self._refresh()
+            if ids is None and where is None:
+                return
+            targets = [str(i) for i in ids] if ids is not None else [self._ids[i] for i in np.flatnonzero(self._alive)]
+            if where is not None:
+                mask = where_mask(where, self._cols)
+                targets = [t for t in targets if t in self._row and mask[self._row[t]]]
+            if self._delete_rows(targets):
+                self._commit()
+                self._maybe_maintain()
+
+    def _delete_rows(self, ids: List[str]) -> int:
+        records = []
+        alive = self._alive.copy()
+        for _id in ids:
+            i = self._row.pop(_id, None)
+            if i is not None:
+                alive[i] = False
+                records.append({"op": "del", "id": _id})
+        if records:
+            self._alive = alive
+            self._append_log(records)
+        return len(records)
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: Optional[Sequence[str]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        include = ("documents", "metadatas") if include is None else include
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                rows = [self._row[str(i)] for i in ids if str(i) in self._row]
+            else:
+                rows = np.flatnonzero(self._alive).tolist()
+            if where:
+                mask = where_mask(where, self._cols)
+                rows = [r for r in rows if mask[r]]
+            if where_document:
+                rows = [r for r in rows if doc_match(where_document, self._doc(r))]
+            start = int(offset or 0)
+            rows = rows[start:start + int(limit)] if limit is not None else rows[start:]
+            return {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._doc(r) for r in rows] if "documents" in include else None,
+                "metadatas": [self._metas[r] for r in rows] if "metadatas" in include else None,
+                "embeddings": (
+                    _dequant(self._vecs, self._scales, np.asarray(rows, dtype=np.int64))
+                    if "embeddings" in include and self._vecs is not None and rows else
+                    ([] if "embeddings" in include else None)
+                ),
+            }
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        return self.get(limit=limit, include=["documents", "metadatas", "embeddings"])
+
+    def query(
+        self,
+        query_embeddings: Optional[Sequence[Sequence[float]]] = None,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: Optional[Sequence[str]] = None,
+        query_texts: Optional[Sequence[str]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        include = ("documents", "metadatas", "distances") if include is None else include
+        if query_embeddings is None:
+            if query_texts is None or self.embedding_function is None:
+                raise ValueError("query_embeddings 또는 query_texts(+embedding_function)가 필요합니다.")
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if self.space == "cosine":
+            queries = _normalize(queries)
+        with self._lock:
+            self._refresh()
+            # 읽기 스냅숏: 이후 검색은 락 없이(행렬곱은 GIL 해제 → 동시 질의 병렬)
+            vecs, scales, norms, n, ivf = self._vecs, self._scales, self._norms, self.n, self._ivf
+            mask = self._alive
+            if where:
+                mask = mask & where_mask(where, self._cols)
+            if where_document:
+                keep = [r for r in np.flatnonzero(mask) if doc_match(where_document, self._doc(r))]
+                mask = np.zeros(n, dtype=bool)
+                mask[keep] = True
+            metas, ids, read_doc = self._metas, self._ids, self._doc_reader()
+
+        nq = len(queries)
+        k = max(int(n_results), 1)
+        n_valid = int(mask.sum())
+        if vecs is None or n_valid == 0:
+            rows = [np.empty(0, np.int64)] * nq
+            dists = [np.empty(0, np.float32)] * nq
+        elif ivf is not None and n_valid >= self.ivf_min_rows:
+            rows, dists = [], []
+            for q in queries:
+                r, d = self._ivf_search(vecs, scales, norms, q, k, mask, ivf, n)
+                rows.append(r)
+                dists.append(d)
+        else:
+            sub = None if n_valid == n else np.flatnonzero(mask)
+            r, d = exact_search(vecs, scales, norms, queries, min(k, n_valid), rows=sub, n=n, space=self.space)
+            rows, dists = list(r), list(d)
+
+        return {
+            "ids": [[ids[int(i)] for i in r] for r in rows],
+            "documents": [[read_doc(int(i)) for i in r] for r in rows] if "documents" in include else None,
+            "metadatas": [[metas[int(i)] for i in r] for r in rows] if "metadatas" in include else None,
+            "distances": [[float(x) for x in d] for d in dists] if "distances" in include else None,
+        }
+
+    def _ivf_search(
+        self,
+        vecs: np.ndarray,
+        scales: Optional[np.ndarray],
+        norms: np.ndarray,
+        q: np.ndarray,
+        k: int,
+        mask: np.ndarray,
+        ivf: Dict[str, np.ndarray],
+        n: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, order, offsets, tail = ivf["centroids"], ivf["order"], ivf["offsets"], ivf["tail"]
+        # 리스트 배정(k-means/_nearest)과 같은 기준(제곱 L2)으로 프로브
+        cd = (centroids * centroids).sum(axis=1) - 2.0 * (centroids @ q)
+        nprobe = min(self.nprobe, len(centroids))
+        probe = np.argpartition(cd, nprobe - 1)[:nprobe]
+        built = int(ivf["rows"])
+        parts = [order[offsets[c]:offsets[c + 1]] for c in probe]
+        # 구축 이후 행: 프로브된 리스트에 배정된 것 + (배정 기록이 없으면) 나머지 전부
+        parts.append(built + np.flatnonzero(np.isin(tail, probe)))
+        parts.append(np.arange(built + len(tail), n))
+        cand = np.sort(np.concatenate(parts))
+        cand = cand[mask[cand]]
+        if len(cand) < k:
+            # 필터가 좁거나 리스트가 작아 후보가 모자라면 전수 검색
+            cand = np.flatnonzero(mask)
+        r, d = exact_search(vecs, scales, norms, q[None, :], min(k, len(cand)), rows=cand, space=self.space)
+        return r[0], d[0]
+
+    # --- 유지 보수 ---
+    def _maybe_maintain(self) -> None:
+        if not self.auto_maintain:
+            return
+        alive = len(self._row)
+        try:
+            if self.n > 1000 and (self.n - alive) > COMPACT_DEAD_RATIO * self.n:
+                self.compact()
+            if alive >= self.ivf_min_rows:
+                built = int(self._ivf["rows"]) if self._ivf is not None else 0
+                if self._ivf is None or self.n - built > IVF_REBUILD_RATIO * built:
+                    self.build_index()
+        except Exception:
+            traceback.print_exc()
+
+    def build_index(self, nlist: Optional[int] = None, iters: int = 8, sample: int = 20000, seed: int = 0) -> int:
+        """IVF 구축(살아 있는 행 기준). 리스트 수 기본값 4*sqrt(N). 반환: 리스트 수."""
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            if self._vecs is None or len(rows) == 0:
+                return 0
+            nlist = int(nlist or max(int(4 * math.sqrt(len(rows))), 1))
+            nlist = min(nlist, len(rows))
+            rng = np.random.default_rng(seed)
+            pick = np.sort(rng.choice(rows, min(len(rows), max(sample, nlist)), replace=False))
+            centroids = kmeans(_dequant(self._vecs, self._scales, pick), nlist, iters=iters, seed=seed)
+            assign = np.empty(len(rows), dtype=np.int64)
+            for s in range(0, len(rows), BLOCK_ROWS):
+                part = rows[s:s + BLOCK_ROWS]
+                assign[s:s + len(part)] = _nearest(_dequant(self._vecs, self._scales, part), centroids)
+            srt = np.argsort(assign, kind="stable")
+            ivf = {
+                "centroids": centroids,
+                "order": rows[srt].astype(np.int64),
+                "offsets": np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64),
+                "rows": np.asarray(self.n, dtype=np.int64),
+            }
+            tmp = self._path("ivf.tmp.npz")
+            np.savez(tmp, **ivf)
+            tmp.replace(self._path("ivf.npz"))
+            self._path("ivf_tail.bin").unlink(missing_ok=True)
+            self._ivf = {**ivf, "tail": np.zeros(0, np.int64)}
+            return nlist
+
+    def compact(self) -> None:
+        """삭제된 행을 빼고 모든 파일을 새로 씀(IVF는 다시 구축해야 함)."""
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            ids = [self._ids[i] for i in rows]
+            docs = [self._doc(int(i)) for i in rows]
+            metas = [self._metas[i] for i in rows]
+            vecs = _dequant(self._vecs, self._scales, rows) if self._vecs is not None and len(rows) else None
+            tmp_root = self.root.with_name(self.root.name + ".compact")
+            shutil.rmtree(tmp_root, ignore_errors=True)
+            fresh = LocalCollection(tmp_root, self.name, None, self.dtype, self.ivf_min_rows, self.nprobe, self.space)
+            if vecs is not None:
+                fresh._append(ids, vecs, docs, metas)
+            fresh._commit()
+            self._vecs = self._docs = None
+            old = self.root.with_name(self.root.name + ".old")
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(self.root, old)
+            os.replace(tmp_root, self.root)
+            shutil.rmtree(old, ignore_errors=True)
+            self._load()
+
+
+class LocalStore(VectorStore):
+    """<path>/local/<컬렉션>/ 아래에 컬렉션을 두는 내장 벡터스토어."""
+
+    provider = "local"
+
+    def __init__(
+        self,
+        path: str | Path,
+        dtype: str = "float16",
+        ivf_min_rows: int = 20000,
+        nprobe: int = 8,
+        space: str = "cosine",
+    ) -> None:
+        self.root = Path(path) / "local"
+        self.dtype = dtype
+        self.space = space
+        self.ivf_min_rows = int(ivf_min_rows)
+        self.nprobe = int(nprobe)
+        self._collections: Dict[str, LocalCollection] = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, name: str, embedding_fn: Optional[Callable[[List[str]], Any]] = None) -> LocalCollection:
+        with self._lock:
+            col = self._collections.get(name)
+            if col is None:
+                col = LocalCollection(
+                    self.root / name, name, embedding_fn, self.dtype, self.ivf_min_rows, self.nprobe, self.space,
+                )
+                self._collections[name] = col
+            elif embedding_fn is not None and col.embedding_function is None:
+                col.embedding_function = embedding_fn
+            return col
+
+    def list_collections(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / "manifest.json").exists())
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+            shutil.rmtree(self.root / name, ignore_errors=True)
+
+
+__all__ = [
+    "DTYPES",
+    "SPACES",
+    "quantize",
+    "where_mask",
+    "doc_match",
+    "exact_search",
+    "kmeans",
+    "LocalCollection",
+    "LocalStore",
+]
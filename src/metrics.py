@@ -0,0 +1,235 @@
+# [RAG][metrics]
+# 역할: 외부 의존성 없는 경량 카운터/게이지/히스토그램 + Prometheus 텍스트 포맷 출력(/metrics).
+# - span(stage, sink): 구간 시간을 rag_stage_seconds{stage=...} 히스토그램에 기록하고, sink(dict)가 있으면 "<stage>_ms"로 누적.
+# TODO:
+# - (선택) prometheus_client로 교체(멀티프로세스 uvicorn 워커 집계가 필요할 때).
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 초 단위 기본 버킷: 1ms ~ 2분(LLM 생성까지)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """현재 값(대기열 길이, 실행 중 수 등). set/inc/dec."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 라벨 → [버킷별 개수..., +Inf 개수], 합계
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[i] += 1
+            self._sums[key] += value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(c), self._sums[k]) for k, c in self._counts.items())
+        out = []
+        for key, counts, total in items:
+            acc = 0
+            for le, n in zip(self.buckets + (math.inf,), counts):
+                acc += n
+                le_label = 'le="%s"' % _num(le)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "RAG 파이프라인 단계별 소요 시간", ["stage"])
+REQUESTS = REGISTRY.counter("rag_http_requests_total", "HTTP 요청 수", ["path", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("rag_http_request_seconds", "HTTP 요청 처리 시간(스트리밍은 헤더 전송까지)", ["path"])
+RETRIEVAL_EVENTS = REGISTRY.counter("rag_retrieval_events_total", "재랭킹 수행/폴백 등 검색 이벤트", ["event"])
+LLM_CALLS = REGISTRY.counter("rag_llm_calls_total", "LLM 호출 시도(폴백 체인 단계별)", ["endpoint", "model", "outcome"])
+LLM_CALL_SECONDS = REGISTRY.histogram("rag_llm_call_seconds", "LLM 호출 1회 소요 시간", ["endpoint", "model"])
+LLM_PROMPT_EVAL_SECONDS = REGISTRY.histogram("rag_llm_prompt_eval_seconds", "Ollama prompt_eval_duration", ["model"])
+LLM_EVAL_SECONDS = REGISTRY.histogram("rag_llm_eval_seconds", "Ollama eval_duration", ["model"])
+LLM_LOAD_SECONDS = REGISTRY.histogram("rag_llm_load_seconds", "Ollama load_duration", ["model"])
+LLM_PROMPT_TOKENS = REGISTRY.counter("rag_llm_prompt_eval_tokens_total", "Ollama prompt_eval_count 합", ["model"])
+LLM_EVAL_TOKENS = REGISTRY.counter("rag_llm_eval_tokens_total", "Ollama eval_count 합", ["model"])
+# 생성 요청 입장 제어(src.scheduler): 용량 계획용 대기열 길이/대기 시간/거절·합류 수
+ADMISSION_QUEUE = REGISTRY.gauge("rag_admission_queue_depth", "모델·우선순위별 생성 대기열 길이", ["model", "priority"])
+ADMISSION_ACTIVE = REGISTRY.gauge("rag_admission_active", "모델별 실행 중인 생성 수", ["model"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram("rag_admission_wait_seconds", "생성 슬롯을 받기까지 대기 시간", ["model", "priority"])
+ADMISSION_EVENTS = REGISTRY.counter(
+    "rag_admission_events_total", "입장 결과(admitted/queued/rejected/collapsed/cancelled)", ["model", "priority", "event"]
+)
+
+@contextmanager
+def span(stage: str, sink: Optional[Dict[str, float]] = None) -> Iterator[None]:
+    """with span("embed", stats): ... → rag_stage_seconds{stage="embed"} 기록, stats["embed_ms"] 누적."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, stage=stage)
+        if sink is not None:
+            key = f"{stage}_ms"
+            sink[key] = sink.get(key, 0.0) + dt * 1000.0
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "REGISTRY",
+    "STAGE_SECONDS",
+    "REQUESTS",
+    "REQUEST_SECONDS",
+    "RETRIEVAL_EVENTS",
+    "LLM_CALLS",
+    "LLM_CALL_SECONDS",
+    "LLM_PROMPT_EVAL_SECONDS",
+    "LLM_EVAL_SECONDS",
+    "LLM_LOAD_SECONDS",
+    "LLM_PROMPT_TOKENS",
+    "LLM_EVAL_TOKENS",
+    "ADMISSION_QUEUE",
+    "ADMISSION_ACTIVE",
+    "ADMISSION_WAIT_SECONDS",
+    "ADMISSION_EVENTS",
+    "span",
+]
@@ -1,22 +1,43 @@
 # [RAG][retriever]
-# 역할: 벡터스토어(Chroma)에서 질의문과 유사한 청크 검색.
+# 역할: 벡터스토어(Chroma 또는 내장 local 인덱스, vectorstore.provider)에서 질의문과 유사한 청크 검색.
 # 주의: 컬렉션명은 config.yaml의 retriever.collection_name를 우선 사용하도록 유지.
+# - 임베딩 모델은 src.embedder 레지스트리에서 공유(컬렉션이 늘어도 모델은 1회 로드).
+# - use_collection(name) / query(..., collection=name)으로 하나의 Retriever가 여러 컬렉션 서빙.
+# - hybrid: BM25 역색인(src.lexical) 결과와 벡터 결과를 RRF로 융합(사건번호/조문 정확 매칭 보완).
+# - 질문 임베딩은 EmbeddingCache(LRU+TTL)를 거쳐 query_embeddings로 전달(반복 질문 재임베딩 방지).
+# - use_reranker: 후보 N개(rerank_candidates) 과다 조회 → CrossEncoder 배치 재랭킹(시간 예산 초과 시 벡터 순서).
+# - 지연 초기화: 생성자는 설정만 읽음. 벡터스토어/임베딩 모델/컬렉션/재랭커는 처음 쓸 때 로드(스레드 안전),
+#   warmup()으로 미리 로드 가능(서버 백그라운드 예열). components()로 로드 상태 확인.
+# - query_federated: 질문 임베딩 1회 → 여러 컬렉션 검색 → 공통 척도(코사인 유사도/재랭커 확률)로 정규화 →
+#   컬렉션별 최소 할당(quotas) 보장 후 점수순 병합(merge_federated). 서버는 컬렉션 검색을 스레드풀에서 동시 실행.
+# - 결과 1건 = RetrievedChunk(__slots__ dataclass, 청크마다 dict를 만들지 않음). 기존 dict 접근(hit["id"], hit.get(...),
+#   dict(hit))도 그대로 동작. 응답 직렬화용 to_source(full | snippet | ids).
+# - filters(doc_type/court/decision_type/날짜 범위/case_no/source/text_contains)는 Chroma where/where_document로
+#   변환해 ANN 단계에서 적용(파이썬 후처리 아님). BM25 후보도 같은 where로 다시 걸러짐.
 # TODO:
-# - use_collection(name: str): 런타임 컬렉션 전환 지원.
-# - where 필터 지원(doc_type='case' 등 메타 기반).
 # - 중복 제거: 동일 source/chunk_idx 및 유사 텍스트 1개만 유지.
-# - (선택) bge-reranker-large 재랭커 장착 및 top_k 조정.
 from __future__ import annotations
 
+import math
 import os
-from dataclasses import dataclass
+import re
+import threading
+import time
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import yaml
-import chromadb
-from chromadb.utils import embedding_functions
-from sentence_transformers import CrossEncoder
+
+from .cache import EmbeddingCache, bump_generation
+from .chunker import build_chunker, split_text  # split_text: 기존 import 경로 호환
+from .embedder import get_embedding_function
+from .lexical import LexicalIndex, build_from_collection, index_path, load_or_create, reciprocal_rank_fusion
+from .metrics import RETRIEVAL_EVENTS, STAGE_SECONDS, span
+from .vectorstore import collection_space, get_client, open_store  # get_client: 기존 import 경로 호환
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
 
 
 def load_config(config_path: str | Path = "config.yaml") -> dict:
@@ -24,29 +45,208 @@ def load_config(config_path: str | Path = "config.yaml") -> dict:
         return yaml.safe_load(f) or {}
 
 
-def split_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
-    if not text:
-        return []
-    chunks: List[str] = []
-    start = 0
-    end = max(chunk_size, 1)
-    length = len(text)
-    while start < length:
-        chunk = text[start:end]
-        chunks.append(chunk)
-        if end >= length:
-            break
-        start = max(end - chunk_overlap, 0)
-        end = min(start + chunk_size, length)
-    return chunks
-
-
-@dataclass
+_DATE_RE = re.compile(r"(\d{4})(?:\D{1,3}(\d{1,2})(?:\D{1,3}(\d{1,2}))?)?")
+
+
+def date_num(value: Any, end: bool = False) -> Optional[int]:
+    """'2025-03-13' / '2025. 3. 13.' / '20250313' / '2025' → 20250313 (범위 비교용 정수).
+
+    월/일이 없으면 end=False면 처음(0101), end=True면 끝(1231)으로 채웁니다.
+    """
+    if value is None:
+        return None
+    s = str(value).strip()
+    if re.fullmatch(r"\d{8}", s):
+        return int(s)
+    m = _DATE_RE.search(s)
+    if not m:
+        return None
+    y = int(m.group(1))
+    mo = int(m.group(2)) if m.group(2) else (12 if end else 1)
+    d = int(m.group(3)) if m.group(3) else (31 if end else 1)
+    if not (1 <= mo <= 12 and 1 <= d <= 31):
+        return None
+    return y * 10000 + mo * 100 + d
+
+
+def _match(field: str, value: Any) -> Optional[Dict[str, Any]]:
+    """값 하나는 등호, 여러 개는 $in. 빈 값만 있으면 None(조건 없음 — {"$in": []}은 아무것도 안 맞음)."""
+    if isinstance(value, (list, tuple, set)):
+        vals = [v for v in value if v not in (None, "")]
+        if not vals:
+            return None
+        return {field: vals[0]} if len(vals) == 1 else {field: {"$in": vals}}
+    return {field: value}
+
+
+def build_where(filters: Any) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """필터(dict 또는 QueryFilters) → (Chroma where, where_document). 조건이 없으면 None."""
+    if filters is None:
+        return None, None
+    if hasattr(filters, "model_dump"):
+        filters = filters.model_dump(exclude_none=True)
+    f = {k: v for k, v in dict(filters).items() if v not in (None, "", [])}
+    conds: List[Dict[str, Any]] = []
+    for field in ("doc_type", "court", "decision_type", "source"):
+        cond = _match(field, f[field]) if field in f else None
+        if cond is not None:
+            conds.append(cond)
+    if "case_no" in f and _match("case_no", f["case_no"]) is not None:
+        # 예전에 적재된 청크는 case_no 메타 없이 case_id에만 사건번호가 있음
+        conds.append({"$or": [_match("case_no", f["case_no"]), _match("case_id", f["case_no"])]})
+    lo, hi = date_num(f.get("date_from")), date_num(f.get("date_to"), end=True)
+    if lo is not None:
+        conds.append({"date_num": {"$gte": lo}})
+    if hi is not None:
+        conds.append({"date_num": {"$lte": hi}})
+    where = None if not conds else conds[0] if len(conds) == 1 else {"$and": conds}
+    where_document = {"$contains": f["text_contains"]} if f.get("text_contains") else None
+    return where, where_document
+
+
+def _row(results: Dict[str, Any], i: int) -> Tuple[List[str], List[Optional[str]], List[Any], List[Any]]:
+    """collection.query 결과에서 i번째 질문의 (ids, documents, metadatas, distances)."""
+    def pick(key: str) -> List[Any]:
+        rows = results.get(key) or []
+        return list(rows[i]) if i < len(rows) and rows[i] is not None else []
+    docs = pick("documents")
+    ids = pick("ids")
+    ids += [f"auto-{j}" for j in range(len(ids), len(docs))]  # 없어도 안전하게 처리
+    return ids, docs, pick("metadatas"), pick("distances")
+
+
+# RetrievedChunk에서 dict처럼 읽을 수 있는 키(source_id는 메타로 계산)
+_HIT_KEYS = (
+    "id", "text", "score", "metadata", "source_id",
+    "similarity", "vector_score", "bm25_score", "collection", "collection_score",
+)
+# 항상 노출하는 키(나머지는 값이 있을 때만 keys()/dict(hit)에 포함 — 기존 dict 결과와 같은 모양)
+_HIT_BASE_KEYS = frozenset(("id", "text", "score", "metadata", "source_id"))
+
+
+@dataclass(slots=True)
 class RetrievedChunk:
+    """검색 결과 1건. 본문(text)/메타(metadata)는 벡터스토어가 돌려준 객체를 복사하지 않고 참조.
+
+    score: 정렬 점수(벡터 1/(1+거리) → hybrid면 RRF → 재랭크면 CrossEncoder 점수, 통합 검색이면 정규화 점수)
+    similarity: 거리 공간 기준 코사인 유사도(컬렉션 간 비교용), vector_score/bm25_score: hybrid/재랭크 이전 점수
+    """
+
     id: str
     text: str
     score: Optional[float]
     metadata: Dict[str, Any]
+    similarity: Optional[float] = None
+    vector_score: Optional[float] = None
+    bm25_score: Optional[float] = None
+    collection: Optional[str] = None
+    collection_score: Optional[float] = None
+
+    @property
+    def source_id(self) -> str:
+        meta = self.metadata
+        return f"{meta.get('source')}#chunk{meta.get('chunk_idx')}"
+
+    # --- 기존 dict 결과 호환(읽기 위주) ---
+    def __getitem__(self, key: str) -> Any:
+        if key not in _HIT_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in _HIT_KEYS or key == "source_id":
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in _HIT_KEYS else None
+        return default if value is None else value
+
+    def keys(self) -> List[str]:
+        return [k for k in _HIT_KEYS if k in _HIT_BASE_KEYS or getattr(self, k) is not None]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.keys()}
+
+    def to_source(self, fmt: str = "full", snippet_chars: int = 200) -> Dict[str, Any]:
+        """응답 sources 항목. full: 본문 전체, snippet: 앞 snippet_chars자, ids: ID/점수만(본문·메타 없음)."""
+        if fmt == "ids":
+            return {"id": self.id, "score": self.score, "collection": self.collection}
+        text = self.text
+        if fmt == "snippet" and len(text) > snippet_chars:
+            text = text[:snippet_chars].rstrip() + "…"
+        return {"id": self.id, "text": text, "score": self.score, "metadata": self.metadata, "collection": self.collection}
+
+
+def distance_to_similarity(dist: Any, space: str) -> Optional[float]:
+    """거리 → 코사인 유사도(0~1로 자름). 같은 임베딩 모델을 쓰는 컬렉션끼리는 이 값으로 비교 가능.
+
+    cosine: d = 1 - cos, ip: d = 1 - 내적, l2: 제곱 L2(정규화 벡터면 d = 2 - 2cos).
+    """
+    if dist is None:
+        return None
+    d = float(dist)
+    sim = 1.0 - d / 2.0 if space == "l2" else 1.0 - d
+    return min(max(sim, 0.0), 1.0)
+
+
+def _federated_scores(hits: List[RetrievedChunk], reranked: bool) -> List[float]:
+    """컬렉션 1개의 결과 순서를 유지하면서 컬렉션 간 비교 가능한 0~1 점수를 매김.
+
+    재랭크됐으면 CrossEncoder 점수(확률, 로짓이면 시그모이드), 아니면 벡터 코사인 유사도.
+    BM25로만 들어온 청크(유사도 없음)나 RRF로 순서가 바뀐 구간은 바로 위 청크 점수를 넘지 않도록 누적 최솟값.
+    """
+    out: List[float] = []
+    prev = 1.0
+    for h in hits:
+        raw = h.score if reranked else h.similarity
+        if raw is None:
+            val = prev
+        else:
+            val = float(raw)
+            if reranked and not 0.0 <= val <= 1.0:
+                val = 1.0 / (1.0 + math.exp(-val))
+            val = min(max(val, 0.0), 1.0)
+        prev = min(val, prev)
+        out.append(prev)
+    return out
+
+
+def merge_federated(
+    results: Dict[str, Tuple[List[RetrievedChunk], Dict[str, float]]],
+    top_k: int,
+    quotas: Optional[Dict[str, int]] = None,
+) -> List[RetrievedChunk]:
+    """컬렉션별 (결과, 통계) → 정규화 점수로 병합한 top_k.
+
+    quotas[컬렉션] = 최소 보장 개수(결과가 그만큼 있을 때). 남은 자리는 점수순으로 채우고 최종 결과도 점수순.
+    각 청크의 score는 정규화 점수로 바뀌고, 원래 점수는 collection_score, 출처는 collection에 남김.
+    """
+    pools: Dict[str, List[RetrievedChunk]] = {}
+    for name, (hits, stats) in results.items():
+        norm = _federated_scores(hits, bool(stats.get("reranked")))
+        pools[name] = [
+            replace(h, collection=name, collection_score=h.score, score=sc)
+            for h, sc in zip(hits, norm)
+        ]
+
+    chosen: List[RetrievedChunk] = []
+    taken: Dict[str, int] = {name: 0 for name in pools}
+    # 할당 합이 top_k를 넘으면 최상위 점수가 높은 컬렉션부터 보장
+    order = sorted(pools, key=lambda n: pools[n][0].score if pools[n] else 0.0, reverse=True)
+    for name in order:
+        want = min(int((quotas or {}).get(name, 0)), len(pools[name]), top_k - len(chosen))
+        if want > 0:
+            chosen.extend(pools[name][:want])
+            taken[name] = want
+    rest = [h for name in pools for h in pools[name][taken[name]:]]
+    rest.sort(key=lambda h: h.score, reverse=True)
+    chosen.extend(rest[: max(top_k - len(chosen), 0)])
+    chosen.sort(key=lambda h: h.score, reverse=True)
+    return chosen
 
 
 class Retriever:
@@ -64,91 +264,509 @@ class Retriever:
         self.top_k: int = int(retr_cfg.get("top_k", 5))
         self.chunk_size: int = int(self.config.get("retriever", {}).get("chunk_size", 800))
         self.chunk_overlap: int = int(self.config.get("retriever", {}).get("chunk_overlap", 120))
+        # 적재용 청커: legal(법령/판결 구조 단위, 기본) | fixed(기존 고정 길이 창)
+        self.chunker_name: str = str(retr_cfg.get("chunker", "legal"))
         self.use_reranker: bool = bool(retr_cfg.get("use_reranker", False))
         self.reranker_model: str | None = retr_cfg.get("reranker_model")
+        # 재랭킹 파라미터: 1단계 후보 수 N, 배치 크기, 최대 시퀀스 길이, 시간 예산(ms)
+        self.rerank_candidates: int = int(retr_cfg.get("rerank_candidates", 30))
+        self.rerank_batch_size: int = int(retr_cfg.get("rerank_batch_size", 16))
+        self.rerank_max_length: int = int(retr_cfg.get("rerank_max_length", 512))
+        self.rerank_budget_ms: float = float(retr_cfg.get("rerank_budget_ms", 1500))
+        # 하이브리드(BM25 + dense) 파라미터
+        self.hybrid: bool = bool(retr_cfg.get("hybrid", False))
+        self.lexical_candidates: int = int(retr_cfg.get("lexical_candidates", 30))
+        self.rrf_k: int = int(retr_cfg.get("rrf_k", 60))
 
         self.db_path = vs_cfg.get("path", "vectorstore")
         # 외부에서 받은 collection_name을 우선 사용, 없으면 config 파일 값 사용
         self.collection_name = collection_name or retr_cfg.get("collection_name", "documents")
-        model_name = os.getenv("EMBEDDING_MODEL", embed_cfg.get("model", "all-MiniLM-L6-v2"))
-        device = str(embed_cfg.get("device", "cpu"))
+        self.model_name = os.getenv("EMBEDDING_MODEL", embed_cfg.get("model", "all-MiniLM-L6-v2"))
+        self.device = str(embed_cfg.get("device", "cpu"))
 
-        self.client = chromadb.PersistentClient(path=self.db_path)
-        self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=model_name,
-            device=device,
-        )
+        # 벡터스토어/임베딩 모델/컬렉션은 처음 쓸 때 로드(store, embedding_fn, collection 속성)
+        self._vs_cfg = {**vs_cfg, "path": self.db_path}
+        self._store: Any = None
+        self._store_lock = threading.Lock()
+        self._embedding_fn: Any = None
 
-        # 이미 존재하면 가져오고, 없으면 생성
-        try:
-            # chromadb 최신 버전은 get_collection에도 embedding_function 전달 가능
-            self.collection = self.client.get_collection(
-                self.collection_name,
-                embedding_function=self.embedding_fn,  # type: ignore[call-arg]
-            )
-        except Exception:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                embedding_function=self.embedding_fn,
-            )
+        self._collections: Dict[str, Any] = {}
+        self._collections_lock = threading.Lock()
+        # 컬렉션 → 거리 공간(cosine | l2 | ip). 점수 → 코사인 유사도 변환용
+        self._spaces: Dict[str, str] = {}
 
         self._reranker: CrossEncoder | None = None
+        self._reranker_lock = threading.Lock()
+        self._lexical: Dict[str, LexicalIndex] = {}
+        self._lexical_lock = threading.Lock()
+
+        cache_cfg = self.config.get("cache", {}) or {}
+        self.embed_cache = EmbeddingCache(
+            max_entries=int(cache_cfg.get("embedding_max_entries", 2048)),
+            ttl_s=float(cache_cfg.get("embedding_ttl_s", 3600)),
+        )
+
+    @property
+    def store(self) -> Any:
+        """벡터스토어 백엔드(chroma | local). 컬렉션 API가 같아 이후 코드는 구분하지 않음."""
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = open_store(self._vs_cfg)
+        return self._store
+
+    @property
+    def client(self) -> Any:
+        """Chroma 백엔드의 PersistentClient(local 백엔드면 None)."""
+        return getattr(self.store, "client", None)
+
+    @property
+    def embedding_fn(self) -> Any:
+        """임베딩 함수. (model, device)가 같으면 다른 Retriever와 같은 모델 인스턴스를 공유."""
+        if self._embedding_fn is None:
+            # 레지스트리가 잠금으로 1회 로드를 보장하므로 여기서는 참조만 저장
+            self._embedding_fn = get_embedding_function(self.model_name, self.device)
+        return self._embedding_fn
+
+    @property
+    def collection(self) -> Any:
+        """기본 컬렉션(collection_name) 핸들."""
+        return self.get_collection(self.collection_name)
+
+    def warmup(self, collections: Optional[List[str]] = None) -> Dict[str, float]:
+        """임베딩 모델·컬렉션(+hybrid면 BM25, use_reranker면 재랭커)을 미리 로드. 반환: 단계별 ms."""
+        timings: Dict[str, float] = {}
+
+        def _timed(key: str, fn) -> None:
+            t0 = time.perf_counter()
+            fn()
+            timings[key] = (time.perf_counter() - t0) * 1000.0
+
+        # 첫 forward는 커널 초기화로 느리므로 더미 질문 1회 임베딩(캐시에는 넣지 않음)
+        _timed("embedder_ms", lambda: self.embedding_fn(["warmup"]))
+        names = list(dict.fromkeys(collections or [self.collection_name]))
+        for name in names:
+            _timed(f"collection_ms.{name}", lambda: self.get_collection(name))
+            if self.hybrid:
+                _timed(f"lexical_ms.{name}", lambda: self.get_lexical(name))
+        if self.use_reranker:
+            _timed("reranker_ms", self._get_reranker)
+        return timings
+
+    def components(self) -> Dict[str, Any]:
+        """로드 상태(모델/컬렉션을 새로 로드하지 않음)."""
+        return {
+            "store": self._store is not None,
+            "provider": getattr(self._store, "provider", None),
+            "embedder": self._embedding_fn is not None,
+            "embedding_model": self.model_name,
+            "collections": sorted(self._collections),
+            "lexical": sorted(self._lexical),
+            "reranker": self._reranker is not None if self.use_reranker else None,
+        }
+
+    def make_chunker(self):
+        """config의 chunk_size/overlap/chunker로 적재용 청커 생성."""
+        return build_chunker(self.chunker_name, self.chunk_size, self.chunk_overlap)
+
+    def get_collection(self, name: str) -> Any:
+        """컬렉션 핸들을 캐시에서 꺼내거나, 없으면 가져오기/생성 후 캐시합니다."""
+        with self._collections_lock:
+            col = self._collections.get(name)
+            if col is not None:
+                return col
+            # 이미 존재하면 가져오고, 없으면 생성
+            col = self.store.get_collection(name, self.embedding_fn)
+            self._collections[name] = col
+            self._spaces[name] = collection_space(col)
+            return col
+
+    def use_collection(self, name: str) -> "Retriever":
+        """기본 컬렉션을 전환합니다. 임베딩 모델은 그대로 공유됩니다."""
+        self.get_collection(name)
+        self.collection_name = name
+        return self
+
+    def get_lexical(self, name: Optional[str] = None) -> LexicalIndex:
+        """컬렉션별 BM25 인덱스를 지연 로드합니다. 파일이 없고 컬렉션이 비어있지 않으면 1회 구축."""
+        name = name or self.collection_name
+        index = self._lexical.get(name)
+        if index is not None:
+            return index
+        with self._lexical_lock:
+            index = self._lexical.get(name)
+            if index is None:
+                path = index_path(self.db_path, name)
+                index = load_or_create(self.db_path, name)
+                if not path.exists():
+                    col = self.get_collection(name)
+                    if col.count() > 0:
+                        build_from_collection(col, index=index)
+                        index.save(path)
+                self._lexical[name] = index
+        return index
+
+    def save_lexical(self, name: Optional[str] = None) -> None:
+        """메모리의 BM25 인덱스를 vectorstore/lexical/ 에 저장합니다(ingest 종료 시 호출)."""
+        name = name or self.collection_name
+        index = self._lexical.get(name)
+        if index is not None:
+            index.save(index_path(self.db_path, name))
 
     def add_documents(
         self,
         documents: List[str],
         metadatas: Optional[List[Dict[str, Any]]] = None,
         ids: Optional[List[str]] = None,
+        embeddings: Optional[List[List[float]]] = None,
     ) -> None:
-        self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        # embeddings가 주어지면(병렬 임베딩 풀 등) Chroma 임베딩 함수를 건너뜀
+        if embeddings is not None:
+            self.collection.add(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+        else:
+            self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        if ids:
+            # BM25 인덱스도 증분 갱신(영속화는 save_lexical)
+            self.get_lexical(self.collection_name).add(ids, documents)
+        # 서버의 답변 캐시가 이 컬렉션을 무효화하도록 세대 갱신
+        bump_generation(self.db_path, self.collection_name)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """기본 컬렉션에서 청크 삭제(BM25 인덱스 포함)."""
+        if not ids:
+            return
+        self.collection.delete(ids=ids)
+        self.get_lexical(self.collection_name).remove(ids)
+        bump_generation(self.db_path, self.collection_name)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """임베딩은 그대로 두고 메타데이터만 갱신."""
+        if ids:
+            self.collection.update(ids=ids, metadatas=metadatas)
+            bump_generation(self.db_path, self.collection_name)
+
+    def embed_query(self, question: str) -> List[float]:
+        """질문 임베딩(캐시 우선). 캐시 미스일 때만 모델 forward 수행."""
+        return self.embed_queries([question])[0]
+
+    def embed_queries(self, questions: List[str]) -> List[List[float]]:
+        """여러 질문 임베딩. 캐시 미스 질문만 모아 한 번의 배치 forward로 계산."""
+        vecs: List[Any] = [self.embed_cache.get_vector(self.model_name, q) for q in questions]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            # 같은 질문이 여러 번 와도 한 번만 계산
+            uniq = list(dict.fromkeys(questions[i] for i in missing))
+            computed = dict(zip(uniq, self.embedding_fn(uniq)))
+            for q, v in computed.items():
+                self.embed_cache.put_vector(self.model_name, q, v)
+            for i in missing:
+                vecs[i] = computed[questions[i]]
+        return [[float(x) for x in v] for v in vecs]
 
-    def query(self, question: str, top_k: int = 6):
-        results = self.collection.query(
-            query_texts=[question],
-            n_results=top_k,
-            include=["documents","metadatas","distances"],
+    def query(self, question: str, top_k: int = 6, collection: Optional[str] = None, filters: Any = None):
+        hits, _ = self.query_detailed(question, top_k=top_k, collection=collection, filters=filters)
+        return hits
+
+    def query_detailed(
+        self,
+        question: str,
+        top_k: int = 6,
+        collection: Optional[str] = None,
+        filters: Any = None,
+    ) -> Tuple[List[RetrievedChunk], Dict[str, float]]:
+        """2단계 검색: (1) 벡터(+BM25 RRF) 후보 N개 과다 조회 → (2) CrossEncoder 재랭킹.
+
+        filters(dict 또는 QueryFilters)는 build_where()로 변환되어 col.query의 where/where_document로 전달됩니다.
+        (결과, 단계별 시간/통계)를 반환합니다. 통계 키:
+        embed_ms, search_ms, dedup_ms, lexical_ms, rerank_ms, total_ms, candidates, reranked(1/0), rerank_fallback(1/0),
+        rerank_load_ms(재랭커를 처음 로드한 요청만)
+        단계 시간은 /metrics의 rag_stage_seconds{stage=...}에도 기록됩니다.
+        """
+        t0 = time.perf_counter()
+        stats: Dict[str, float] = {}
+        with span("embed", stats):
+            qvec = self.embed_query(question)
+        hits, searched = self.search_detailed(question, qvec, top_k=top_k, collection=collection, filters=filters)
+        stats.update(searched)
+        stats["total_ms"] = (time.perf_counter() - t0) * 1000.0
+        STAGE_SECONDS.observe(stats["total_ms"] / 1000.0, stage="retrieval")
+        return hits, stats
+
+    def search_detailed(
+        self,
+        question: str,
+        qvec: List[float],
+        top_k: int = 6,
+        collection: Optional[str] = None,
+        filters: Any = None,
+    ) -> Tuple[List[RetrievedChunk], Dict[str, float]]:
+        """이미 계산한 질문 임베딩으로 컬렉션 1개 검색(query_detailed에서 임베딩 단계를 뺀 것).
+
+        통계 키: search_ms, dedup_ms, lexical_ms, rerank_ms, candidates, reranked(1/0), rerank_fallback(1/0),
+        rerank_load_ms(재랭커를 처음 로드한 요청만)
+        """
+        stats: Dict[str, float] = {}
+        # collection 지정 시 기본 컬렉션을 바꾸지 않고 해당 컬렉션만 조회(요청 간 공유 안전)
+        col = self.get_collection(collection) if collection else self.collection
+        where, where_document = build_where(filters)
+        n_results = self._n_results(top_k)
+        with span("search", stats):
+            results = col.query(
+                query_embeddings=[qvec],
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=["documents","metadatas","distances"],
+            )
+
+        hits, post = self._postprocess(
+            question, _row(results, 0), col, collection or self.collection_name,
+            top_k, n_results, where, where_document,
         )
+        stats.update(post)
+        return hits, stats
+
+    def query_federated(
+        self,
+        question: str,
+        collections: List[str],
+        top_k: int = 8,
+        filters: Any = None,
+        quotas: Optional[Dict[str, int]] = None,
+        executor: Any = None,
+    ) -> Tuple[List[RetrievedChunk], Dict[str, float]]:
+        """여러 컬렉션 통합 검색: 임베딩 1회 → 컬렉션별 search_detailed(executor가 있으면 동시) → merge_federated.
+
+        통계 키: embed_ms, merge_ms, total_ms, 컬렉션별 "<컬렉션>.<search_detailed 통계 키>"
+        """
+        t0 = time.perf_counter()
+        stats: Dict[str, float] = {}
+        names = list(dict.fromkeys(collections))
+        with span("embed", stats):
+            qvec = self.embed_query(question)
 
-        docs  = results.get("documents", [[]])[0]
-        metas = results.get("metadatas", [[]])[0]
-        dists = results.get("distances", [[]])[0]
-        ids   = results.get("ids", [[]])[0]  # 없어도 안전하게 처리
+        def _one(name: str) -> Tuple[List[RetrievedChunk], Dict[str, float]]:
+            return self.search_detailed(question, qvec, top_k=top_k, collection=name, filters=filters)
 
-        from collections import defaultdict
-        hits, seen_ids, seen_sig = [], set(), set()
-        file_bucket = defaultdict(list)
+        mapped = executor.map(_one, names) if executor is not None else map(_one, names)
+        results = dict(zip(names, mapped))
+        with span("merge", stats):
+            hits = merge_federated(results, top_k, quotas)
+        for name, (_, st) in results.items():
+            stats.update({f"{name}.{k}": v for k, v in st.items()})
+        stats["total_ms"] = (time.perf_counter() - t0) * 1000.0
+        STAGE_SECONDS.observe(stats["total_ms"] / 1000.0, stage="retrieval")
+        return hits, stats
 
-        for i, (doc, meta, dist) in enumerate(zip(docs, metas, dists)):
-            _id = ids[i] if i < len(ids) else f"auto-{i}"
+    def query_many(
+        self,
+        questions: List[str],
+        top_k: int = 6,
+        collection: Optional[str] = None,
+        filters: Any = None,
+    ) -> List[List[RetrievedChunk]]:
+        hits, _ = self.query_many_detailed(questions, top_k=top_k, collection=collection, filters=filters)
+        return hits
+
+    def query_many_detailed(
+        self,
+        questions: List[str],
+        top_k: int = 6,
+        collection: Optional[str] = None,
+        filters: Any = None,
+    ) -> Tuple[List[List[RetrievedChunk]], Dict[str, float]]:
+        """여러 질문을 한 번에 검색: 배치 임베딩 1회 + collection.query 1회 → 질문별 BM25/재랭킹/파일 균형.
+
+        통계 키: questions, embed_ms, search_ms, post_ms(질문별 후처리 합), total_ms
+        """
+        t0 = time.perf_counter()
+        if not questions:
+            return [], {"questions": 0.0, "embed_ms": 0.0, "search_ms": 0.0, "post_ms": 0.0, "total_ms": 0.0}
+        stats: Dict[str, float] = {"questions": float(len(questions))}
+        col = self.get_collection(collection) if collection else self.collection
+        where, where_document = build_where(filters)
+        n_results = self._n_results(top_k)
+        with span("embed_batch", stats):
+            qvecs = self.embed_queries(questions)
+        with span("search_batch", stats):
+            results = col.query(
+                query_embeddings=qvecs,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=["documents","metadatas","distances"],
+            )
+
+        out: List[List[RetrievedChunk]] = []
+        with span("post", stats):
+            for i, q in enumerate(questions):
+                hits, _ = self._postprocess(
+                    q, _row(results, i), col, collection or self.collection_name,
+                    top_k, n_results, where, where_document,
+                )
+                out.append(hits)
+        stats["embed_ms"] = stats.pop("embed_batch_ms")
+        stats["search_ms"] = stats.pop("search_batch_ms")
+        stats["total_ms"] = (time.perf_counter() - t0) * 1000.0
+        return out, stats
+
+    def _n_results(self, top_k: int) -> int:
+        # 재랭커 사용 시 1단계에서 후보를 넉넉히 가져옴
+        return max(top_k, self.rerank_candidates) if self.use_reranker else top_k
+
+    def _postprocess(
+        self,
+        question: str,
+        row: Tuple[List[str], List[Optional[str]], List[Any], List[Any]],
+        col: Any,
+        collection_name: str,
+        top_k: int,
+        n_results: int,
+        where: Optional[Dict[str, Any]],
+        where_document: Optional[Dict[str, Any]],
+    ) -> Tuple[List[RetrievedChunk], Dict[str, float]]:
+        """질문 1개의 벡터 결과 → 중복 제거 → (BM25 RRF) → (재랭킹) → 파일당 2개 균형, top_k."""
+        stats: Dict[str, float] = {}
+        ids, docs, metas, dists = row
+        filtered = where is not None or where_document is not None
+        space = self._spaces.get(collection_name, "l2")
+
+        candidates: List[RetrievedChunk] = []
+        seen_ids, seen_sig = set(), set()
+
+        def _push(_id: str, doc: Optional[str], meta: Optional[Dict[str, Any]], dist: Any) -> None:
             if _id in seen_ids:
-                continue
-            sig = (meta.get("source"), meta.get("chunk_idx"), (doc or "").strip())
+                return
+            meta = meta or {}
+            doc = doc or ""
+            sig = (meta.get("source"), meta.get("chunk_idx"), doc.strip())
             if sig in seen_sig:
-                continue
+                return
             seen_ids.add(_id); seen_sig.add(sig)
-            sim = 1.0 / (1.0 + float(dist) if dist is not None else 1.0)
-            item = {
-              "id": _id,
-              "text": (doc or ""),
-              "score": sim,  # 0~1
-              "metadata": meta or {},
-              "source_id": f"{(meta or {}).get('source')}#chunk{(meta or {}).get('chunk_idx')}"
-            }
-            file_bucket[(meta or {}).get("source")].append(item)
-
-        balanced = []
-        for _, lst in file_bucket.items():
-            balanced.extend(lst[:2])  # 파일당 최대 2개
-        return balanced
+            candidates.append(RetrievedChunk(
+                _id, doc,
+                1.0 / (1.0 + float(dist)) if dist is not None else None,  # 0~1
+                meta,
+                distance_to_similarity(dist, space),  # 컬렉션 간 비교용(코사인)
+            ))
+
+        with span("dedup", stats):
+            for i, (doc, meta, dist) in enumerate(zip(docs, metas, dists)):
+                _id = ids[i] if i < len(ids) else f"auto-{i}"
+                _push(_id, doc, meta, dist)
+
+        with span("lexical", stats):
+            if self.hybrid:
+                # BM25 인덱스는 메타를 모르므로 필터가 있으면 넉넉히 뽑고 아래 col.get(where=...)에서 거름
+                lex_n = max(n_results, self.lexical_candidates) * (4 if filtered else 1)
+                lex_hits = self.get_lexical(collection_name).search(question, top_n=lex_n)
+                # 벡터 쪽에 없던 BM25 후보는 본문/메타를 컬렉션에서 가져옴
+                missing = [d for d, _ in lex_hits if d not in seen_ids]
+                if missing:
+                    got = col.get(ids=missing, where=where, where_document=where_document,
+                                  include=["documents", "metadatas"])
+                    for _id, doc, meta in zip(got.get("ids") or [], got.get("documents") or [], got.get("metadatas") or []):
+                        _push(_id, doc, meta, None)
+                bm25 = dict(lex_hits)
+                fused = reciprocal_rank_fusion(
+                    [[c.id for c in candidates if c.score is not None], [d for d, _ in lex_hits if d in seen_ids]],
+                    k=self.rrf_k,
+                )
+                top = fused[0][1] if fused else 1.0
+                rank = {d: sc / top for d, sc in fused}
+                for c in candidates:
+                    c.vector_score = c.score
+                    c.bm25_score = bm25.get(c.id)
+                    c.score = rank.get(c.id, 0.0)  # RRF 점수(최댓값=1로 정규화)
+                candidates.sort(key=lambda c: c.score, reverse=True)
+
+        reranked, fallback = False, False
+        load_failed = False
+        if self.use_reranker and len(candidates) > 1 and self._reranker is None:
+            # 재랭커 첫 로드(수 초)는 rerank 시간/예산과 분리해 rerank_load_ms로 기록
+            with span("rerank_load", stats):
+                try:
+                    self._get_reranker()
+                except Exception:
+                    import traceback; traceback.print_exc()
+                    load_failed = True
+        with span("rerank", stats):
+            if self.use_reranker and len(candidates) > 1:
+                scores = None if load_failed else self._rerank_scores(question, [c.text for c in candidates])
+                if scores is None:
+                    fallback = True  # 시간 예산 초과/로드 실패 → 1단계(벡터/RRF) 순서 유지
+                else:
+                    for c, sc in zip(candidates, scores):
+                        if not self.hybrid:
+                            c.vector_score = c.score
+                        c.score = sc
+                    candidates.sort(key=lambda c: c.score, reverse=True)
+                    reranked = True
+
+        # 파일당 최대 2개. 점수가 같으면 파일이 처음 나온 순서 → 후보 순서(파일별 버킷을 이어 붙여 정렬하던 것과 동일)
+        per_file: Dict[Any, int] = {}
+        first_seen: Dict[Any, int] = {}
+        keep: List[Tuple[float, int, int, RetrievedChunk]] = []
+        for pos, item in enumerate(candidates):
+            src = item.metadata.get("source")
+            n = per_file.get(src, 0)
+            if n >= 2:
+                continue
+            per_file[src] = n + 1
+            keep.append((-(item.score or 0.0), first_seen.setdefault(src, len(first_seen)), pos, item))
+        keep.sort(key=lambda t: t[:3])
+        balanced = [t[3] for t in keep[:top_k]]
+
+        if reranked or fallback:
+            RETRIEVAL_EVENTS.inc(event="reranked" if reranked else "rerank_fallback")
+        stats.update({
+            "candidates": float(len(candidates)),
+            "reranked": 1.0 if reranked else 0.0,
+            "rerank_fallback": 1.0 if fallback else 0.0,
+        })
+        return balanced, stats
+
+    def _rerank_scores(self, question: str, texts: List[str]) -> Optional[List[float]]:
+        """CrossEncoder로 배치 단위 점수 계산. 시간 예산을 넘기거나 실패하면 None."""
+        try:
+            model = self._get_reranker()
+        except Exception:
+            import traceback; traceback.print_exc()
+            return None
+        # 예산은 모델이 준비된 뒤부터(첫 로드 시간으로 매번 폴백되지 않도록)
+        deadline = time.perf_counter() + self.rerank_budget_ms / 1000.0
+        scores: List[float] = []
+        bs = max(self.rerank_batch_size, 1)
+        for i in range(0, len(texts), bs):
+            # 배치 사이에서 예산 확인(배치 중간 중단은 불가)
+            if time.perf_counter() > deadline:
+                return None
+            pairs = [(question, t) for t in texts[i:i+bs]]
+            out = model.predict(pairs, batch_size=bs, show_progress_bar=False)
+            scores.extend(float(x) for x in out)
+        if time.perf_counter() > deadline:
+            return None
+        return scores
 
     def _get_reranker(self) -> CrossEncoder:
         if self._reranker is None:
-            model_name = self.reranker_model or "BAAI/bge-reranker-large"
-            # embedder와 동일 디바이스 선호
-            device = self.embedding_fn._model.device.type if hasattr(self.embedding_fn, "_model") else "cpu"  # type: ignore[attr-defined]
-            self._reranker = CrossEncoder(model_name, device=device)
+            with self._reranker_lock:
+                if self._reranker is None:
+                    # torch/sentence_transformers import는 재랭커를 처음 쓸 때
+                    from sentence_transformers import CrossEncoder
+
+                    model_name = self.reranker_model or "BAAI/bge-reranker-large"
+                    # embedder와 동일 디바이스 사용
+                    self._reranker = CrossEncoder(
+                        model_name,
+                        device=self.device,
+                        max_length=self.rerank_max_length,
+                    )
         return self._reranker
 
 
-__all__ = ["Retriever", "split_text", "RetrievedChunk", "load_config"]
+__all__ = [
+    "Retriever", "split_text", "RetrievedChunk", "load_config", "build_where", "date_num",
+    "distance_to_similarity", "merge_federated",
+]
 
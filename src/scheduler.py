@@ -0,0 +1,242 @@
+# [RAG][generation][scheduler]
+# 역할: LLM 생성 요청 입장 제어(서버 → answer_question_async 앞단). Ollama가 동시에 몇 개만 생성할 수 있으므로
+#   요청을 Ollama 안에 쌓아 모두 타임아웃 나게 두지 않고 프로세스 안에서 줄 세우거나 빠르게 거절.
+# - 모델별 동시 실행 수 제한(max_concurrency, models로 모델별 덮어쓰기).
+# - 우선순위 클래스(classes 순서가 우선순위, 예: interactive > batch)별 대기열 한도.
+#   한도를 넘으면 QueueFull(retry_after) → 서버가 429 + Retry-After로 응답(대기 없이 즉시).
+# - Retry-After 추정: 모델별 생성 시간 EWMA × (앞선 대기 수 + 1) / 동시 실행 수.
+# - 같은 키(답변 캐시 키: 컬렉션·모델·청크 ID·정규화 질문)로 이미 생성 중이면 새로 줄 서지 않고 그 결과를 공유.
+# - 대기열 길이/실행 중 수/대기 시간/거절·합류 수는 /metrics(rag_admission_*)와 snapshot()으로 노출.
+# TODO:
+# - (선택) 낮은 우선순위 기아 방지(aging).
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .llm_guard import canonical_model
+from .metrics import ADMISSION_ACTIVE, ADMISSION_EVENTS, ADMISSION_QUEUE, ADMISSION_WAIT_SECONDS
+
+# 우선순위 클래스 → 대기열 한도(앞쪽이 먼저 실행)
+DEFAULT_CLASSES: Dict[str, int] = {"interactive": 16, "batch": 64}
+
+
+class QueueFull(Exception):
+    """대기열 한도 초과. retry_after(초)는 Retry-After 헤더 값."""
+
+    def __init__(self, model: str, priority: str, retry_after: float) -> None:
+        super().__init__(f"{model} 생성 대기열이 가득 찼습니다({priority}). {retry_after:.0f}초 후 다시 시도하세요.")
+        self.model = model
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """모델 1개의 실행 슬롯 + 우선순위 대기열(heap, 취소된 항목은 꺼낼 때 건너뜀)."""
+
+    def __init__(self, limit: int, classes: Sequence[str]) -> None:
+        self.limit = max(int(limit), 1)
+        self.active = 0
+        self.heap: List[Tuple[int, int, asyncio.Future, str]] = []
+        self.queued: Dict[str, int] = {c: 0 for c in classes}
+        self.service_s = 0.0  # 생성 1건 소요 EWMA(0이면 아직 모름)
+        self.completed = 0
+
+    def waiting(self) -> int:
+        return sum(self.queued.values())
+
+
+class AdmissionScheduler:
+    """모델별 동시성 제한 + 우선순위 대기열 + 동일 요청 합류. 하나의 이벤트 루프 안에서만 사용."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        classes: Optional[Dict[str, int]] = None,
+        models: Optional[Dict[str, int]] = None,
+        default_service_s: float = 10.0,
+        ewma_alpha: float = 0.2,
+    ) -> None:
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.classes: Dict[str, int] = {str(k): int(v) for k, v in (classes or DEFAULT_CLASSES).items()}
+        self.rank = {c: i for i, c in enumerate(self.classes)}
+        self.default_priority = next(iter(self.classes))
+        self.models = {canonical_model(k): int(v) for k, v in (models or {}).items()}
+        self.default_service_s = float(default_service_s)
+        self.ewma_alpha = float(ewma_alpha)
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = itertools.count()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.collapsed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]], default_concurrency: int = 2) -> "AdmissionScheduler":
+        """config.yaml scheduler 섹션으로 생성."""
+        cfg = cfg or {}
+        return cls(
+            max_concurrency=int(cfg.get("max_concurrency") or default_concurrency),
+            classes=cfg.get("classes") or None,
+            models=cfg.get("models") or None,
+            default_service_s=float(cfg.get("default_service_s", 10.0)),
+        )
+
+    def priority(self, name: Optional[str]) -> str:
+        """알 수 없는/빈 우선순위는 가장 높은 클래스로."""
+        return name if name in self.classes else self.default_priority
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(self.models.get(model, self.max_concurrency), list(self.classes))
+        return lane
+
+    def limit(self, model: str) -> int:
+        """모델의 동시 생성 수."""
+        return self._lane(canonical_model(model)).limit
+
+    def retry_after(self, model: str) -> float:
+        """지금 줄을 서면 슬롯을 받기까지 예상 대기(초, 1~300)."""
+        lane = self._lane(canonical_model(model))
+        per = lane.service_s or self.default_service_s
+        return min(max(math.ceil(per * (lane.waiting() + 1) / lane.limit), 1.0), 300.0)
+
+    def check(self, model: str, priority: Optional[str] = None) -> None:
+        """대기열이 가득 찼으면 QueueFull(스트리밍처럼 응답 시작 전에 거절해야 할 때 미리 확인)."""
+        model, priority = canonical_model(model), self.priority(priority)
+        lane = self._lane(model)
+        if lane.active >= lane.limit and lane.queued[priority] >= self.classes[priority]:
+            self._reject(model, priority)
+
+    def _reject(self, model: str, priority: str) -> None:
+        self.rejected += 1
+        ADMISSION_EVENTS.inc(model=model, priority=priority, event="rejected")
+        raise QueueFull(model, priority, self.retry_after(model))
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> AsyncIterator[None]:
+        """생성 슬롯 1개 점유. 대기열이 가득 차면 QueueFull. stats가 있으면 admission_wait_ms 기록."""
+        model, priority = canonical_model(model), self.priority(priority)
+        lane = self._lane(model)
+        t0 = time.perf_counter()
+        if lane.active < lane.limit and not lane.waiting():
+            lane.active += 1
+            ADMISSION_EVENTS.inc(model=model, priority=priority, event="admitted")
+        else:
+            if lane.queued[priority] >= self.classes[priority]:
+                self._reject(model, priority)
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(lane.heap, (self.rank[priority], next(self._seq), fut, priority))
+            lane.queued[priority] += 1
+            ADMISSION_QUEUE.set(lane.queued[priority], model=model, priority=priority)
+            ADMISSION_EVENTS.inc(model=model, priority=priority, event="queued")
+            try:
+                await fut  # _release가 슬롯을 넘겨줄 때까지(active는 넘겨주는 쪽에서 유지)
+            except asyncio.CancelledError:
+                if fut.cancelled():
+                    # 대기 중 취소(클라이언트 종료 등): heap 항목은 꺼낼 때 건너뜀
+                    lane.queued[priority] -= 1
+                    ADMISSION_QUEUE.set(lane.queued[priority], model=model, priority=priority)
+                else:
+                    # 슬롯을 넘겨받은 직후 취소 → 다음 대기자에게 반납
+                    self._release(model, lane)
+                ADMISSION_EVENTS.inc(model=model, priority=priority, event="cancelled")
+                raise
+        waited = time.perf_counter() - t0
+        ADMISSION_WAIT_SECONDS.observe(waited, model=model, priority=priority)
+        ADMISSION_ACTIVE.set(lane.active, model=model)
+        if stats is not None:
+            stats["admission_wait_ms"] = waited * 1000.0
+        t_run = time.perf_counter()
+        try:
+            yield
+        finally:
+            took = time.perf_counter() - t_run
+            lane.service_s = took if not lane.service_s else (1 - self.ewma_alpha) * lane.service_s + self.ewma_alpha * took
+            lane.completed += 1
+            self._release(model, lane)
+
+    def _release(self, model: str, lane: _Lane) -> None:
+        while lane.heap:
+            _, _, fut, priority = heapq.heappop(lane.heap)
+            if fut.cancelled():
+                continue
+            lane.queued[priority] -= 1
+            ADMISSION_QUEUE.set(lane.queued[priority], model=model, priority=priority)
+            fut.set_result(None)
+            return
+        lane.active -= 1
+        ADMISSION_ACTIVE.set(lane.active, model=model)
+
+    async def run(
+        self,
+        model: str,
+        factory: Callable[[], Awaitable[Any]],
+        priority: Optional[str] = None,
+        key: Optional[Hashable] = None,
+        stats: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """슬롯을 받아 factory()를 실행. key가 같은 요청이 이미 실행/대기 중이면 그 결과를 함께 받음(admission_collapsed=1)."""
+        while key is not None and key in self._inflight:
+            leader = self._inflight[key]
+            self.collapsed += 1
+            ADMISSION_EVENTS.inc(model=canonical_model(model), priority=self.priority(priority), event="collapsed")
+            if stats is not None:
+                stats["admission_collapsed"] = 1.0
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if leader.cancelled():
+                    continue  # 선행 요청만 취소됨 → 직접 실행(또는 다음 선행 요청에 합류)
+                raise
+
+        done: Optional[asyncio.Future] = None
+        if key is not None:
+            done = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with self.slot(model, priority, stats):
+                result = await factory()
+        except asyncio.CancelledError:
+            if done is not None:
+                done.cancel()
+            raise
+        except Exception as e:
+            if done is not None:
+                done.set_exception(e)
+                done.exception()  # 합류한 요청이 없어도 "never retrieved" 경고가 나지 않도록
+            raise
+        else:
+            if done is not None:
+                done.set_result(result)
+            return result
+        finally:
+            if key is not None:
+                self._inflight.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """모델별 실행 중/대기(우선순위별)/생성 시간 EWMA + 전체 합류·거절 수(/scheduler_stats)."""
+        return {
+            "classes": dict(self.classes),
+            "collapsed": self.collapsed,
+            "rejected": self.rejected,
+            "inflight_keys": len(self._inflight),
+            "models": {
+                model: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "queued": dict(lane.queued),
+                    "service_ms_ewma": lane.service_s * 1000.0,
+                    "completed": lane.completed,
+                    "retry_after_s": self.retry_after(model),
+                }
+                for model, lane in self._lanes.items()
+            },
+        }
+
+
+__all__ = ["DEFAULT_CLASSES", "QueueFull", "AdmissionScheduler"]
@@ -1,25 +1,100 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, field_validator
 
+from .retriever import date_num
 
-class QueryRequest(BaseModel):
+
+class QueryFilters(BaseModel):
+    """검색 필터(Chroma where/where_document로 변환되어 ANN 단계에서 적용)."""
+    doc_type: Optional[Union[str, List[str]]] = Field(None, description="문서 종류(case | statute | document)")
+    court: Optional[Union[str, List[str]]] = Field(None, description="법원(예: '대법원')")
+    decision_type: Optional[Union[str, List[str]]] = Field(None, description="판결 | 결정 등")
+    date_from: Optional[str] = Field(None, description="선고일 하한(YYYY-MM-DD, 포함)")
+    date_to: Optional[str] = Field(None, description="선고일 상한(YYYY-MM-DD, 포함)")
+    case_no: Optional[Union[str, List[str]]] = Field(None, description="사건번호(예: '2023다250746')")
+    source: Optional[Union[str, List[str]]] = Field(None, description="원본 source 경로")
+    text_contains: Optional[str] = Field(None, description="본문에 반드시 포함될 문자열(where_document)")
+
+    @field_validator("date_from", "date_to")
+    @classmethod
+    def _check_date(cls, v: Optional[str]) -> Optional[str]:
+        # 해석할 수 없는 날짜를 조용히 버리면 필터 없이 검색되므로 422로 거절
+        if v is not None and str(v).strip() and date_num(v) is None:
+            raise ValueError(f"날짜 형식을 해석할 수 없습니다: {v!r} (예: 2020-01-31, 2020-01, 2020, 20200131)")
+        return v
+
+
+# 응답 sources 형식: full(본문 전체) | snippet(앞 snippet_chars자) | ids(ID/점수만, 본문·메타 없음)
+SourceFormat = Literal["full", "snippet", "ids"]
+
+
+class _OutputOptions(BaseModel):
+    """sources 응답 형식 옵션(답변을 돌려주는 요청 모델들이 상속)."""
+    source_format: SourceFormat = Field("full", description="sources 형식(full | snippet | ids). 본문이 필요 없으면 응답 크기/직렬화 시간 절감")
+    snippet_chars: int = Field(200, ge=20, le=4000, description="source_format=snippet일 때 본문 앞부분 길이(문자)")
+
+
+class QueryRequest(_OutputOptions):
     question: str = Field(..., description="사용자 질문")
     top_k: int = Field(5, ge=1, le=50, description="검색 상위 K")
     model: Optional[str] = Field(None, description="LLM 모델 오버라이드(예: 'qwen3:8b')")
+    filters: Optional[QueryFilters] = Field(None, description="메타데이터 필터")
+    include_timings: bool = Field(False, description="true면 응답 timings에 단계별 소요(검색/패킹/LLM/Ollama 통계) 포함")
+    priority: Optional[str] = Field(None, description="생성 대기열 우선순위(interactive | batch, 기본 interactive)")
+
+
+class FederatedQueryRequest(_OutputOptions):
+    question: str = Field(..., description="사용자 질문")
+    collections: Optional[List[str]] = Field(
+        None, min_length=1, description="함께 검색할 컬렉션(기본: config federated.collections → 법령+판례)"
+    )
+    top_k: int = Field(8, ge=1, le=50, description="병합 후 상위 K(컨텍스트에 들어갈 청크 수)")
+    quotas: Optional[Dict[str, int]] = Field(
+        None, description="컬렉션별 최소 보장 청크 수(기본: config federated.min_per_collection)"
+    )
+    model: Optional[str] = Field(None, description="LLM 모델 오버라이드")
+    filters: Optional[QueryFilters] = Field(None, description="모든 컬렉션에 공통 적용할 메타데이터 필터")
+    include_timings: bool = Field(False, description="true면 응답 timings에 컬렉션별 검색/병합/LLM 소요 포함")
+    priority: Optional[str] = Field(None, description="생성 대기열 우선순위(interactive | batch, 기본 interactive)")
 
 
 class Source(BaseModel):
     id: str
-    text: str
+    text: Optional[str] = Field(None, description="source_format=ids면 생략")
     score: Optional[float] = None
     metadata: Optional[Dict[str, Any]] = None
+    collection: Optional[str] = Field(None, description="통합 검색(/query_federated)에서 청크가 나온 컬렉션")
 
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Source]
+    timings: Optional[Dict[str, float]] = Field(
+        None, description="include_timings=true일 때: 단계별 소요(*_ms), 후보 수, 컨텍스트 패킹, Ollama prompt_eval/eval 통계"
+    )
+
+
+class BatchQueryRequest(_OutputOptions):
+    questions: List[str] = Field(..., min_length=1, max_length=1000, description="질문 목록(한 번에 임베딩/검색)")
+    top_k: int = Field(5, ge=1, le=50, description="질문별 검색 상위 K")
+    model: Optional[str] = Field(None, description="LLM 모델 오버라이드(retrieval_only=false일 때)")
+    filters: Optional[QueryFilters] = Field(None, description="모든 질문에 공통 적용할 메타데이터 필터")
+    collection: Optional[str] = Field(None, description="검색 컬렉션(기본: config의 collection_name, 판례: 'cases_kb_m3')")
+    retrieval_only: bool = Field(False, description="true면 LLM 호출 없이 검색 결과만 반환")
+    priority: Optional[str] = Field(None, description="생성 대기열 우선순위(interactive | batch, 기본 batch)")
+
+
+class BatchQueryItem(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    sources: List[Source]
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryItem]
+    timings: Optional[Dict[str, float]] = Field(None, description="배치 임베딩/검색/후처리/생성 소요(ms)")
 
 
 class IngestStats(BaseModel):
@@ -1,51 +1,430 @@
 import os
-from fastapi import FastAPI, HTTPException
-from .schemas import QueryRequest, QueryResponse
-from .retriever import Retriever
-from .llm import answer_question
-from pydantic import BaseModel
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from .schemas import (
+    BatchQueryRequest, BatchQueryResponse, FederatedQueryRequest, QueryFilters, QueryRequest, QueryResponse, _OutputOptions,
+)
+from .retriever import Retriever, RetrievedChunk, merge_federated
+from . import llm
+from .llm import EMPTY_ANSWER, aclose_async_client, answer_question_async, answer_question_stream_async
+from .cache import AnswerCache, read_generation
+from .metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, span
+from .scheduler import AdmissionScheduler, QueueFull
 
-app = FastAPI()
+try:
+    import orjson
+except ImportError:  # orjson이 없으면 표준 json(느리지만 동작)
+    orjson = None
 
+# 하나의 Retriever(=임베딩 모델 1회 로드)가 법령/판례 컬렉션을 모두 서빙.
+# 생성자는 설정만 읽음: 임베딩 모델/컬렉션/재랭커는 백그라운드 예열 또는 첫 요청 때 로드(스레드 안전)
+# → import/포트 바인딩이 모델 로드를 기다리지 않음. 준비 상태는 /readyz.
 RETRIEVER = Retriever("config.yaml")
-CASES_RETRIEVER = Retriever(config_path="config.yaml", collection_name="cases_kb_m3")
+CASES_COLLECTION = "cases_kb_m3"
+STARTED_AT = time.time()
 
-class AskCasesRequest(BaseModel):
+# 통합 검색(/query_federated) 기본 컬렉션과 컬렉션별 최소 보장 청크 수
+_fed_cfg = RETRIEVER.config.get("federated", {}) or {}
+FEDERATED_COLLECTIONS = list(_fed_cfg.get("collections") or [RETRIEVER.collection_name, CASES_COLLECTION])
+FEDERATED_MIN = int(_fed_cfg.get("min_per_collection", 2))
+
+# 임베딩/Chroma 호출 전용 스레드풀: LLM 대기와 분리해 느린 생성이 검색을 굶기지 않도록
+_server_cfg = RETRIEVER.config.get("server", {}) or {}
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(_server_cfg.get("retrieval_workers", 4)),
+    thread_name_prefix="retrieval",
+)
+# 기동 시 검색 구성요소 예열(끄면 첫 요청이 로드 비용을 부담). 환경변수 SERVER_WARMUP=0/1이 우선
+WARMUP_ENABLED = os.environ.get("SERVER_WARMUP", str(_server_cfg.get("warmup", True))).lower() not in ("0", "false", "no")
+WARMUP_STATE: dict = {"state": "pending" if WARMUP_ENABLED else "disabled"}
+# 예열 실패 시 재시도 간격(초): warmup_retry_s부터 2배씩, 최대 300초(성공할 때까지 /readyz는 503)
+WARMUP_RETRY_S = float(_server_cfg.get("warmup_retry_s", 5.0))
+WARMUP_RETRY_MAX_S = 300.0
+# 모델별 num_ctx/keep_alive, 예열 모델 목록(config.yaml llm 섹션)
+llm.configure(RETRIEVER.config.get("llm"))
+# LLM 생성 입장 제어: 모델별 동시 실행 + 우선순위 대기열(가득 차면 429) + 동일 요청 합류
+SCHEDULER = AdmissionScheduler.from_config(RETRIEVER.config.get("scheduler"), default_concurrency=llm.LLM_MAX_CONCURRENCY)
+
+
+def warmup_retrieval() -> None:
+    """임베딩 모델과 서빙 컬렉션(법령/판례/통합 검색)을 미리 로드. RETRIEVAL_EXECUTOR에서 실행."""
+    WARMUP_STATE.update(state="running", attempts=WARMUP_STATE.get("attempts", 0) + 1)
+    WARMUP_STATE.pop("retry_in_s", None)
+    t0 = time.perf_counter()
+    try:
+        timings = RETRIEVER.warmup([RETRIEVER.collection_name, CASES_COLLECTION, *FEDERATED_COLLECTIONS])
+        WARMUP_STATE.update(state="done", timings=timings)
+        WARMUP_STATE.pop("error", None)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        WARMUP_STATE.update(state="failed", error=str(e))
+    WARMUP_STATE["total_ms"] = (time.perf_counter() - t0) * 1000.0
+    print(f"[SERVER] warmup {WARMUP_STATE['state']} ({WARMUP_STATE['total_ms']:.0f}ms)")
+
+
+async def warmup_until_ready() -> None:
+    """예열이 성공할 때까지 백그라운드 재시도(일시적인 벡터스토어/모델 로드 실패로 영구 503이 되지 않도록)."""
+    loop = asyncio.get_running_loop()
+    delay = WARMUP_RETRY_S
+    while True:
+        await loop.run_in_executor(RETRIEVAL_EXECUTOR, warmup_retrieval)
+        if WARMUP_STATE["state"] == "done":
+            return
+        WARMUP_STATE["retry_in_s"] = delay
+        print(f"[SERVER] warmup retry in {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # 예열은 백그라운드로: 모델 로드가 끝나기 전에도 서버는 요청을 받음
+    retrieval_warmup = asyncio.create_task(warmup_until_ready()) if WARMUP_ENABLED else None
+    warmup = asyncio.create_task(llm.warmup_async())
+    yield
+    warmup.cancel()
+    if retrieval_warmup is not None:
+        retrieval_warmup.cancel()
+    await aclose_async_client()
+    RETRIEVAL_EXECUTOR.shutdown(wait=False)
+
+
+def _json_default(obj):
+    if isinstance(obj, RetrievedChunk):
+        return obj.to_dict()
+    if hasattr(obj, "tolist"):  # numpy 스칼라/배열
+        return obj.tolist()
+    raise TypeError(f"JSON으로 직렬화할 수 없는 타입: {type(obj).__name__}")
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        # RetrievedChunk(dataclass)도 _json_default(to_dict)를 거치도록 패스스루
+        return orjson.dumps(content, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS)
+    return json.dumps(content, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """orjson 직렬화. 엔드포인트가 이 응답을 직접 돌려주면 response_model(pydantic) 검증/변환을 건너뜀(스키마 문서용으로만 유지)."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # 경로 파라미터가 없는 API라 url.path를 그대로 라벨로 사용
+        path = request.url.path
+        REQUESTS.inc(path=path, status=str(status))
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, path=path)
+
+
+async def run_retrieval(fn, *args, **kwargs):
+    """블로킹 검색 함수를 RETRIEVAL_EXECUTOR에서 실행."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(RETRIEVAL_EXECUTOR, partial(fn, *args, **kwargs))
+
+_cache_cfg = RETRIEVER.config.get("cache", {}) or {}
+ANSWER_CACHE = AnswerCache(
+    max_entries=int(_cache_cfg.get("answer_max_entries", 512)),
+    ttl_s=float(_cache_cfg.get("answer_ttl_s", 1800)),
+    similarity=float(_cache_cfg.get("answer_similarity", 0.0)),
+)
+
+
+def _generation(collection: str) -> float:
+    # 통합 검색 키("법령+판례")는 구성 컬렉션 중 하나라도 재적재되면 바뀌도록 최댓값
+    return max(read_generation(RETRIEVER.db_path, c) for c in collection.split("+"))
+
+async def _cache_probe(collection: str, question: str, ctx, model_name: str):
+    key = AnswerCache.make_key(collection, model_name, [c.id for c in ctx], question)
+    gen = _generation(collection)
+    # 질문 임베딩은 검색 단계에서 이미 캐시되어 있음(near-dup 조회용)
+    qvec = await run_retrieval(RETRIEVER.embed_query, question) if ANSWER_CACHE.similarity > 0 else None
+    return key, gen, qvec, ANSWER_CACHE.lookup(key, generation=gen, qvec=qvec)
+
+async def cached_answer(collection: str, question: str, ctx, model_name: str, stats=None, priority=None) -> str:
+    """(컬렉션, 모델, 청크 ID, 질문) 키로 답변 캐시 조회 → 미스면 SCHEDULER 슬롯을 받아 LLM 호출 후 저장.
+
+    같은 키로 생성 중인 요청이 있으면 그 결과를 공유. 대기열이 가득 차면 QueueFull(→ 429).
+    stats(dict)를 넘기면 캐시 적중 여부와, 미스일 때 입장 대기(admission_*)·컨텍스트 패킹(context_*)·LLM 단계/Ollama 통계를 채움.
+    """
+    key, gen, qvec, ans = await _cache_probe(collection, question, ctx, model_name)
+    if stats is not None:
+        stats["answer_cached"] = 0.0 if ans is None else 1.0
+    if ans is not None:
+        return ans
+
+    async def generate() -> str:
+        out = await answer_question_async(question, ctx, model_name, stats=stats)
+        if out != EMPTY_ANSWER:  # 실패 응답은 캐시하지 않음
+            ANSWER_CACHE.store(key, out, generation=gen, qvec=qvec)
+        return out
+
+    return await SCHEDULER.run(model_name, generate, priority=priority, key=key, stats=stats)
+
+def _sources(ctx, source_format: str = "full", snippet_chars: int = 200):
+    """응답 sources: full(본문 전체) | snippet(앞부분) | ids(ID/점수만). 본문 문자열은 복사하지 않고 참조."""
+    return [c.to_source(source_format, snippet_chars) for c in ctx]
+
+def _overloaded(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+class AskCasesRequest(_OutputOptions):
     question: str
     model: str | None = None
+    filters: QueryFilters | None = None
+    include_timings: bool = False
+    priority: str | None = None
 
 @app.post("/query", response_model=QueryResponse)
-def query(req: QueryRequest):
+async def query(req: QueryRequest):
     try:
-        ctx = RETRIEVER.query(req.question, top_k=req.top_k or 6)
+        ctx, timings = await run_retrieval(RETRIEVER.query_detailed, req.question, top_k=req.top_k or 6, filters=req.filters)
 
         # 모델명 미입력 시 config 기본값(LLM_DEFAULT)로 폴백
         model_name = (req.model or os.environ.get("LLM_DEFAULT") or "qwen2.5:7b-instruct")
-        ans = answer_question(req.question, ctx, model_name)
+        with span("answer", timings):
+            ans = await cached_answer(RETRIEVER.collection_name, req.question, ctx, model_name, stats=timings, priority=req.priority)
 
-        return {
+        return FastJSONResponse({
             "answer": ans,
-            "sources": ctx,
-        }
+            "sources": _sources(ctx, req.source_format, req.snippet_chars),
+            "timings": timings if req.include_timings else None,
+        })
+    except QueueFull as e:
+        raise _overloaded(e)
     except Exception as e:
         # 콘솔에 전체 스택을 찍고 사용자에겐 간단 메시지
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Server error: {e}")
 
 @app.post("/ask_cases", response_model=QueryResponse)
-def ask_cases(req: AskCasesRequest):
+async def ask_cases(req: AskCasesRequest):
     try:
         # 판례 컬렉션에서만 검색
-        ctx = CASES_RETRIEVER.query(req.question, top_k=6)
+        ctx, timings = await run_retrieval(RETRIEVER.query_detailed, req.question, top_k=6, collection=CASES_COLLECTION, filters=req.filters)
 
         # 모델명 미입력 시 config 기본값 또는 환경변수로 폴백
         model_name = (req.model or os.environ.get("LLM_DEFAULT") or "qwen3:8b")
-        ans = answer_question(req.question, ctx, model_name=model_name)
+        with span("answer", timings):
+            ans = await cached_answer(CASES_COLLECTION, req.question, ctx, model_name, stats=timings, priority=req.priority)
+
+        return FastJSONResponse({
+            "answer": ans,
+            "sources": _sources(ctx, req.source_format, req.snippet_chars),
+            "timings": timings if req.include_timings else None,
+        })
+    except QueueFull as e:
+        raise _overloaded(e)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server error: {e}")
+
+@app.post("/query_federated", response_model=QueryResponse)
+async def query_federated(req: FederatedQueryRequest):
+    """법령+판례 등 여러 컬렉션 통합 검색: 임베딩 1회 → 컬렉션별 동시 검색 → 정규화 점수로 병합 → LLM 1회."""
+    names = list(dict.fromkeys(req.collections or FEDERATED_COLLECTIONS))
+    known = {RETRIEVER.collection_name, CASES_COLLECTION, *FEDERATED_COLLECTIONS}
+    unknown = [n for n in names if n not in known]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown collection: {', '.join(unknown)}")
+    quotas = req.quotas if req.quotas is not None else {n: FEDERATED_MIN for n in names}
+    try:
+        t0 = time.perf_counter()
+        timings: dict = {}
+        with span("embed", timings):
+            qvec = await run_retrieval(RETRIEVER.embed_query, req.question)
+        # 컬렉션 검색(+BM25/재랭킹)은 RETRIEVAL_EXECUTOR에서 동시에
+        results = await asyncio.gather(*(
+            run_retrieval(RETRIEVER.search_detailed, req.question, qvec, top_k=req.top_k, collection=n, filters=req.filters)
+            for n in names
+        ))
+        with span("merge", timings):
+            ctx = merge_federated(dict(zip(names, results)), req.top_k, quotas)
+        for n, (_, st) in zip(names, results):
+            timings.update({f"{n}.{k}": v for k, v in st.items()})
+        timings["retrieval_ms"] = (time.perf_counter() - t0) * 1000.0
+        STAGE_SECONDS.observe(timings["retrieval_ms"] / 1000.0, stage="retrieval")
+
+        model_name = (req.model or os.environ.get("LLM_DEFAULT") or "qwen2.5:7b-instruct")
+        with span("answer", timings):
+            # 캐시 키의 컬렉션은 "법령+판례"처럼 묶어서(세대는 _generation에서 합산)
+            ans = await cached_answer("+".join(names), req.question, ctx, model_name, stats=timings, priority=req.priority)
+        timings["total_ms"] = (time.perf_counter() - t0) * 1000.0
 
-        return {
+        return FastJSONResponse({
             "answer": ans,
-            "sources": ctx,
-        }
+            "sources": _sources(ctx, req.source_format, req.snippet_chars),
+            "timings": timings if req.include_timings else None,
+        })
+    except QueueFull as e:
+        raise _overloaded(e)
     except Exception as e:
         import traceback; traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Server error: {e}")
+
+@app.post("/query_batch", response_model=BatchQueryResponse)
+async def query_batch(req: BatchQueryRequest):
+    """여러 질문을 배치 임베딩 1회 + Chroma 조회 1회로 검색. retrieval_only=false면 질문별 답변도 생성."""
+    collection = req.collection or RETRIEVER.collection_name
+    if collection not in (RETRIEVER.collection_name, CASES_COLLECTION):
+        raise HTTPException(status_code=400, detail=f"unknown collection: {collection}")
+    try:
+        t0 = time.perf_counter()
+        ctxs, timings = await run_retrieval(
+            RETRIEVER.query_many_detailed, req.questions, top_k=req.top_k or 6,
+            collection=collection, filters=req.filters,
+        )
+        answers = [None] * len(ctxs)
+        if not req.retrieval_only:
+            default = "qwen3:8b" if collection == CASES_COLLECTION else "qwen2.5:7b-instruct"
+            model_name = (req.model or os.environ.get("LLM_DEFAULT") or default)
+            # 배치 1건이 대기열을 혼자 채우지 않도록 동시 제출 수를 모델 동시 실행 수로 제한(기본 우선순위 batch)
+            gate = asyncio.Semaphore(SCHEDULER.limit(model_name))
+            priority = req.priority or "batch"
+
+            async def one(q, ctx):
+                async with gate:
+                    return await cached_answer(collection, q, ctx, model_name, priority=priority)
+
+            answers = await asyncio.gather(*(one(q, ctx) for q, ctx in zip(req.questions, ctxs)))
+            timings["generate_ms"] = (time.perf_counter() - t0) * 1000.0 - timings["total_ms"]
+            timings["total_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        return FastJSONResponse({
+            "results": [
+                {"question": q, "answer": a, "sources": _sources(ctx, req.source_format, req.snippet_chars)}
+                for q, a, ctx in zip(req.questions, answers, ctxs)
+            ],
+            "timings": timings,
+        })
+    except QueueFull as e:
+        raise _overloaded(e)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server error: {e}")
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+async def stream_answer(collection: str, question: str, ctx, timings, model_name: str, priority=None,
+                        source_format: str = "full", snippet_chars: int = 200):
+    """SSE 이벤트 순서: sources(검색 결과) → token(답변 조각)* → done(컨텍스트 패킹 통계) | error.
+
+    생성 중에는 SCHEDULER 슬롯을 점유(토큰 스트림은 공유할 수 없어 동일 요청 합류는 하지 않음).
+    """
+    yield _sse("sources", {"sources": _sources(ctx, source_format, snippet_chars), "timings": timings})
+    key, gen, qvec, cached = await _cache_probe(collection, question, ctx, model_name)
+    if cached is not None:
+        yield _sse("token", {"text": cached})
+        yield _sse("done", {"cached": True})
+        return
+    parts, packed = [], {}
+    try:
+        async with SCHEDULER.slot(model_name, priority, packed):
+            async for piece in answer_question_stream_async(question, ctx, model_name, stats=packed):
+                parts.append(piece)
+                yield _sse("token", {"text": piece})
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        yield _sse("error", {"detail": f"Server error: {e}"})
+        return
+    ans = "".join(parts).strip()
+    if ans and ans != EMPTY_ANSWER:
+        ANSWER_CACHE.store(key, ans, generation=gen, qvec=qvec)
+    yield _sse("done", {"cached": False, **packed})
+
+@app.post("/query_stream")
+async def query_stream(req: QueryRequest):
+    model_name = (req.model or os.environ.get("LLM_DEFAULT") or "qwen2.5:7b-instruct")
+    try:
+        # 응답을 시작한 뒤에는 429를 보낼 수 없으므로 대기열 여유를 먼저 확인
+        SCHEDULER.check(model_name, req.priority)
+        ctx, timings = await run_retrieval(RETRIEVER.query_detailed, req.question, top_k=req.top_k or 6, filters=req.filters)
+    except QueueFull as e:
+        raise _overloaded(e)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server error: {e}")
+    return StreamingResponse(
+        stream_answer(RETRIEVER.collection_name, req.question, ctx, timings, model_name, req.priority,
+                      req.source_format, req.snippet_chars),
+        media_type="text/event-stream",
+    )
+
+@app.post("/ask_cases_stream")
+async def ask_cases_stream(req: AskCasesRequest):
+    model_name = (req.model or os.environ.get("LLM_DEFAULT") or "qwen3:8b")
+    try:
+        SCHEDULER.check(model_name, req.priority)
+        ctx, timings = await run_retrieval(RETRIEVER.query_detailed, req.question, top_k=6, collection=CASES_COLLECTION, filters=req.filters)
+    except QueueFull as e:
+        raise _overloaded(e)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server error: {e}")
+    return StreamingResponse(
+        stream_answer(CASES_COLLECTION, req.question, ctx, timings, model_name, req.priority,
+                      req.source_format, req.snippet_chars),
+        media_type="text/event-stream",
+    )
+
+
+@app.get("/healthz")
+def healthz():
+    """생존 확인: 프로세스가 요청을 처리할 수 있으면 200(모델 로드 여부와 무관)."""
+    return {"status": "ok", "uptime_s": round(time.time() - STARTED_AT, 1)}
+
+@app.get("/readyz")
+def readyz():
+    """준비 확인: 예열이 끝났거나(또는 꺼져 있으면) 200, 진행 중/실패(재시도 대기)면 503. 구성요소별 로드 상태 포함."""
+    ready = WARMUP_STATE["state"] in ("done", "disabled")
+    body = {
+        "ready": ready,
+        "warmup": WARMUP_STATE,
+        "retriever": RETRIEVER.components(),
+        "llm": {"client": llm.async_client_open(), "warmup": llm.WARMUP_RESULTS},
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus 텍스트 포맷: 단계별/HTTP/LLM 호출 히스토그램과 카운터."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/llm_stats")
+def llm_stats():
+    """모델별 prefill(prompt_eval)/생성 통계와 예열 결과. prefix_reuse_est로 KV 캐시 재사용 확인."""
+    return {
+        "prompt": llm.PROMPT_STATS.snapshot(),
+        "warmup": llm.WARMUP_RESULTS,
+    }
+
+@app.get("/scheduler_stats")
+def scheduler_stats():
+    """생성 입장 제어 상태: 모델별 실행 중/우선순위별 대기/생성 시간 EWMA/예상 Retry-After, 합류·거절 수."""
+    return SCHEDULER.snapshot()
+
+@app.get("/cache_stats")
+def cache_stats():
+    return {
+        "embedding": RETRIEVER.embed_cache.stats(),
+        "answer": ANSWER_CACHE.stats(),
+    }
@@ -0,0 +1,177 @@
+# [RAG][vectorstore]
+# 역할: 벡터스토어 백엔드 선택(config.yaml vectorstore.provider) + Chroma → local 마이그레이션 도구.
+# - chroma: chromadb.PersistentClient(기존 동작, 경로별 클라이언트 공유).
+# - local: src.local_store(memmap float16/int8 + 전수/IVF 검색, SQLite/HNSW 없음).
+# - 두 백엔드 모두 Chroma Collection과 같은 메서드(add/get/query/update/delete/count)를 가진 컬렉션을 돌려주므로
+#   Retriever/incremental/lexical/dedup 코드는 백엔드를 구분하지 않음.
+#
+# 마이그레이션: python -m src.vectorstore --collections law_kb_m3 cases_kb_m3 --dtype int8
+# TODO:
+# - (선택) local → chroma 역방향 변환.
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+PROVIDERS = ("chroma", "local")
+
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(path: str) -> Any:
+    """경로별 PersistentClient를 프로세스 내에서 공유합니다."""
+    import chromadb
+
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(path)
+        if client is None:
+            client = chromadb.PersistentClient(path=path)
+            _CLIENTS[path] = client
+    return client
+
+
+class VectorStore:
+    """백엔드 공통 인터페이스. get_collection은 Chroma Collection 호환 객체를 반환."""
+
+    provider = ""
+
+    def get_collection(self, name: str, embedding_fn: Optional[Callable[[List[str]], Any]] = None) -> Any:
+        raise NotImplementedError
+
+    def list_collections(self) -> List[str]:
+        raise NotImplementedError
+
+    def delete_collection(self, name: str) -> None:
+        raise NotImplementedError
+
+
+class ChromaStore(VectorStore):
+    provider = "chroma"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.client = get_client(path)
+
+    def get_collection(self, name: str, embedding_fn: Optional[Callable[[List[str]], Any]] = None) -> Any:
+        # 이미 존재하면 가져오고, 없으면 생성
+        try:
+            # chromadb 최신 버전은 get_collection에도 embedding_function 전달 가능
+            return self.client.get_collection(name, embedding_function=embedding_fn)  # type: ignore[call-arg]
+        except Exception:
+            return self.client.create_collection(name=name, embedding_function=embedding_fn)
+
+    def list_collections(self) -> List[str]:
+        # chromadb 0.6+는 이름 목록, 그 이전/1.x 일부는 Collection 객체 목록
+        return [getattr(c, "name", c) for c in self.client.list_collections()]
+
+    def delete_collection(self, name: str) -> None:
+        self.client.delete_collection(name)
+
+
+def open_store(vs_cfg: Optional[Dict[str, Any]] = None) -> VectorStore:
+    """config.yaml의 vectorstore 섹션으로 백엔드 생성."""
+    vs_cfg = vs_cfg or {}
+    provider = str(vs_cfg.get("provider", "chroma")).lower()
+    path = vs_cfg.get("path", "vectorstore")
+    if provider == "chroma":
+        return ChromaStore(path)
+    if provider == "local":
+        from .local_store import LocalStore
+
+        local = vs_cfg.get("local", {}) or {}
+        return LocalStore(
+            path,
+            dtype=str(local.get("dtype", "float16")),
+            ivf_min_rows=int(local.get("ivf_min_rows", 20000)),
+            nprobe=int(local.get("nprobe", 8)),
+            space=str(local.get("space", "cosine")),
+        )
+    raise ValueError(f"알 수 없는 vectorstore.provider: {provider} (가능: {', '.join(PROVIDERS)})")
+
+
+def collection_space(col: Any) -> str:
+    """컬렉션의 거리 공간. local은 space 속성, Chroma 1.x는 configuration_json, 구버전은 metadata["hnsw:space"]."""
+    if isinstance(getattr(col, "space", None), str):
+        return col.space
+    cfg = getattr(col, "configuration_json", None)
+    space = ((cfg or {}).get("hnsw") or {}).get("space") if isinstance(cfg, dict) else None
+    return space or (getattr(col, "metadata", None) or {}).get("hnsw:space") or "l2"
+
+
+def migrate(src: VectorStore, dst: VectorStore, name: str, batch: int = 1000, target: Optional[str] = None) -> int:
+    """src 컬렉션의 ID/본문/메타/임베딩을 그대로 dst로 복사(재임베딩 없음). 반환: 복사한 청크 수."""
+    src_col = src.get_collection(name)
+    dst_col = dst.get_collection(target or name)
+    if hasattr(dst_col, "set_space"):
+        dst_col.set_space(collection_space(src_col))
+    # 배치마다 IVF 재구축/압축하지 않도록 끄고, 끝나면 호출한 쪽에서 build_index
+    if hasattr(dst_col, "auto_maintain"):
+        dst_col.auto_maintain = False
+    copied = 0
+    offset = 0
+    while True:
+        got = src_col.get(include=["documents", "metadatas", "embeddings"], limit=batch, offset=offset)
+        ids = list(got.get("ids") or [])
+        if not ids:
+            break
+        dst_col.add(
+            ids=ids,
+            embeddings=np.asarray(got.get("embeddings"), dtype=np.float32),
+            metadatas=list(got.get("metadatas") or [None] * len(ids)),
+            documents=list(got.get("documents") or [""] * len(ids)),
+        )
+        copied += len(ids)
+        offset += len(ids)
+        print(f"[VS] {name}: {copied} 청크 복사")
+    if hasattr(dst_col, "auto_maintain"):
+        dst_col.auto_maintain = True
+    return copied
+
+
+def main() -> None:
+    from .retriever import load_config
+
+    ap = argparse.ArgumentParser(description="Chroma 컬렉션 → 내장 local 벡터스토어 변환")
+    ap.add_argument("--config", default="config.yaml")
+    ap.add_argument("--collections", nargs="+", default=None, help="변환할 컬렉션(기본: Chroma의 전체 컬렉션)")
+    ap.add_argument("--dtype", choices=["float16", "int8"], default=None, help="기본: config vectorstore.local.dtype")
+    ap.add_argument("--batch", type=int, default=1000)
+    ap.add_argument("--nlist", type=int, default=None, help="IVF 리스트 수(기본 4*sqrt(N))")
+    ap.add_argument("--build-index", action="store_true", help="행 수와 상관없이 IVF 구축")
+    ap.add_argument("--overwrite", action="store_true", help="이미 있는 local 컬렉션을 지우고 다시 변환")
+    args = ap.parse_args()
+
+    vs_cfg = dict(load_config(args.config).get("vectorstore", {}) or {})
+    local_cfg = dict(vs_cfg.get("local", {}) or {})
+    if args.dtype:
+        local_cfg["dtype"] = args.dtype
+    src = open_store({**vs_cfg, "provider": "chroma"})
+    dst = open_store({**vs_cfg, "provider": "local", "local": local_cfg})
+
+    names = args.collections or src.list_collections()
+    for name in names:
+        if name in dst.list_collections():
+            if not args.overwrite:
+                print(f"[VS] {name}: 이미 local에 있음(--overwrite로 다시 변환)")
+                continue
+            dst.delete_collection(name)
+        t0 = time.perf_counter()
+        n = migrate(src, dst, name, batch=args.batch)
+        col = dst.get_collection(name)
+        if n and (args.build_index or col.count() >= col.ivf_min_rows):
+            nlist = col.build_index(nlist=args.nlist)
+            print(f"[VS] {name}: IVF 구축(nlist={nlist})")
+        print(f"[VS] {name}: {n} 청크, dtype={col.dtype}, space={col.space}, {time.perf_counter() - t0:.1f}s")
+    print("config.yaml 의 vectorstore.provider 를 local 로 바꾸면 적용됩니다.")
+
+
+__all__ = ["PROVIDERS", "VectorStore", "ChromaStore", "get_client", "open_store", "collection_space", "migrate"]
+
+
+if __name__ == "__main__":
+    main()